@@ -1,11 +1,116 @@
 #!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to commit the snapshot changes and push them to the repository. The added, modified and
+deleted paths are taken from changes.json that qlik_explore writes in the state directory, so only these paths are
+staged and the snapshot tree is not scanned. Without changes nothing is committed or pushed. If changes.json is not
+available, all changes in the snapshot tree are staged, except for the staging directory of qlik_explore.
+If qlik_explore used the git store, the snapshot has been committed already and only the branch is pushed, also the
+commits of earlier runs that have not been pushed.
+"""
+
 import argparse
 import datetime
 import git
+import json
 import logging
+import os
 from lib import my_env
 from lib.sense_engine_api import init_env
 
+
+def get_group(path):
+    """
+    Return the commit group for the path, as requested with --commit-per: the stream directory for stream, the
+    stream and application directory for app.
+
+    :param path: Path relative to the snapshot directory.
+    :return: Commit group, empty string for one commit per run.
+    """
+    if args.commit_per == 'run':
+        return ''
+    depth = 1 if args.commit_per == 'stream' else 2
+    parts = path.split(os.sep)
+    # Files on a higher level than the group directory (e.g. _changed.txt) are in the group of their directory.
+    return os.sep.join(parts[:min(depth, len(parts) - 1)])
+
+
+def pathspec_file(paths):
+    """
+    Write the paths to a pathspec file in the state directory, to pass any number of paths to git.
+
+    :param paths: List of paths relative to the snapshot directory.
+    :return: Name of the pathspec file.
+    """
+    filename = os.path.join(props['statedir'], 'pathspec.txt')
+    with open(filename, 'w', encoding='utf-8') as fh:
+        fh.write('\0'.join(paths))
+    return filename
+
+
+def stage(changed, deleted):
+    """
+    Stage the changed paths and the deleted paths. The paths are literal paths, not glob patterns: titles may have
+    characters as *, ? and [.
+
+    :param changed: List of added and modified paths.
+    :param deleted: List of deleted paths.
+    :return:
+    """
+    with my_repo.git.custom_environment(GIT_LITERAL_PATHSPECS='1'):
+        if changed:
+            my_repo.git.add('--pathspec-from-file', pathspec_file(changed), '--pathspec-file-nul')
+        if deleted:
+            my_repo.git.rm('--cached', '--quiet', '--ignore-unmatch', '--pathspec-from-file',
+                           pathspec_file(deleted), '--pathspec-file-nul')
+    return
+
+
+def has_staged_changes():
+    """
+    Check if there are staged changes.
+
+    :return: True if the index differs from HEAD, False otherwise.
+    """
+    if not my_repo.head.is_valid():
+        return len(my_repo.index.entries) > 0
+    return len(my_repo.index.diff('HEAD')) > 0
+
+
+def commit(group):
+    """
+    Commit the staged changes, if any.
+
+    :param group: Commit group (stream or application directory), empty string for the full run.
+    :return: True if a commit has been made, False otherwise.
+    """
+    if not has_staged_changes():
+        logging.info(f"No changes to commit{f' for {group}' if group else ''}")
+        return False
+    msg = f"Snapshot from {now}"
+    if group:
+        msg += f" - {group}"
+    res = my_repo.index.commit(msg)
+    logging.info(f"Commit {res.hexsha[:10]}: {msg}")
+    return True
+
+
+def unpushed(branch):
+    """
+    Count the commits on the branch that have not been pushed to origin. All commits of the branch are counted if the
+    branch has not been pushed before.
+
+    :param branch: Branch with the snapshot commits.
+    :return: Number of commits that have not been pushed.
+    """
+    head = f"refs/heads/{branch}"
+    if not my_repo.git.rev_parse('--verify', '--quiet', head, with_exceptions=False):
+        return 0
+    upstream = f"refs/remotes/origin/{branch}"
+    if my_repo.remotes and my_repo.git.rev_parse('--verify', '--quiet', upstream, with_exceptions=False):
+        return int(my_repo.git.rev_list('--count', f"{upstream}..{head}"))
+    return int(my_repo.git.rev_list('--count', head))
+
+
 # Initialize Environment
 projectname = "qlik"
 config = my_env.init_env(projectname, __file__)
@@ -13,23 +118,61 @@ config = my_env.init_env(projectname, __file__)
 parser = argparse.ArgumentParser(description="Specify target environment")
 parser.add_argument('-t', '--target', type=str, default='Remote', choices=['Local', 'Remote'],
                     help='Please provide the target environment (Local, Remote).')
+parser.add_argument('--commit-per', type=str, default='run', choices=['run', 'stream', 'app'],
+                    help='One commit for the run (default), per stream or per application.')
 args = parser.parse_args()
 logging.info("Arguments: {a}".format(a=args))
 props = init_env(args.target)
 workdir = props['workdir']
+changes_file = os.path.join(props['statedir'], 'changes.json')
 
-# Add commit username and password.
-# Print commit result
-# Push
-my_repo = git.Repo(workdir)
-# Don't test on is_dirty, always True 
-# if my_repo.is_dirty(untracked_files=True):
 logging.info("Preparing git update")
-# my_repo.index.add('*')
-my_repo.git.add(all=True)
 now_obj = datetime.datetime.now()
 now = "{now:%d-%m-%Y %H:%M:%S}".format(now=now_obj)
-msg = f"Snapshot from {now}"
-res = my_repo.index.commit(msg)
-my_repo.remotes.origin.push('master')
-logging.info('Push finished')
+try:
+    with open(changes_file, encoding='utf-8') as fh:
+        report = json.load(fh)
+except FileNotFoundError:
+    report = None
+commits = 0
+branch = 'master'
+if report is not None and 'commit' in report:
+    # Snapshot committed by the git store of qlik_explore, push the branch. Commits of earlier runs may not have been
+    # pushed, e.g. if the push failed, so the branch is pushed as long as it is ahead of origin.
+    my_repo = git.Repo(props['gitdir'])
+    branch = props['branch']
+    if report['commit']:
+        logging.info(f"Snapshot committed by qlik_explore: {report['commit']}")
+    else:
+        logging.info("No changes committed by qlik_explore")
+    commits = unpushed(branch)
+    if commits:
+        logging.info(f"{commits} commit(s) on {branch} not pushed yet")
+elif report is None:
+    my_repo = git.Repo(workdir)
+    logging.warning(f"{changes_file} not found, stage all changes in {workdir}")
+    # The staging directory of an interrupted qlik_explore run is not part of the snapshot.
+    my_repo.git.add('--all', '--', '.', f":(exclude){my_env.staging_dir}")
+    commits += commit('')
+else:
+    my_repo = git.Repo(workdir)
+    groups = {}
+    for status in ('added', 'modified', 'deleted'):
+        for path in report[status]:
+            changed, deleted = groups.setdefault(get_group(path), ([], []))
+            (deleted if status == 'deleted' else changed).append(path)
+    logging.info(f"{len(report['added'])} files added, {len(report['modified'])} modified, "
+                 f"{len(report['deleted'])} deleted in {len(groups)} commit group(s)")
+    for group, (changed, deleted) in sorted(groups.items()):
+        stage(changed, deleted)
+        commits += commit(group)
+if commits and not my_repo.remotes:
+    logging.info('No remote repository, no push')
+elif commits:
+    my_repo.remotes.origin.push(branch)
+    logging.info('Push finished')
+else:
+    logging.info('Nothing to commit, no push')
+if report is not None:
+    # The change set has been processed, qlik_explore starts a new one.
+    os.replace(changes_file, os.path.join(props['statedir'], 'changes.committed.json'))
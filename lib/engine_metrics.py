@@ -0,0 +1,186 @@
+"""
+This module collects per-RPC instrumentation for the Engine API layer: for every method and every application the
+number of requests, errors, latency histogram, request size and response size. The EngineSession reports every
+request to the module registry 'metrics'. At the end of a run the registry is dumped as json and in Prometheus text
+exposition format.
+"""
+
+import json
+import os
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets.
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MethodStats:
+    """
+    This class holds the statistics for one method (and one application).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.request_size = 0
+        self.response_size = 0
+        self.response_size_max = 0
+        # Last bucket counts requests slower than the last bound (+Inf).
+        self.buckets = [0] * (len(latency_buckets) + 1)
+        return
+
+    def observe(self, latency, request_size, response_size, error):
+        self.count += 1
+        self.errors += int(error)
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.request_size += request_size
+        self.response_size += response_size
+        self.response_size_max = max(self.response_size_max, response_size)
+        for i, bound in enumerate(latency_buckets):
+            if latency <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        return
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.latency_sum += other.latency_sum
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.request_size += other.request_size
+        self.response_size += other.response_size
+        self.response_size_max = max(self.response_size_max, other.response_size_max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        return
+
+    def to_dict(self):
+        return dict(
+            count=self.count,
+            errors=self.errors,
+            latency_sum=round(self.latency_sum, 6),
+            latency_avg=round(self.latency_sum / self.count, 6) if self.count else 0,
+            latency_max=round(self.latency_max, 6),
+            latency_histogram={str(bound): cnt for bound, cnt in zip(latency_buckets + ('+Inf',), self.buckets)},
+            request_size=self.request_size,
+            response_size=self.response_size,
+            response_size_max=self.response_size_max
+        )
+
+
+class RpcMetrics:
+    """
+    This class is the registry with the statistics per application and method. Sizes are the length of the JSON text
+    of request and response.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+        return
+
+    def observe(self, method, app, latency, request_size, response_size, error=False):
+        """
+        Register a completed request.
+
+        :param method: Engine API method name.
+        :param app: Application ID for the connection, 'global' for the engine connection.
+        :param latency: Time in seconds between sending the request and receiving the reply.
+        :param request_size: Size of the request.
+        :param response_size: Size of the reply.
+        :param error: True if the engine returned an error.
+        :return:
+        """
+        with self.lock:
+            try:
+                stats = self.series[(method, app)]
+            except KeyError:
+                stats = self.series[(method, app)] = MethodStats()
+            stats.observe(latency, request_size, response_size, error)
+        return
+
+    def per_method(self):
+        methods = {}
+        for (method, _), stats in self.series.items():
+            methods.setdefault(method, MethodStats()).merge(stats)
+        return methods
+
+    def to_dict(self):
+        """
+        Return the statistics per method and per application.
+
+        :return: Dictionary with keys methods and apps.
+        """
+        with self.lock:
+            methods = {method: stats.to_dict() for method, stats in sorted(self.per_method().items())}
+            apps = {}
+            for (method, app), stats in sorted(self.series.items(), key=lambda item: (item[0][1], item[0][0])):
+                apps.setdefault(app, {})[method] = stats.to_dict()
+        return dict(methods=methods, apps=apps)
+
+    def to_prometheus(self):
+        """
+        Return the statistics in Prometheus text exposition format. The latency histogram is per method, request
+        counters and latency sums are per method and application.
+
+        :return: String with the metrics.
+        """
+        lines = []
+        with self.lock:
+            methods = self.per_method()
+            lines.append('# HELP qsapi_engine_request_duration_seconds Engine API request latency.')
+            lines.append('# TYPE qsapi_engine_request_duration_seconds histogram')
+            for method, stats in sorted(methods.items()):
+                cumulative = 0
+                for bound, cnt in zip(latency_buckets + ('+Inf',), stats.buckets):
+                    cumulative += cnt
+                    lines.append(f'qsapi_engine_request_duration_seconds_bucket{{method="{method}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'qsapi_engine_request_duration_seconds_sum{{method="{method}"}} {stats.latency_sum}')
+                lines.append(f'qsapi_engine_request_duration_seconds_count{{method="{method}"}} {stats.count}')
+            counters = [
+                ('qsapi_engine_requests_total', 'Engine API requests.', 'count'),
+                ('qsapi_engine_request_errors_total', 'Engine API requests that returned an error.', 'errors'),
+                ('qsapi_engine_request_seconds_total', 'Total Engine API request latency.', 'latency_sum'),
+                ('qsapi_engine_request_size_total', 'Total size of Engine API requests.', 'request_size'),
+                ('qsapi_engine_response_size_total', 'Total size of Engine API responses.', 'response_size'),
+            ]
+            for name, help_text, attrib in counters:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for (method, app), stats in sorted(self.series.items()):
+                    app_label = app.replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append(f'{name}{{method="{method}",app="{app_label}"}} {getattr(stats, attrib)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path, name='rpc_metrics'):
+        """
+        Write the statistics to path as name.json and name.prom.
+
+        :param path: Directory for the metric files.
+        :param name: Filename without extension.
+        :return:
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, f"{name}.json"), 'w', encoding='utf-8') as fh:
+            json.dump(self.to_dict(), fh, indent=2)
+        with open(os.path.join(path, f"{name}.prom"), 'w', encoding='utf-8') as fh:
+            fh.write(self.to_prometheus())
+        return
+
+    def summary(self, top=5):
+        """
+        Return a one line summary with the methods that took the most time.
+
+        :param top: Number of methods in the summary.
+        :return: Summary string.
+        """
+        with self.lock:
+            methods = sorted(self.per_method().items(), key=lambda item: item[1].latency_sum, reverse=True)
+        return ', '.join(f"{method}: {stats.count} calls {stats.latency_sum:.1f}s" for method, stats in methods[:top])
+
+
+metrics = RpcMetrics()
@@ -0,0 +1,479 @@
+"""
+This library simulates the subset of the Qlik Sense Engine JSON-RPC API that is used in sense_engine_api. It serves
+synthetic applications on a local websocket, so exploration and reload can be benchmarked and tested without a
+production engine. Point LOCAL_URI to the simulator, e.g. ws://localhost:4848/app/.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+import websockets
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+
+
+class SiteModel:
+    """
+    This class generates a synthetic Qlik Sense site: streams with applications, every application with sheets, sheet
+    children, master dimensions, master measures and variables. Content is generated from the seed, so the same
+    parameters always give the same site.
+    """
+
+    def __init__(self, streams=2, apps=10, sheets=3, children=5, dimensions=5, measures=5, variables=5, payload=0,
+                 seed=0):
+        """
+        Initialization of the synthetic site.
+
+        :param streams: Number of streams. Applications are spread over the streams.
+        :param apps: Number of applications.
+        :param sheets: Number of sheets per application.
+        :param children: Number of child objects per sheet.
+        :param dimensions: Number of master dimensions per application.
+        :param measures: Number of master measures per application.
+        :param variables: Number of variables per application.
+        :param payload: Number of padding bytes in the property tree of every child object.
+        :param seed: Seed for the generated content.
+        :return:
+        """
+        self.sheets = sheets
+        self.children = children
+        self.dimensions = dimensions
+        self.measures = measures
+        self.variables = variables
+        self.payload = payload
+        self.seed = seed
+        self.streams = [dict(id=self.guid('stream', i), name=f"Stream {i}") for i in range(streams)]
+        base_time = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.docs = {}
+        for i in range(apps):
+            doc_id = self.guid('app', i)
+            stream = self.streams[i % streams] if streams else None
+            modified = (base_time + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            self.docs[doc_id] = dict(
+                qDocName=f"App {i:04d}",
+                qConnectedUsers=0,
+                qFileTime=0,
+                qFileSize=1024 * (i + 1),
+                qDocId=doc_id,
+                qMeta=dict(
+                    createdDate=modified,
+                    modifiedDate=modified,
+                    published=stream is not None,
+                    publishTime=modified,
+                    privileges=['read', 'update', 'delete', 'reload', 'exportdata'],
+                    description='',
+                    stream=stream
+                ),
+                qLastReloadTime=modified,
+                qTitle=f"App {i:04d}",
+                qThumbNail=dict(qUrl='')
+            )
+        self.apps = {}
+        return
+
+    def guid(self, *parts):
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, '/'.join(str(p) for p in (self.seed,) + parts)))
+
+    def doclist(self):
+        return list(self.docs.values())
+
+    def app(self, doc_id):
+        """
+        Return the application model for the doc_id. The application is generated on first use.
+
+        :param doc_id: qDocId of the application.
+        :return: AppModel, or None if the application does not exist.
+        """
+        if doc_id not in self.docs:
+            return None
+        if doc_id not in self.apps:
+            self.apps[doc_id] = AppModel(self, self.docs[doc_id])
+        return self.apps[doc_id]
+
+
+class AppModel:
+    """
+    This class holds the objects of a synthetic application. Objects are dictionaries with qInfo, properties, layout and
+    children.
+    """
+
+    chart_types = ['barchart', 'linechart', 'table', 'kpi', 'piechart', 'text-image', 'filterpane']
+
+    def __init__(self, site, doc):
+        self.doc = doc
+        self.doc_id = doc['qDocId']
+        self.script = f"///$tab Main\nSET ThousandSep='.';\n// {doc['qTitle']}\nLOAD * INLINE [a, b\n1, 2];\n"
+        self.objects = {}
+        self.reload_count = 0
+        self.variable_values = {}
+        rnd = random.Random(self.doc_id)
+        padding = 'x' * site.payload
+        dimension_ids = [site.guid(self.doc_id, 'dimension', i) for i in range(site.dimensions)]
+        measure_ids = [site.guid(self.doc_id, 'measure', i) for i in range(site.measures)]
+        for i, qid in enumerate(dimension_ids):
+            self.add(qid, 'dimension', dict(
+                qInfo=dict(qId=qid, qType='dimension'),
+                qDim=dict(qGrouping='N', qFieldDefs=[f"Field{i}"], qFieldLabels=[''], title=f"Dimension {i}"),
+                qMetaDef=dict(title=f"Dimension {i}", description='', tags=[])
+            ))
+        for i, qid in enumerate(measure_ids):
+            self.add(qid, 'measure', dict(
+                qInfo=dict(qId=qid, qType='measure'),
+                qMeasure=dict(qLabel=f"Measure {i}", qDef=f"Sum(Field{i})", qGrouping='N', qExpressions=[],
+                              qActiveExpression=0),
+                qMetaDef=dict(title=f"Measure {i}", description='', tags=[])
+            ))
+        self.sheet_ids = []
+        for s in range(site.sheets):
+            sheet_id = site.guid(self.doc_id, 'sheet', s)
+            self.sheet_ids.append(sheet_id)
+            child_ids = []
+            for c in range(site.children):
+                child_id = site.guid(self.doc_id, 'sheet', s, 'child', c)
+                child_type = self.chart_types[rnd.randrange(len(self.chart_types))]
+                # Some objects have no title, exploration uses the qId as filename.
+                title = '' if c % 4 == 3 else f"Chart {s}.{c}"
+                properties = dict(
+                    qInfo=dict(qId=child_id, qType=child_type),
+                    visualization=child_type,
+                    title=title,
+                    qHyperCubeDef=dict(
+                        qDimensions=[dict(qLibraryId=rnd.choice(dimension_ids))] if dimension_ids else [],
+                        qMeasures=[dict(qLibraryId=rnd.choice(measure_ids))] if measure_ids else [],
+                        qInitialDataFetch=[dict(qWidth=10, qHeight=50)]
+                    )
+                )
+                if padding:
+                    properties['simPadding'] = padding
+                self.add(child_id, child_type, properties, parent=sheet_id)
+                child_ids.append(child_id)
+            self.add(sheet_id, 'sheet', dict(
+                qInfo=dict(qId=sheet_id, qType='sheet'),
+                qMetaDef=dict(title=f"Sheet {s}", description=''),
+                rank=s,
+                columns=24,
+                rows=12,
+                cells=[dict(name=child_id, col=0, row=0, colspan=12, rowspan=6) for child_id in child_ids],
+                qChildListDef=dict(qData=dict(title='/title'))
+            ), children=child_ids)
+        self.variables = []
+        for v in range(site.variables):
+            qid = site.guid(self.doc_id, 'variable', v)
+            self.variables.append(dict(qName=f"vVariable{v}", qDefinition=f"={v}",
+                                       qInfo=dict(qId=qid, qType='variable'), qData=dict(tags=[])))
+        self.connections = [dict(qId=site.guid(self.doc_id, 'connection'), qName='DataFiles', qType='folder',
+                                 qConnectionString='C:\\Data', qModifiedDate=doc['qMeta']['modifiedDate'])]
+        return
+
+    def add(self, qid, qtype, properties, parent=None, children=None):
+        self.objects[qid] = dict(qType=qtype, properties=properties, parent=parent, children=children or [])
+        return
+
+    def properties(self):
+        return dict(qTitle=self.doc['qTitle'], qLastReloadTime=self.doc['qLastReloadTime'], qHasScript=True,
+                    qThumbNail=dict(qUrl=''), description='')
+
+    def all_infos(self):
+        infos = [dict(qId=qid, qType=obj['qType']) for qid, obj in self.objects.items()]
+        infos.append(dict(qId='AppPropsList', qType='appprops'))
+        return infos
+
+    def full_property_tree(self, qid):
+        obj = self.objects[qid]
+        return dict(
+            qProperty=obj['properties'],
+            qChildren=[self.full_property_tree(child_id) for child_id in obj['children']],
+            qEmbeddedSnapshotRef=None
+        )
+
+    def layout(self, qid):
+        obj = self.objects[qid]
+        props = obj['properties']
+        layout = {key: value for key, value in props.items() if key not in ('qMetaDef', 'qChildListDef')}
+        if obj['qType'] == 'sheet':
+            layout['qMeta'] = dict(title=props['qMetaDef']['title'], privileges=['read', 'update', 'delete'])
+            layout['qSelectionInfo'] = dict()
+            layout['qChildList'] = dict(qItems=[
+                dict(qInfo=dict(qId=child_id, qType=self.objects[child_id]['qType']),
+                     qData=dict(title=self.objects[child_id]['properties']['title']))
+                for child_id in obj['children']
+            ])
+        return layout
+
+    def lists_layout(self):
+        def item(qid):
+            obj = self.objects[qid]
+            title = obj['properties'].get('qMetaDef', {}).get('title', '')
+            return dict(qInfo=dict(qId=qid, qType=obj['qType']), qMeta=dict(title=title), qData=dict(id=qid))
+        return dict(
+            qInfo=dict(qId='AppLists', qType='AppLists'),
+            qAppObjectList=dict(qItems=[item(qid) for qid in self.sheet_ids]),
+            qDimensionList=dict(qItems=[item(qid) for qid, obj in self.objects.items() if obj['qType'] == 'dimension']),
+            qMeasureList=dict(qItems=[item(qid) for qid, obj in self.objects.items() if obj['qType'] == 'measure']),
+            qVariableList=dict(qItems=self.variables)
+        )
+
+
+class EngineError(Exception):
+    """
+    Engine API error that is returned as JSON-RPC error to the client.
+    """
+
+    def __init__(self, code, message, parameter=''):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.parameter = parameter
+
+
+class EngineSimulator:
+    """
+    This class serves the SiteModel on a websocket as Qlik Sense Engine. Every request is handled in its own task after
+    the configured latency, so replies may arrive in another order than the requests, like on the real engine.
+    """
+
+    def __init__(self, site, latency=0.0, jitter=0.0, error_rate=0.0, reload_time=1.0, partial_reload_time=None,
+                 volatile=False, seed=0, hang_rate=0.0):
+        """
+        Initialization of the simulator.
+
+        :param site: SiteModel to serve.
+        :param latency: Response latency in seconds for each request.
+        :param jitter: Random extra latency in seconds, between 0 and jitter.
+        :param error_rate: Fraction of requests (0 - 1) that fail with a simulated engine error.
+        :param reload_time: Duration in seconds of an application reload.
+        :param partial_reload_time: Duration in seconds of a partial reload, default a quarter of reload_time.
+        :param volatile: If set then sheet layouts have runtime content (selection state, data pages) that changes on
+            every request, as layouts of a real engine.
+        :param seed: Seed for latency jitter and errors.
+        :param hang_rate: Fraction of requests (0 - 1) that get no reply until they are cancelled with CancelRequest.
+        :return:
+        """
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.reload_time = reload_time
+        self.partial_reload_time = partial_reload_time if partial_reload_time is not None else reload_time / 4
+        self.volatile = volatile
+        self.random = random.Random(seed)
+        self.reloads = {}
+        self.stats = dict(connections=0, requests=0, errors=0, hangs=0, cancelled=0, bytes_in=0, bytes_out=0,
+                          methods={})
+        return
+
+    async def handler(self, websocket, path=None):
+        """
+        Handle a websocket connection. The application ID is taken from the URI path after /app/.
+
+        :param websocket: Websocket connection.
+        :param path: Request path, for older websockets versions.
+        :return:
+        """
+        if path is None:
+            path = websocket.request.path
+        self.stats['connections'] += 1
+        conn = dict(handles={}, next_handle=2, app=None, cid=self.stats['connections'], hung={},
+                    path_app=unquote(path.split('/app/', 1)[-1]) or None)
+        await websocket.send(json.dumps(dict(jsonrpc='2.0', method='OnConnected',
+                                             params=dict(qSessionState='SESSION_CREATED'))))
+        tasks = set()
+        try:
+            async for msg in websocket:
+                self.stats['requests'] += 1
+                self.stats['bytes_in'] += len(msg)
+                task = asyncio.create_task(self.reply(websocket, conn, json.loads(msg)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        for task in tasks:
+            task.cancel()
+        return
+
+    async def reply(self, websocket, conn, request):
+        method = request['method']
+        self.stats['methods'][method] = self.stats['methods'].get(method, 0) + 1
+        delay = self.latency + self.random.random() * self.jitter
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            if self.hang_rate and method != 'CancelRequest' and self.random.random() < self.hang_rate:
+                # A stuck request, the engine only replies when the request is cancelled.
+                self.stats['hangs'] += 1
+                cancelled = conn['hung'][request['id']] = asyncio.Event()
+                await cancelled.wait()
+                raise EngineError(15, 'Request aborted', method)
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise EngineError(-128, 'Simulated engine error', method)
+            result = await self.dispatch(conn, request)
+            response = dict(jsonrpc='2.0', id=request['id'], result=result)
+        except EngineError as e:
+            self.stats['errors'] += 1
+            response = dict(jsonrpc='2.0', id=request['id'],
+                            error=dict(code=e.code, parameter=e.parameter, message=e.message))
+        msg = json.dumps(response)
+        self.stats['bytes_out'] += len(msg)
+        try:
+            await websocket.send(msg)
+        except websockets.ConnectionClosed:
+            pass
+        return
+
+    def new_handle(self, conn, kind, qid=None, qtype=None):
+        handle = conn['next_handle']
+        conn['next_handle'] += 1
+        conn['handles'][handle] = (kind, qid)
+        return dict(qReturn=dict(qType=qtype or kind, qHandle=handle, qGenericId=qid))
+
+    async def dispatch(self, conn, request):
+        method = request['method']
+        handle = request.get('handle', -1)
+        params = request.get('params') or {}
+        if isinstance(params, list):
+            params = {}
+        app = conn['app']
+        if handle == -1:
+            if method == 'GetDocList':
+                return dict(qDocList=self.site.doclist())
+            elif method == 'OpenDoc':
+                doc_id = params.get('qDocName')
+                app = self.site.app(doc_id)
+                if app is None:
+                    raise EngineError(1002, 'App not found', doc_id)
+                conn['app'] = app
+                conn['handles'][1] = ('doc', doc_id)
+                return dict(qReturn=dict(qType='Doc', qHandle=1, qGenericId=doc_id))
+            elif method == 'GetAuthenticatedUser':
+                return dict(qReturn='UserDirectory=SIM; UserId=simulator')
+            elif method == 'ConfigureReload':
+                return dict()
+            elif method == 'GetProgress':
+                return dict(qProgressData=self.progress((conn['cid'], params.get('qRequestId'))))
+            elif method == 'CancelRequest':
+                job = self.reloads.get((conn['cid'], params.get('qRequestId')))
+                if job is not None:
+                    job['cancel'].set()
+                hung = conn['hung'].pop(params.get('qRequestId'), None)
+                if hung is not None:
+                    self.stats['cancelled'] += 1
+                    hung.set()
+                return dict()
+            raise EngineError(-32601, 'Method not found', method)
+        try:
+            kind, qid = conn['handles'][handle]
+        except KeyError:
+            raise EngineError(-32602, 'Invalid handle', str(handle))
+        if kind == 'doc':
+            return await self.dispatch_doc(conn, app, request['id'], method, params)
+        elif kind == 'applists':
+            if method == 'GetLayout':
+                return dict(qLayout=app.lists_layout())
+        elif kind == 'variable':
+            if method == 'SetStringValue':
+                app.variable_values[qid] = params.get('qVal')
+                return dict()
+        elif kind == 'object':
+            if method == 'GetLayout':
+                layout = app.layout(qid)
+                if self.volatile and app.objects[qid]['qType'] == 'sheet':
+                    rows = self.random.randint(1, 100)
+                    layout['qSelectionInfo'] = dict(qInSelections=self.random.random() < 0.5)
+                    layout['qStateName'] = '$'
+                    layout['qHyperCube'] = dict(qSize=dict(qcx=1, qcy=rows), qDataPages=[
+                        dict(qArea=dict(qLeft=0, qTop=0, qWidth=1, qHeight=rows),
+                             qMatrix=[[dict(qNum=self.random.random())]])])
+                return dict(qLayout=layout)
+            elif method == 'GetFullPropertyTree':
+                return dict(qPropEntry=app.full_property_tree(qid))
+            elif method == 'GetProperties':
+                return dict(qProp=app.objects[qid]['properties'])
+            elif method == 'GetChildInfos':
+                return dict(qInfos=[dict(qId=child_id, qType=app.objects[child_id]['qType'])
+                                    for child_id in app.objects[qid]['children']])
+        raise EngineError(-32601, 'Method not found', method)
+
+    async def dispatch_doc(self, conn, app, request_id, method, params):
+        if method == 'GetAppProperties':
+            return dict(qProp=app.properties())
+        elif method == 'GetAppLayout':
+            return dict(qLayout=dict(app.properties(), qFileSize=app.doc['qFileSize']))
+        elif method == 'GetScript':
+            return dict(qScript=app.script)
+        elif method == 'GetConnections':
+            return dict(qConnections=app.connections)
+        elif method == 'GetAllInfos':
+            return dict(qInfos=app.all_infos())
+        elif method == 'CreateSessionObject':
+            return self.new_handle(conn, 'applists', 'AppLists', 'GenericObject')
+        elif method in ('GetObject', 'GetDimension', 'GetMeasure'):
+            qid = params.get('qId')
+            if qid not in app.objects:
+                raise EngineError(2, 'Object not found', qid)
+            return self.new_handle(conn, 'object', qid, app.objects[qid]['qType'])
+        elif method == 'GetVariableByName':
+            name = params.get('qName')
+            if name not in (variable['qName'] for variable in app.variables):
+                return dict(qReturn=dict(qType=None, qHandle=None, qGenericId=None))
+            return self.new_handle(conn, 'variable', name, 'GenericVariable')
+        elif method == 'DoReload':
+            return await self.do_reload(app, (conn['cid'], request_id), params.get('qPartial', False))
+        elif method == 'DoSave':
+            if any(job['app'] is app and not job['finished'] for job in self.reloads.values()):
+                raise EngineError(11, 'Reload in progress')
+            return dict()
+        raise EngineError(-32601, 'Method not found', method)
+
+    async def do_reload(self, app, job_id, partial=False):
+        duration = self.partial_reload_time if partial else self.reload_time
+        job = dict(app=app, start=time.monotonic(), duration=duration, finished=False, polls=0, cancel=asyncio.Event())
+        self.reloads[job_id] = job
+        try:
+            await asyncio.wait_for(job['cancel'].wait(), timeout=duration)
+        except asyncio.TimeoutError:
+            pass
+        job['finished'] = True
+        if job['cancel'].is_set():
+            raise EngineError(15, 'Request aborted')
+        app.reload_count += 1
+        app.doc['qLastReloadTime'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        return dict(qReturn=True)
+
+    def progress(self, job_id):
+        try:
+            job = self.reloads[job_id]
+        except KeyError:
+            return dict(qFinished=False, qPersistentProgressMessages=[], qTransientProgressMessage={})
+        elapsed = time.monotonic() - job['start']
+        job['polls'] += 1
+        persistent = 'Started loading data' if job['polls'] == 1 else f"Table{job['polls']} << INLINE 2 Lines fetched"
+        transient = {} if job['finished'] else dict(qMessageCode=7, qMessageParameters=[f"{elapsed:.1f}"])
+        return dict(
+            qStarted=True,
+            qFinished=job['finished'],
+            qCompleted=min(int(100 * elapsed / job['duration']), 100) if job['duration'] else 100,
+            qTotal=100,
+            qKB=0,
+            qMillisecs=int(elapsed * 1000),
+            qUserInteractionWanted=False,
+            qPersistentProgress='' if job['finished'] else persistent,
+            qTransientProgress=f"Reload in progress, {elapsed:.1f} s" if not job['finished'] else '',
+            qPersistentProgressMessages=[],
+            qTransientProgressMessage=transient
+        )
+
+    async def serve(self, host='localhost', port=4848):
+        """
+        Start serving on host and port.
+
+        :param host: Hostname or IP address to listen on.
+        :param port: Port to listen on.
+        :return: Websockets server
+        """
+        server = await websockets.serve(self.handler, host, port, max_size=None)
+        logging.info(f"Engine simulator serving {len(self.site.docs)} apps on ws://{host}:{port}/app/")
+        return server
@@ -0,0 +1,68 @@
+"""
+This module splits the applications of a site into shards, so the snapshot can be collected by several qlik_explore
+processes (on one host or on several hosts with a shared work and state directory). An application is assigned to a
+shard by a stable hash of its qDocId or of its stream, so every process calculates the same shards from GetDocList.
+Sharding by stream gives every shard its own stream directories, sharding by qDocId spreads the applications evenly.
+Every shard keeps its manifest, changes report and result in its own state directory. The coordinator
+(qlik_explore_shards) merges the shard results and is the only one that removes content from the snapshot.
+"""
+
+import json
+import os
+import zlib
+
+# Name of the directory in the state directory with the shard state directories.
+shards_dir = 'shards'
+
+
+def parse_shard(value):
+    """
+    Convert the --shard argument K/N into shard number and number of shards.
+
+    :param value: Shard argument, e.g. 2/8. Shards are numbered from 1.
+    :return: Tuple (shard, shards).
+    """
+    try:
+        shard, shards = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value}, expected K/N (e.g. 2/8)")
+    if shards < 1 or not 1 <= shard <= shards:
+        raise ValueError(f"Invalid shard {value}, K must be between 1 and N")
+    return shard, shards
+
+
+def get_shard(doc, shards, shard_by='docid'):
+    """
+    Return the shard for the application.
+
+    :param doc: Application dictionary from the doclist.
+    :param shards: Number of shards.
+    :param shard_by: docid or stream.
+    :return: Shard number, from 1 to shards.
+    """
+    if shard_by == 'stream':
+        stream = doc['qMeta'].get('stream')
+        key = stream['id'] if doc['qMeta'].get('published') and stream else ''
+    else:
+        key = doc['qDocId']
+    return zlib.crc32(key.encode('utf-8')) % shards + 1
+
+
+def get_shard_dir(statedir, shard):
+    return os.path.join(statedir, shards_dir, str(shard))
+
+
+def read_shard_file(statedir, shard, filename):
+    """
+    Read a json file from the state directory of the shard.
+
+    :param statedir: State directory of the run.
+    :param shard: Shard number.
+    :param filename: Name of the file.
+    :return: Content of the file, or None if the shard did not write the file.
+    """
+    try:
+        with open(os.path.join(get_shard_dir(statedir, shard), filename), encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
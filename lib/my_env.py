@@ -4,18 +4,35 @@ setup and initializing the config file.
 Also some application specific utilities find their home here.
 """
 
+import atexit
 import configparser
+import functools
+import hashlib
+import heapq
 import logging
 import logging.handlers
 import json
 import os
 import platform
+import queue
+import shutil
 import sys
 import subprocess
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
 from pathvalidate import sanitize_filename, validate_filepath, validate_filename, ValidationError
 
+# Content up to spool_size bytes is kept in memory, larger content is written to a temporary file while it is encoded.
+spool_size = 1024 * 1024
+# Number of characters that are encoded and written at once.
+write_size = 64 * 1024
+# Temporary files get the permissions of a file created with open.
+umask = os.umask(0)
+os.umask(umask)
+# Directory in the work directory where applications are written before they are swapped in.
+staging_dir = '.staging'
+
 
 def init_env(projectname, filename):
     """
@@ -45,34 +62,78 @@ def get_modulename(scriptname):
     return module
 
 
-def get_valid_path(parent, fn):
+@functools.lru_cache(maxsize=None)
+def get_valid_filename(fn):
+    """
+    This function returns the filename if it is valid, the sanitized filename otherwise. The result is cached for the
+    run, every name is validated only once.
+
+    :param fn: Directory or filename.
+    :return: Valid directory or filename.
+    """
+    try:
+        validate_filename(fn, platform='auto')
+    except ValidationError:
+        return sanitize_filename(fn)
+    return fn
+
+
+@functools.lru_cache(maxsize=None)
+def is_valid_filepath(path):
+    """
+    This function checks if the path is valid. The result is cached for the run.
+
+    :param path: Path to check.
+    :return: Error message if the path is not valid, None otherwise.
+    """
+    try:
+        validate_filepath(path, platform='auto')
+    except ValidationError as e:
+        return str(e)
+    return None
+
+
+def get_valid_path(parent, fn, changes=None, owner=None):
     """
     This function returns a valid path name for the parent path and the directory. It is an os.path.join, with
     additional validation on dir as a valid filename.
     We need to validate the filename, since 'some/name' will validate as a pathname, but needs to validate as filename.
+    If owner is set, the path is claimed for the owner in the ChangeSet: a name that is used by another object in this
+    run gets the owner as suffix.
 
     :param parent: parent directory, this must be a valid directory.
     :param fn: Directory or filename to add to the parent directory.
+    :param changes: ChangeSet for the run, the '_changed.txt' file is written through the ChangeSet.
+    :param owner: Id of the object (e.g. qId) for the directory, to find names that collide.
     :return: a valid parent/subdir path.
     """
-    try:
-        validate_filename(fn, platform='auto')
-    except ValidationError:
-        logging.info(f"Need to sanitize stream {fn} to {sanitize_filename(fn)}")
-        attrib_fn = fn
-        fn = sanitize_filename(fn)
-        if not os.path.isfile(os.path.join(parent, f"{fn}_changed.txt")):
-            with open(os.path.join(parent, f"{fn}_changed.txt"), 'w') as fh:
-                msg = f"Name '{attrib_fn}' changed to '{fn}'"
+    valid_fn = get_valid_filename(fn)
+    if valid_fn != fn:
+        changed_file = os.path.join(parent, f"{valid_fn}_changed.txt")
+        msg = f"Name '{fn}' changed to '{valid_fn}'"
+        if changes is not None:
+            if not changes.is_registered(changed_file):
+                logging.info(f"Need to sanitize {fn} to {valid_fn}")
+                # The parent directory may still be waiting in the write queue.
+                changes.mkdir(parent)
+                if changes.write(changed_file, msg.encode()):
+                    logging.info(msg)
+        elif not os.path.isfile(changed_file):
+            with open(changed_file, 'w') as fh:
                 logging.info(msg)
                 fh.write(msg)
-    return os.path.join(parent, fn)
+    path = os.path.join(parent, valid_fn)
+    if changes is not None and owner is not None:
+        path = changes.claim(path, owner)
+    return path
 
 
 def init_loghandler(modulename):
     """
     This function initializes the loghandler. Logfilename consists of calling module name + computername.
     Format of the logmessage is specified in basicConfig function.
+    Log records are put on a queue, a background thread writes them to the logfile. So logging does not block the
+    asyncio event loop on file I/O.
 
     :param modulename: The name of the module. Each module will create it's own logfile.
     :return: Log Handler
@@ -94,8 +155,12 @@ def init_loghandler(modulename):
     formatter_file = logging.Formatter(fmt=fmt_str, datefmt='%d/%m/%Y|%H:%M:%S')
     # Add Formatter to Rotating File Handler
     rfh.setFormatter(formatter_file)
-    # Add Handler to the logger
-    logger.addHandler(rfh)
+    # Add Handler to the logger through a queue, the listener thread writes the log records.
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, rfh, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
     # Configure Console Handler
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
@@ -116,7 +181,8 @@ def init_loghandler(modulename):
 def get_inifile(projectname):
     """
     Read Project configuration ini file in subdirectory properties. Config ini filename is the projectname.
-    The ini file is located in the properties module, which is sibling of the lib module.
+    The ini file is located in the properties module, which is sibling of the lib module. Environment variable INIFILE
+    overrides the location of the ini file.
     Environment settings defined in .env file are exported as well. The .env file needs to be in the project main
     directory.
 
@@ -130,6 +196,7 @@ def get_inifile(projectname):
     (filepath, _) = os.path.split(filepath_lib)
     # configfile = filepath + "/properties/" + projectname + ".ini"
     configfile = os.path.join(filepath, 'properties', "{p}.ini".format(p=projectname))
+    configfile = os.getenv('INIFILE', configfile)
     ini_config = configparser.ConfigParser()
     try:
         f = open(configfile, encoding='utf-8')
@@ -143,11 +210,11 @@ def get_inifile(projectname):
     return ini_config
 
 
-def dump_structure(struct, path, filename, sort_keys=False):
+def dump_structure(struct, path, filename, sort_keys=False, changes=None, normalize=None):
     """
     This function takes a python structure, dumps it to a json string and saves the result in a file or the specified
-    directory.
-    This function has an attribute 'path_dict'.
+    directory. The file is only written if the content is different from the file on disk. The json text is written
+    while it is encoded, so a large structure is never held as one string.
     Filename/Path validation is done using pathvalidate. This seems a better approach compared to the slugify function.
     Slugify will slug names even if corresponding filename is valid.
 
@@ -155,23 +222,591 @@ def dump_structure(struct, path, filename, sort_keys=False):
     :param path: Path of the resulting file. If path does not exist it will be created.
     :param filename: Filename of the required file.
     :param sort_keys: If set then sort on Keys. Default False.
-    :return:
+    :param changes: ChangeSet for the run, the file is written through the ChangeSet.
+    :param normalize: Function that returns the normalized structure, e.g. lib.snapshot_normalize.Normalizer.
+    :return: True if the file has been written, False if the file did not change.
     """
-    try:
-        validate_filepath(path, platform='auto')
-    except ValidationError as e:
-        logging.critical(f"Invalid path {path}: {e}")
-        return
-    if not os.path.isdir(path):
+    error = is_valid_filepath(path)
+    if error:
+        logging.critical(f"Invalid path {path}: {error}")
+        return False
+    if changes is not None:
+        changes.mkdir(path)
+    elif not os.path.isdir(path):
         os.mkdir(path)
-    struct_str = json.dumps(struct, ensure_ascii=False, indent=2, sort_keys=sort_keys)
+    if normalize is not None:
+        struct = normalize(struct)
+    chunks = json.JSONEncoder(ensure_ascii=False, indent=2, sort_keys=sort_keys).iterencode(struct)
+    filepath = os.path.join(path, get_valid_filename(filename))
+    if changes is not None:
+        return changes.write_chunks(filepath, chunks)
+    status, _, _ = write_chunks(filepath, chunks)
+    return status != 'unchanged'
+
+
+def get_digest(data):
+    """
+    This function calculates the content hash for file data. The hash is the git blob id of the data, so it can be
+    compared with the objects in the snapshot repository.
+
+    :param data: File content as bytes.
+    :return: Hex digest of the content.
+    """
+    digest = hashlib.sha1(f"blob {len(data)}\0".encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def get_file_digest(filepath, size=None):
+    """
+    This function calculates the content hash (git blob id) of a file. The file is read in blocks.
+
+    :param filepath: Full path of the file.
+    :param size: Size of the file in bytes, if known.
+    :return: Hex digest of the content.
+    """
+    if size is None:
+        size = os.path.getsize(filepath)
+    digest = hashlib.sha1(f"blob {size}\0".encode())
+    with open(filepath, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_chunks(chunks):
+    """
+    Generator that encodes text chunks as utf-8 blocks of about write_size characters. Small chunks are combined, a
+    large chunk (e.g. an embedded image) is encoded in parts, so it is never copied as a whole.
+
+    :param chunks: Iterable with text chunks.
+    :return: Blocks of bytes.
+    """
+    parts, chars = [], 0
+    for chunk in chunks:
+        if parts and chars + len(chunk) > write_size:
+            yield ''.join(parts).encode('utf-8')
+            parts, chars = [], 0
+        if len(chunk) > write_size:
+            for pos in range(0, len(chunk), write_size):
+                yield chunk[pos:pos + write_size].encode('utf-8')
+        else:
+            parts.append(chunk)
+            chars += len(chunk)
+    if parts:
+        yield ''.join(parts).encode('utf-8')
+
+
+def spool_chunks(chunks, tmpdir=None):
+    """
+    This function encodes text chunks (e.g. from json.JSONEncoder.iterencode) as utf-8. Content up to spool_size bytes
+    is returned as bytes, larger content is written to a temporary file in tmpdir while it is encoded.
+
+    :param chunks: Iterable with text chunks.
+    :param tmpdir: Directory for the temporary file, default the system temporary directory.
+    :return: Tuple with content (bytes, None for a temporary file), temporary file (None for bytes) and size in bytes.
+    """
+    data, size = [], 0
+    fh, tmp_file = None, None
     try:
-        validate_filename(filename, platform='auto')
-    except ValidationError:
-        filename = sanitize_filename(filename)
-    with open(os.path.join(path, filename), 'w', encoding='utf-8') as fh:
-        fh.write(struct_str)
-    return
+        for block in encode_chunks(chunks):
+            size += len(block)
+            data.append(block)
+            if fh is None and size > spool_size:
+                if tmpdir:
+                    os.makedirs(tmpdir, exist_ok=True)
+                fd, tmp_file = tempfile.mkstemp(dir=tmpdir, suffix='.tmp')
+                os.fchmod(fd, 0o666 & ~umask)
+                fh = os.fdopen(fd, 'wb')
+            if fh is not None:
+                fh.writelines(data)
+                data = []
+        if fh is None:
+            return b''.join(data), None, size
+        fh.close()
+    except BaseException:
+        if fh is not None:
+            fh.close()
+            os.remove(tmp_file)
+        raise
+    return None, tmp_file, size
+
+
+def replace_file(filepath, tmp_file, size):
+    """
+    This function replaces the file in the directory tree by the temporary file, unless the file already has this
+    content. The temporary file is removed.
+
+    :param filepath: Full path of the file.
+    :param tmp_file: Full path of the temporary file, in the directory of the file.
+    :param size: Size of the temporary file in bytes.
+    :return: Tuple with status (added, modified or unchanged) and content hash.
+    """
+    digest = get_file_digest(tmp_file, size)
+    try:
+        if os.path.getsize(filepath) == size:
+            status = 'unchanged' if get_file_digest(filepath, size) == digest else 'modified'
+        else:
+            status = 'modified'
+    except FileNotFoundError:
+        status = 'added'
+    if status == 'unchanged':
+        os.remove(tmp_file)
+    else:
+        os.replace(tmp_file, filepath)
+    return status, digest
+
+
+def write_chunks(filepath, chunks):
+    """
+    This function writes text chunks to the file in the directory tree, unless the file already has this content.
+    Large content is written to a temporary file in the same directory, the file is replaced in one step.
+
+    :param filepath: Full path of the file.
+    :param chunks: Iterable with text chunks.
+    :return: Tuple with status (added, modified or unchanged), content hash and size in bytes.
+    """
+    data, tmp_file, size = spool_chunks(chunks, os.path.dirname(filepath))
+    if data is not None:
+        status, digest = write_file(filepath, data)
+    else:
+        status, digest = replace_file(filepath, tmp_file, size)
+    return status, digest, size
+
+
+def write_if_changed(filepath, data, changes=None):
+    """
+    This function writes data to the file, unless the file already has this content. An unchanged file keeps its
+    modification time, so git does not need to hash it again.
+
+    :param filepath: Full path of the file.
+    :param data: File content as bytes.
+    :param changes: ChangeSet for the run, the file is written through the ChangeSet.
+    :return: True if the file has been written, False if the file did not change.
+    """
+    if changes is not None:
+        return changes.write(filepath, data)
+    status, _ = write_file(filepath, data)
+    return status != 'unchanged'
+
+
+def write_file(filepath, data):
+    """
+    This function writes data to the file in the directory tree, unless the file already has this content.
+
+    :param filepath: Full path of the file.
+    :param data: File content as bytes.
+    :return: Tuple with status (added, modified or unchanged) and content hash.
+    """
+    digest = get_digest(data)
+    try:
+        if os.path.getsize(filepath) == len(data):
+            with open(filepath, 'rb') as fh:
+                status = 'unchanged' if get_digest(fh.read()) == digest else 'modified'
+        else:
+            status = 'modified'
+    except FileNotFoundError:
+        status = 'added'
+    if status == 'modified':
+        # The file can be a hard link to the file in the snapshot (staging), it must not be changed in place.
+        os.remove(filepath)
+    if status != 'unchanged':
+        with open(filepath, 'wb') as fh:
+            fh.write(data)
+    return status, digest
+
+
+class ChangeSet:
+    """
+    This class collects the result for every file in the snapshot during a run: added, modified, unchanged or deleted.
+    Files in the snapshot that have not been registered in the run can be removed with sweep. The report lists the
+    changed paths relative to the work directory.
+    All snapshot file operations go through the ChangeSet, this class stores the snapshot as a directory tree in the
+    work directory. Other snapshot stores (lib.snapshot_store) implement the same methods. Files can be written from
+    several threads (lib.snapshot_writer).
+    An application directory can be staged: the application is written in a staging directory (a hard linked copy of
+    the application directory) and swapped in when it is complete, so a failed or interrupted application never leaves
+    a half written directory. Paths are always the snapshot paths, the ChangeSet writes staged paths to the staging
+    directory.
+    """
+
+    def __init__(self, workdir):
+        """
+        Initialization of the ChangeSet for the snapshot in workdir.
+
+        :param workdir: Work Directory (base) of the snapshot.
+        :return:
+        """
+        self.workdir = workdir
+        self.files = {}
+        # File size by path, for the largest files of the run.
+        self.sizes = {}
+        # Directories that exist, so every directory is created only once in the run.
+        self.created = set()
+        # Owner by path (case-insensitive) of the claimed paths.
+        self.claims = {}
+        # Staged application path -> list of the files registered for the application.
+        self.staged = {}
+        # Staged application path -> staging directory.
+        self.staging = {}
+        self.staging_root = None
+        return
+
+    def is_registered(self, filepath):
+        return os.path.normpath(filepath) in self.files
+
+    def claim(self, path, owner, ext=''):
+        """
+        Claim a path for an object in this run. If the path, compared case-insensitive, has been claimed by another
+        object, the owner is added to the name: 'name (owner)ext'. Objects with the same name (e.g. two sheets with the
+        same title) do not overwrite each other.
+
+        :param path: Full path of the directory or file.
+        :param owner: Id of the object, e.g. qId.
+        :param ext: Extension of the file, the suffix is added before the extension.
+        :return: Path for the object.
+        """
+        key = path.casefold()
+        other = self.claims.setdefault(key, owner)
+        if other == owner:
+            return path
+        base = path[:-len(ext)] if ext and path.endswith(ext) else path
+        unique = f"{base} ({get_valid_filename(str(owner))}){ext}"
+        logging.warning(f"Name collision: {path} is used by {other}, {owner} is written to {unique}")
+        self.claims[unique.casefold()] = owner
+        return unique
+
+    def record(self, filepath, status, digest=None, size=None):
+        """
+        Register the result for a file.
+
+        :param filepath: Full path of the file.
+        :param status: added, modified, unchanged or deleted
+        :param digest: Content hash of the file.
+        :param size: Size of the file in bytes.
+        :return:
+        """
+        filepath = os.path.normpath(filepath)
+        self.files[filepath] = (status, digest)
+        if size is not None:
+            self.sizes[filepath] = size
+        for path, files in list(self.staged.items()):
+            if filepath.startswith(path + os.sep):
+                files.append(filepath)
+        return
+
+    def physical(self, path):
+        """
+        Return the path where the file or directory is written: in the staging directory if the application is staged.
+
+        :param path: Path in the snapshot.
+        :return: Path on disk.
+        """
+        for app_path, stage_dir in list(self.staging.items()):
+            if path == app_path or path.startswith(app_path + os.sep):
+                return stage_dir + path[len(app_path):]
+        return path
+
+    def init_staging(self, name):
+        """
+        Prepare the staging directory of the run. An application swap that has been interrupted is completed first,
+        staging directories of an interrupted run are removed.
+
+        :param name: Name of the staging directory of the process, processes (shards) must have a different name.
+        :return:
+        """
+        self.staging_root = os.path.join(self.workdir, staging_dir, name)
+        if os.path.isdir(self.staging_root):
+            for fn in sorted(os.listdir(self.staging_root)):
+                if fn.endswith('.swap'):
+                    with open(os.path.join(self.staging_root, fn), encoding='utf-8') as fh:
+                        swap = json.load(fh)
+                    if not os.path.exists(swap['path']):
+                        source = swap['stage'] if os.path.isdir(swap['stage']) else swap['old']
+                        logging.warning(f"Swap of {swap['path']} has been interrupted, restore from {source}")
+                        os.rename(source, swap['path'])
+            shutil.rmtree(self.staging_root)
+        os.makedirs(self.staging_root)
+        return
+
+    def close_staging(self):
+        """
+        Remove the staging directory of the run.
+
+        :return:
+        """
+        if self.staging_root is not None:
+            shutil.rmtree(self.staging_root, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(self.staging_root))
+            except OSError:
+                # Other processes (shards) are still staging.
+                pass
+            self.staging_root = None
+        return
+
+    def stage(self, path):
+        """
+        Stage the application directory: the application is written to a staging directory with hard links to the
+        files of the current application directory. Unchanged files keep their modification time.
+
+        :param path: Application directory in the snapshot.
+        :return:
+        """
+        self.staged[path] = []
+        if self.staging_root is None:
+            self.mkdir(path)
+            return
+        stage_dir = tempfile.mkdtemp(dir=self.staging_root)
+        if os.path.isdir(path):
+            shutil.copytree(path, stage_dir, copy_function=os.link, dirs_exist_ok=True)
+        self.staging[path] = stage_dir
+        return
+
+    def commit(self, path):
+        """
+        Swap the staged application directory in. The swap is registered in a journal, so an interrupted swap is
+        completed by init_staging.
+
+        :param path: Application directory in the snapshot.
+        :return: List with the files registered for the application.
+        """
+        files = self.staged.pop(path)
+        stage_dir = self.staging.get(path)
+        if stage_dir is None:
+            return files
+        old_dir = f"{stage_dir}.old"
+        journal = f"{stage_dir}.swap"
+        with open(journal, 'w', encoding='utf-8') as fh:
+            json.dump(dict(path=path, stage=stage_dir, old=old_dir), fh)
+        if os.path.isdir(path):
+            os.rename(path, old_dir)
+        os.rename(stage_dir, path)
+        del self.staging[path]
+        os.remove(journal)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self.created = set(d for d in self.created if not d.startswith(stage_dir))
+        return files
+
+    def discard(self, path):
+        """
+        Discard the staged application, the files of the application directory are kept as they are.
+
+        :param path: Application directory in the snapshot.
+        :return:
+        """
+        files = self.staged.pop(path, [])
+        stage_dir = self.staging.pop(path, None)
+        if stage_dir is not None:
+            for filepath in files:
+                self.files.pop(filepath, None)
+                self.sizes.pop(filepath, None)
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        self.keep(path)
+        return
+
+    def keep(self, path):
+        """
+        Register all files below path as unchanged, so they are not removed by sweep.
+
+        :param path: Directory to keep.
+        :return:
+        """
+        for dirpath, _, filenames in os.walk(path):
+            for fn in filenames:
+                filepath = os.path.normpath(os.path.join(dirpath, fn))
+                if filepath not in self.files:
+                    self.record(filepath, 'unchanged')
+        return
+
+    def keep_file(self, filepath):
+        """
+        Register the file as unchanged if it is in the snapshot, so it is not removed by sweep.
+
+        :param filepath: Full path of the file.
+        :return: True if the file is in the snapshot, False otherwise.
+        """
+        filepath = os.path.normpath(filepath)
+        if filepath in self.files:
+            return self.files[filepath][0] != 'deleted'
+        try:
+            with open(self.physical(filepath), 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return False
+        self.record(filepath, 'unchanged', get_digest(data), len(data))
+        return True
+
+    def largest_files(self, count=10):
+        """
+        Return the largest files of the run.
+
+        :param count: Number of files.
+        :return: List of tuples (path relative to the work directory, size in bytes), largest first.
+        """
+        largest = heapq.nlargest(count, self.sizes.items(), key=lambda item: item[1])
+        return [(os.path.relpath(filepath, self.workdir), size) for filepath, size in largest]
+
+    def write(self, filepath, data):
+        """
+        Write the file, unless the file already has this content, and register the result.
+
+        :param filepath: Full path of the file.
+        :param data: File content as bytes.
+        :return: True if the file has been written, False if the file did not change.
+        """
+        status, digest = write_file(self.physical(filepath), data)
+        self.record(filepath, status, digest, len(data))
+        return status != 'unchanged'
+
+    def write_chunks(self, filepath, chunks):
+        """
+        Write the text chunks to the file, unless the file already has this content, and register the result.
+
+        :param filepath: Full path of the file.
+        :param chunks: Iterable with text chunks, e.g. from json.JSONEncoder.iterencode.
+        :return: True if the file has been written, False if the file did not change.
+        """
+        status, digest, size = write_chunks(self.physical(filepath), chunks)
+        self.record(filepath, status, digest, size)
+        return status != 'unchanged'
+
+    def isdir(self, path):
+        return os.path.isdir(self.physical(path))
+
+    def mkdir(self, path):
+        """
+        Create the directory and its parent directories if they do not exist. Other writer threads or processes
+        (shards) may create the directory at the same time.
+
+        :param path: Directory to create.
+        :return:
+        """
+        path = self.physical(path)
+        if path not in self.created:
+            os.makedirs(path, exist_ok=True)
+            self.created.add(path)
+        return
+
+    def rmdir(self, path):
+        """
+        Remove the directory if it is empty.
+
+        :param path: Directory to remove.
+        :return:
+        """
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+            self.created.discard(path)
+        return
+
+    def close(self, message):
+        """
+        End of the run. The directory tree is complete, git_processing commits the changes.
+
+        :param message: Commit message, not used for the directory tree.
+        :return: None, no commit has been made.
+        """
+        return None
+
+    def remove_tree(self, path):
+        """
+        Remove a directory from the snapshot. All files in the directory are registered as deleted.
+
+        :param path: Directory to remove.
+        :return:
+        """
+        for dirpath, _, filenames in os.walk(path):
+            for fn in filenames:
+                self.record(os.path.join(dirpath, fn), 'deleted')
+        shutil.rmtree(path)
+        self.created = set(d for d in self.created if d != path and not d.startswith(path + os.sep))
+        return
+
+    def sweep(self, path):
+        """
+        Remove all files below path that have not been registered in this run, then remove empty directories. The .git
+        and staging directories are never touched.
+
+        :param path: Directory to clean up.
+        :return:
+        """
+        subdirs = []
+        physical = self.physical(path)
+        for dirpath, dirnames, filenames in os.walk(physical):
+            for skip in ('.git', staging_dir):
+                if skip in dirnames:
+                    dirnames.remove(skip)
+            subdirs.append(dirpath)
+            for fn in filenames:
+                filepath = os.path.normpath(os.path.join(dirpath, fn))
+                snapshot_path = os.path.normpath(os.path.join(path, os.path.relpath(filepath, physical)))
+                if snapshot_path not in self.files:
+                    os.remove(filepath)
+                    self.record(snapshot_path, 'deleted')
+        # Subdirectories are handled before their parent directory.
+        for dirpath in reversed(subdirs[1:]):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+                self.created.discard(dirpath)
+        return
+
+    def sweep_snapshot(self):
+        """
+        Remove all files of the snapshot that have not been registered in this run. Only the stream directories in the
+        work directory are swept, empty stream directories are removed. Files in the work directory (e.g. readme.md or
+        .gitignore of the repository) and directories starting with a dot (.git) are not part of the snapshot.
+
+        :return:
+        """
+        for item in sorted(os.listdir(self.workdir)):
+            path = os.path.join(self.workdir, item)
+            if not item.startswith('.') and os.path.isdir(path):
+                self.sweep(path)
+                self.rmdir(path)
+        return
+
+    def report(self):
+        """
+        Create the changed paths report.
+
+        :return: Dictionary with lists of added, modified and deleted paths and the count of unchanged files.
+        """
+        report = dict(added=[], modified=[], deleted=[])
+        unchanged = 0
+        for filepath, (status, _) in sorted(self.files.items()):
+            if status == 'unchanged':
+                unchanged += 1
+            else:
+                report[status].append(os.path.relpath(filepath, self.workdir))
+        report['unchanged'] = unchanged
+        return report
+
+
+def merge_change_reports(previous, report, workdir):
+    """
+    Merge a changed paths report that has not been processed yet into the report of this run, so no change is lost
+    when the snapshot runs more than once before the changes are committed. The status of this run is used for paths
+    in both reports, other paths of the previous report are modified if they still exist and deleted otherwise.
+
+    :param previous: Changed paths report that has not been processed.
+    :param report: Changed paths report of this run.
+    :param workdir: Work Directory (base) of the snapshot.
+    :return: Merged report.
+    """
+    merged = {status: set(report[status]) for status in ('added', 'modified', 'deleted')}
+    current = set().union(*merged.values())
+    for status in ('added', 'modified', 'deleted'):
+        for path in previous.get(status, []):
+            if path in current:
+                continue
+            if os.path.exists(os.path.join(workdir, path)):
+                merged['added' if status == 'added' else 'modified'].add(path)
+            else:
+                merged['deleted'].add(path)
+    merged = {status: sorted(paths) for status, paths in merged.items()}
+    merged['unchanged'] = report['unchanged']
+    return merged
 
 
 def run_script(path, script_name, *args):
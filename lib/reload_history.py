@@ -0,0 +1,164 @@
+"""
+This module keeps the history of the application reloads started by qlik_reload in a local SQLite database in the
+state directory. Every reload result (app, reload mode, start time, duration, save duration, status and script
+messages) is one row. The history tells when the last full reload of an application was done and how long an
+application usually takes to reload, so the longest reloads can be started first and the end of the batch estimated.
+"""
+
+import json
+import os
+import sqlite3
+import statistics
+from datetime import datetime, timezone
+
+
+class ReloadHistory:
+    """
+    This class handles the reload history database.
+    """
+
+    def __init__(self, filename, window=10):
+        """
+        Open the reload history database, the database is created if it does not exist.
+
+        :param filename: Full path of the database file.
+        :param window: Number of recent successful reloads that are used for the expected duration.
+        :return:
+        """
+        self.filename = filename
+        self.window = window
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS reloads (
+                id INTEGER PRIMARY KEY,
+                app TEXT NOT NULL,
+                doc_id TEXT,
+                mode TEXT NOT NULL,
+                start TEXT NOT NULL,
+                duration REAL,
+                save_duration REAL,
+                status TEXT NOT NULL,
+                slow INTEGER NOT NULL DEFAULT 0,
+                messages TEXT
+            );
+            CREATE INDEX IF NOT EXISTS reloads_app ON reloads (app, mode, status, start);
+        """)
+        return
+
+    def record(self, app, doc_id, mode, start, duration, status, save_duration=None, messages=None, slow=False):
+        """
+        Add a reload result to the history.
+
+        :param app: Application name.
+        :param doc_id: Application ID.
+        :param mode: Reload mode that has been used: full or partial.
+        :param start: Start time of the reload (datetime, UTC).
+        :param duration: Reload duration in seconds.
+        :param status: Reload status: ok, save_failed, failed or timeout.
+        :param save_duration: Save duration in seconds, None if the application has not been saved.
+        :param messages: List of persistent script messages.
+        :param slow: True if the reload was much slower than usual.
+        :return: Reload result dictionary.
+        """
+        result = dict(
+            app=app,
+            doc_id=doc_id,
+            mode=mode,
+            start=start.isoformat(timespec='seconds'),
+            duration=duration,
+            save_duration=save_duration,
+            status=status,
+            slow=int(slow),
+            messages=json.dumps(messages or [], ensure_ascii=False)
+        )
+        with self.conn:
+            self.conn.execute("INSERT INTO reloads (app, doc_id, mode, start, duration, save_duration, status, slow, "
+                              "messages) VALUES (:app, :doc_id, :mode, :start, :duration, :save_duration, :status, "
+                              ":slow, :messages)", result)
+        return result
+
+    def last(self, app, mode=None):
+        """
+        Return the last successful reload of the application.
+
+        :param app: Application name.
+        :param mode: Reload mode (full or partial), None for any mode.
+        :return: Reload result dictionary, or None if there is no successful reload.
+        """
+        row = self.conn.execute("SELECT * FROM reloads WHERE app = ? AND status = 'ok' AND (? IS NULL OR mode = ?) "
+                                "ORDER BY start DESC, id DESC LIMIT 1", (app, mode, mode)).fetchone()
+        return dict(row) if row is not None else None
+
+    def hours_since_full(self, app):
+        """
+        Return the number of hours since the start of the last successful full reload of the application.
+
+        :param app: Application name.
+        :return: Hours since the last full reload, or None if there is no successful full reload.
+        """
+        result = self.last(app, 'full')
+        if result is None:
+            return None
+        start = datetime.fromisoformat(result['start'])
+        return (datetime.now(timezone.utc) - start).total_seconds() / 3600
+
+    def durations(self, app, mode):
+        """
+        Return the durations of the most recent successful reloads of the application in the reload mode.
+
+        :param app: Application name.
+        :param mode: Reload mode: full or partial.
+        :return: List of durations in seconds, most recent first.
+        """
+        rows = self.conn.execute("SELECT duration FROM reloads WHERE app = ? AND mode = ? AND status = 'ok' "
+                                 "ORDER BY start DESC, id DESC LIMIT ?", (app, mode, self.window)).fetchall()
+        return [row['duration'] for row in rows]
+
+    def average_duration(self, app, mode):
+        """
+        Return the average duration of the recent successful reloads of the application in the reload mode.
+
+        :param app: Application name.
+        :param mode: Reload mode: full or partial.
+        :return: Average duration in seconds, or None if there are no successful reloads.
+        """
+        durations = self.durations(app, mode)
+        if not durations:
+            return None
+        return sum(durations) / len(durations)
+
+    def expected_duration(self, app, mode):
+        """
+        Return the expected reload duration: the median of the recent successful reloads. The median is not affected
+        by a single very slow or very fast reload.
+
+        :param app: Application name.
+        :param mode: Reload mode: full or partial.
+        :return: Expected duration in seconds, or None if there are no successful reloads.
+        """
+        durations = self.durations(app, mode)
+        if not durations:
+            return None
+        return statistics.median(durations)
+
+    def is_slow(self, app, mode, duration, factor=2.0, min_reloads=3):
+        """
+        Check if a reload is much slower than the history of the application. Call before the reload is recorded.
+
+        :param app: Application name.
+        :param mode: Reload mode: full or partial.
+        :param duration: Reload duration in seconds.
+        :param factor: Reload is slow if the duration is more than factor times the expected duration.
+        :param min_reloads: Minimum number of successful reloads in the history to compare with.
+        :return: True if the reload is slow, False otherwise.
+        """
+        durations = self.durations(app, mode)
+        if len(durations) < min_reloads:
+            return False
+        return duration > factor * statistics.median(durations)
+
+    def close(self):
+        self.conn.close()
+        return
@@ -0,0 +1,119 @@
+"""
+This module follows an application reload. Reload completion is detected from the reply on the DoReload request, so
+there is no fixed wait time. While the reload runs, GetProgress is polled with a short interval that grows to a
+maximum, and every poll is turned into a structured progress event with the script messages from qProgressData.
+The reload is cancelled when the application deadline or the global deadline is reached.
+"""
+
+import asyncio
+import logging
+import time
+from lib.sense_engine_api import get_progress, cancel_request
+
+
+class ReloadMonitor:
+    """
+    This class monitors the reload for one application.
+    """
+
+    def __init__(self, session, app, deadline=None, min_interval=0.5, max_interval=10.0, backoff=1.5, on_event=None):
+        """
+        Initialization of the reload monitor.
+
+        :param session: Engine session for the application.
+        :param app: Application name, for events and logging.
+        :param deadline: Time (time.monotonic) at which the reload is cancelled, None for no deadline.
+        :param min_interval: First progress poll interval in seconds.
+        :param max_interval: Maximum progress poll interval in seconds.
+        :param backoff: Factor to increase the poll interval after every poll.
+        :param on_event: Function that is called with every progress event dictionary.
+        :return:
+        """
+        self.session = session
+        self.app = app
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.on_event = on_event if on_event is not None else log_event
+        self.messages = []
+        return
+
+    def progress_event(self, start, progress_data):
+        """
+        Convert qProgressData into a progress event. Persistent messages are collected for the reload result.
+
+        :param start: Start time of the reload (time.monotonic).
+        :param progress_data: qProgressData from GetProgress.
+        :return: Progress event dictionary.
+        """
+        persistent = [line for line in progress_data.get('qPersistentProgress', '').splitlines() if line.strip()]
+        self.messages.extend(persistent)
+        event = dict(
+            app=self.app,
+            elapsed=round(time.monotonic() - start, 3),
+            finished=progress_data.get('qFinished', False),
+            completed=progress_data.get('qCompleted'),
+            total=progress_data.get('qTotal'),
+            persistent=persistent,
+            transient=progress_data.get('qTransientProgress', ''),
+            messages=progress_data.get('qPersistentProgressMessages', []),
+            transient_message=progress_data.get('qTransientProgressMessage', {})
+        )
+        return event
+
+    async def wait(self, request_id, reload_future):
+        """
+        Wait for the reload to finish.
+
+        :param request_id: Request id of the DoReload request.
+        :param reload_future: Future for the DoReload reply.
+        :return: Dictionary with status (ok, failed, timeout), duration in seconds and persistent script messages.
+        """
+        start = time.monotonic()
+        interval = self.min_interval
+        while not reload_future.done():
+            timeout = interval
+            if self.deadline is not None:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.error(f"App {self.app} reload did not finish before the deadline, cancel reload.")
+                    await cancel_request(self.session, request_id)
+                    # The engine replies on DoReload with an error once the reload is aborted. Consume the reply, so
+                    # it is not reported as an unhandled exception when the session closes.
+                    reload_future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    await asyncio.wait({reload_future}, timeout=self.max_interval)
+                    return dict(status='timeout', duration=round(time.monotonic() - start, 3),
+                                messages=self.messages)
+                timeout = min(timeout, remaining)
+            await asyncio.wait({reload_future}, timeout=timeout)
+            if reload_future.done():
+                break
+            progress = await get_progress(self.session, request_id)
+            try:
+                self.on_event(self.progress_event(start, progress['qProgressData']))
+            except KeyError:
+                pass
+            interval = min(interval * self.backoff, self.max_interval)
+        duration = round(time.monotonic() - start, 3)
+        reload_json = reload_future.result()
+        try:
+            ok = reload_json['result']['qReturn']
+        except KeyError:
+            logging.error(f"App {self.app} reload failed: {reload_json.get('error')}")
+            ok = False
+        return dict(status='ok' if ok else 'failed', duration=duration, messages=self.messages)
+
+
+def log_event(event):
+    """
+    Default progress event handler: persistent script messages on info level, transient progress on debug level.
+
+    :param event: Progress event dictionary.
+    :return:
+    """
+    for line in event['persistent']:
+        logging.info(f"App {event['app']}: {line}")
+    if event['transient']:
+        logging.debug(f"App {event['app']} ({event['elapsed']}s): {event['transient']}")
+    return
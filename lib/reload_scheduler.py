@@ -0,0 +1,213 @@
+"""
+This module schedules application reloads. Reload dependencies (e.g. extract app -> transform app -> dashboards) are
+read from the ini file. Independent reloads run in parallel up to the concurrency limit, a downstream app starts as
+soon as all its parents have been reloaded and saved. A failure cancels only the dependents of the failed app.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+
+
+def get_dependencies(config, apps):
+    """
+    This function reads the reload dependencies from section ReloadDependencies in the ini file. Every key is an app,
+    the value is the comma separated list of apps that must be reloaded first. App names are matched case insensitive,
+    since the ini file keys are lowercase.
+
+    :param config: ini file handle.
+    :param apps: List of apps to reload.
+    :return: Dictionary with key app and value the set of parent apps.
+    """
+    dependencies = {app: set() for app in apps}
+    try:
+        section = config['ReloadDependencies']
+    except KeyError:
+        return dependencies
+    app_names = {app.lower(): app for app in apps}
+    for key, value in section.items():
+        try:
+            app = app_names[key.strip().lower()]
+        except KeyError:
+            logging.warning(f"Reload dependency for app {key} ignored, app is not in the reload list.")
+            continue
+        for parent in value.split(','):
+            parent = parent.strip()
+            if not parent:
+                continue
+            try:
+                dependencies[app].add(app_names[parent.lower()])
+            except KeyError:
+                logging.warning(f"Parent {parent} for app {app} ignored, parent is not in the reload list.")
+    return dependencies
+
+
+def estimate_duration(apps, dependencies, durations, concurrency=1, priority=None, running=None):
+    """
+    This function estimates the time to reload the apps by simulating the scheduler with the expected reload duration
+    for every app. Parents that are not in the list of apps are considered done.
+
+    :param apps: List of apps that still have to start.
+    :param dependencies: Dictionary with key app and value the set of parent apps.
+    :param durations: Dictionary with key app and value the expected reload duration in seconds.
+    :param concurrency: Maximum number of reloads at the same time.
+    :param priority: Dictionary with key app and value the priority. Default is the position in the list.
+    :param running: Dictionary with key app and value the remaining duration of apps that are reloading now.
+    :return: Estimated duration in seconds.
+    """
+    running = running or {}
+    priority = priority if priority is not None else {app: pos for pos, app in enumerate(apps)}
+    todo = set(apps) | set(running)
+    waiting = [app for app in apps if app not in running]
+    active = [(remaining, app) for app, remaining in running.items()]
+    heapq.heapify(active)
+    done = set()
+    now = 0.0
+    while True:
+        ready = sorted((app for app in waiting if all(p in done or p not in todo for p in dependencies.get(app, ()))),
+                       key=lambda app: priority[app])
+        for app in ready[:max(concurrency - len(active), 0)]:
+            waiting.remove(app)
+            heapq.heappush(active, (now + durations.get(app, 0), app))
+        if not active:
+            return now
+        now, app = heapq.heappop(active)
+        done.add(app)
+
+
+class ReloadScheduler:
+    """
+    This class runs the reloads for a list of apps in dependency order. Ready apps are started in order of priority
+    (lowest value first), by default the order of the reload list.
+    Status of an app is waiting, running, ok, failed or skipped (a parent failed or was skipped).
+    """
+
+    def __init__(self, apps, dependencies, reload_app, concurrency=1, priority=None, on_finished=None):
+        """
+        Initialization of the scheduler. A dependency cycle raises a ValueError.
+
+        :param apps: List of apps to reload.
+        :param dependencies: Dictionary with key app and value the set of parent apps.
+        :param reload_app: Coroutine function with parameter app, returns True if the app has been reloaded and saved.
+        :param concurrency: Maximum number of reloads at the same time.
+        :param priority: Dictionary with key app and value the priority. Default is the position in the list.
+        :param on_finished: Function that is called with the app after every reload, when the status has been updated.
+        :return:
+        """
+        self.apps = apps
+        self.dependencies = {app: set(dependencies.get(app, ())) for app in apps}
+        self.children = {app: set() for app in apps}
+        for app, parents in self.dependencies.items():
+            for parent in parents:
+                self.children[parent].add(app)
+        self.reload_app = reload_app
+        self.concurrency = concurrency
+        self.priority = priority if priority is not None else {app: pos for pos, app in enumerate(apps)}
+        self.status = {app: 'waiting' for app in apps}
+        self.started = {}
+        self.on_finished = on_finished
+        self.check_cycles()
+        return
+
+    def check_cycles(self):
+        visited = set()
+        path = set()
+
+        def visit(app):
+            if app in path:
+                raise ValueError(f"Reload dependency cycle found for app {app}")
+            if app in visited:
+                return
+            path.add(app)
+            for parent in self.dependencies[app]:
+                visit(parent)
+            path.remove(app)
+            visited.add(app)
+
+        for app in self.apps:
+            visit(app)
+        return
+
+    def skip_dependents(self, app):
+        """
+        Mark all dependents (children, grandchildren, ...) of a failed app as skipped.
+
+        :param app: App that failed or was skipped.
+        :return:
+        """
+        for child in self.children[app]:
+            if self.status[child] == 'waiting':
+                logging.error(f"Reload of app {child} cancelled, parent app {app} did not reload.")
+                self.status[child] = 'skipped'
+                self.skip_dependents(child)
+        return
+
+    def queue_ready(self, ready):
+        """
+        Put all waiting apps for which all parents have been reloaded on the ready queue.
+
+        :param ready: Priority queue with apps that can start.
+        :return:
+        """
+        for pos, app in enumerate(self.apps):
+            if self.status[app] == 'waiting' and all(self.status[p] == 'ok' for p in self.dependencies[app]):
+                self.status[app] = 'queued'
+                ready.put_nowait((self.priority[app], pos, app))
+        return
+
+    def finished(self):
+        return all(status in ('ok', 'failed', 'skipped') for status in self.status.values())
+
+    async def worker(self, ready, done):
+        while True:
+            _, _, app = await ready.get()
+            self.status[app] = 'running'
+            self.started[app] = time.monotonic()
+            try:
+                ok = await self.reload_app(app)
+            except Exception as e:
+                logging.exception(f"Reload of app {app} failed: {e}")
+                ok = False
+            self.status[app] = 'ok' if ok else 'failed'
+            if not ok:
+                self.skip_dependents(app)
+            self.queue_ready(ready)
+            if self.on_finished is not None:
+                self.on_finished(app)
+            if self.finished():
+                done.set()
+
+    def estimate_remaining(self, durations):
+        """
+        Estimate the time until all reloads are done, from the apps that did not start yet and the apps that are
+        reloading now.
+
+        :param durations: Dictionary with key app and value the expected reload duration in seconds.
+        :return: Estimated remaining duration in seconds.
+        """
+        now = time.monotonic()
+        waiting = [app for app in self.apps if self.status[app] in ('waiting', 'queued')]
+        running = {app: max(durations.get(app, 0) - (now - self.started[app]), 0)
+                   for app in self.apps if self.status[app] == 'running'}
+        return estimate_duration(waiting, self.dependencies, durations, self.concurrency, self.priority, running)
+
+    async def run(self):
+        """
+        Run all reloads.
+
+        :return: Dictionary with key app and value the final status.
+        """
+        ready = asyncio.PriorityQueue()
+        done = asyncio.Event()
+        self.queue_ready(ready)
+        if self.finished():
+            return self.status
+        workers = [asyncio.create_task(self.worker(ready, done)) for _ in range(self.concurrency)]
+        try:
+            await done.wait()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.status
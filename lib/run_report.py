@@ -0,0 +1,87 @@
+"""
+This module keeps the run report of qlik_explore: the applications that failed or did not finish before their deadline
+and the objects that have been skipped because the engine did not reply before the deadline of the request. Skipped
+applications and objects keep the files of the last snapshot. The report is written as run_report.json in the state
+directory at the end of the run, the coordinator of a sharded run merges the reports of the shards.
+"""
+
+from lib import my_env
+from lib.snapshot_index import get_time
+
+
+class RunReport:
+    """
+    This class collects the failed applications and skipped objects of the run.
+    """
+
+    def __init__(self):
+        self.start = get_time()
+        # Applications with status failed or timeout.
+        self.apps = []
+        # Objects that have been skipped.
+        self.objects = []
+        return
+
+    def add_app(self, doc, status, error):
+        """
+        Register an application that is not in the snapshot of this run.
+
+        :param doc: Application dictionary from the doclist.
+        :param status: failed or timeout.
+        :param error: Error message.
+        :return:
+        """
+        self.apps.append(dict(doc_id=doc['qDocId'], app=doc['qTitle'], status=status, error=str(error)))
+        return
+
+    def add_object(self, doc, qid, qtype, error):
+        """
+        Register an object that has been skipped, because the engine did not reply in time.
+
+        :param doc: Application dictionary from the doclist.
+        :param qid: Id for the object.
+        :param qtype: Object type: sheet, sheet child, dimension or measure.
+        :param error: EngineTimeout for the request.
+        :return:
+        """
+        self.objects.append(dict(doc_id=doc['qDocId'], app=doc['qTitle'], qid=qid, type=qtype,
+                                 method=getattr(error, 'method', None), timeout=getattr(error, 'timeout', None)))
+        return
+
+    def to_dict(self, apps):
+        """
+        Return the report.
+
+        :param apps: Number of applications in scope of the run.
+        :return: Report dictionary.
+        """
+        return dict(
+            start=self.start,
+            end=get_time(),
+            apps=apps,
+            failed=sorted(self.apps, key=lambda app: (app['app'], app['doc_id'])),
+            skipped=sorted(self.objects, key=lambda obj: (obj['app'], obj['doc_id'], obj['type'], obj['qid']))
+        )
+
+    def dump(self, statedir, apps):
+        my_env.dump_structure(self.to_dict(apps), statedir, 'run_report.json')
+        return
+
+
+def merge_run_reports(reports):
+    """
+    Merge the run reports of the shards. Shards without report are not in the merged report.
+
+    :param reports: List with the run report dictionaries of the shards, None for a shard without report.
+    :return: Merged report dictionary.
+    """
+    reports = [report for report in reports if report is not None]
+    merged = dict(start=min((report['start'] for report in reports), default=None),
+                  end=max((report['end'] for report in reports), default=None),
+                  apps=sum(report['apps'] for report in reports), failed=[], skipped=[])
+    for report in reports:
+        merged['failed'].extend(report['failed'])
+        merged['skipped'].extend(report['skipped'])
+    merged['failed'].sort(key=lambda app: (app['app'], app['doc_id']))
+    merged['skipped'].sort(key=lambda obj: (obj['app'], obj['doc_id'], obj['type'], obj['qid']))
+    return merged
@@ -3,56 +3,49 @@ This library consolidates Qlik Sense Engine API methods
 """
 
 import asyncio
+import contextlib
 import json
 import logging
 import os
 import ssl
+import time
 import websockets
 from lib import my_env
+from lib.engine_metrics import metrics
 from urllib.parse import quote
 
 
-async def create_app_objectlist(websocket, sid, handle):
+async def create_app_objectlist(session, handle):
     """
     Create a SessionList containing the App Object List.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return: Handle for the session List
     """
-    session_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='CreateSessionObject',
-        params=[
-            dict(
-                qInfo=dict(qType='AppLists'),
-                qAppObjectListDef=dict(
-                    qType='sheet',
-                    qData=dict(id='/qInfo/qId')
-                ),
-                qDimensionListDef=dict(
-                    qType='dimension',
-                    qData={}
-                ),
-                qMeasureListDef=dict(
-                    qType='measure'
-                ),
-                qVariableListDef=dict(
-                    qType='variable',
-                    qShowReserved=True,
-                    qShowConfig=True,
-                    qData=dict(tags='/tags')
-                )
+    params = [
+        dict(
+            qInfo=dict(qType='AppLists'),
+            qAppObjectListDef=dict(
+                qType='sheet',
+                qData=dict(id='/qInfo/qId')
+            ),
+            qDimensionListDef=dict(
+                qType='dimension',
+                qData={}
+            ),
+            qMeasureListDef=dict(
+                qType='measure'
+            ),
+            qVariableListDef=dict(
+                qType='variable',
+                qShowReserved=True,
+                qShowConfig=True,
+                qData=dict(tags='/tags')
             )
-        ]
-    )
-    await websocket.send(json.dumps(session_object))
-    session_str = await websocket.recv()
-    logging.debug(f"< {session_str}")
-    session_json = json.loads(session_str)
+        )
+    ]
+    session_json = await session.call('CreateSessionObject', handle, params)
     return session_json['result']['qReturn']['qHandle']
 
 
@@ -65,11 +58,54 @@ def init_env(env):
         raise Exception("Unknown Environment, expected Local or Remote")
 
 
+def get_statedir(target):
+    """
+    Function to get the state directory for the target environment. The state directory holds run information (e.g.
+    the snapshot manifest) that must not be part of the snapshot in the work directory.
+    The directory is LOCAL_STATEDIR or REMOTE_STATEDIR, default is subdirectory state_<target> of LOGDIR.
+
+    :param target: Local or Remote
+    :return: State directory
+    """
+    statedir = os.getenv(f"{target.upper()}_STATEDIR")
+    if not statedir:
+        statedir = os.path.join(os.getenv('LOGDIR'), f"state_{target}")
+    return statedir
+
+
+def get_deadlines(config):
+    """
+    Function to get the deadlines in seconds for Engine API requests from section EngineDeadlines of the ini file. Key
+    default is the deadline for all methods, other keys are the deadline for a method (e.g. GetFullPropertyTree).
+    Without the section requests have no deadline.
+
+    :param config: ini file handle.
+    :return: Dictionary with key method name (lowercase) or default and value the deadline in seconds.
+    """
+    if 'EngineDeadlines' not in config:
+        return {}
+    return {key.lower(): float(value) for key, value in config['EngineDeadlines'].items() if value}
+
+
+def get_max_size():
+    """
+    Function to get the maximum size of an engine message in bytes: WS_MAX_SIZE, default no limit. The full property
+    tree of an application with large extensions or images can be far larger than the websockets default (1 MiB).
+
+    :return: Maximum message size, None for no limit.
+    """
+    return int(os.getenv('WS_MAX_SIZE', '0')) or None
+
+
 def init_local():
     local_props = dict(
         target='Local',
         uri=os.getenv('LOCAL_URI'),
-        workdir=os.getenv('LOCAL_WORKDIR')
+        workdir=os.getenv('LOCAL_WORKDIR'),
+        statedir=get_statedir('Local'),
+        gitdir=os.getenv('LOCAL_GITDIR') or os.getenv('LOCAL_WORKDIR'),
+        branch=os.getenv('LOCAL_BRANCH', 'master'),
+        max_size=get_max_size()
     )
     return local_props
 
@@ -89,6 +125,10 @@ def init_remote():
         target='Remote',
         uri=os.getenv('REMOTE_URI'),
         workdir=os.getenv('REMOTE_WORKDIR'),
+        statedir=get_statedir('Remote'),
+        gitdir=os.getenv('REMOTE_GITDIR') or os.getenv('REMOTE_WORKDIR'),
+        branch=os.getenv('REMOTE_BRANCH', 'master'),
+        max_size=get_max_size(),
         headers=headers,
         ssl_context=ssl_context
     )
@@ -107,509 +147,619 @@ def set_connection(app_id=None, **props):
     else:
         uri = props['uri']
     if props['target'] == 'Local':
-        return websockets.connect(uri)
+        return websockets.connect(uri, max_size=props.get('max_size'))
     elif props['target'] == 'Remote':
-        return websockets.connect(uri, ssl=props['ssl_context'], extra_headers=props['headers'])
+        return websockets.connect(uri, ssl=props['ssl_context'], extra_headers=props['headers'],
+                                  max_size=props.get('max_size'))
     else:
         logging.fatal(f"Destination in props['target'] is not defined.")
     return
 
 
-def set_stream_dir(destination, meta, workdir):
+class WireMessage:
+    """
+    Lazy log argument for a message on the wire. The message is only converted to text, and truncated to maxlen
+    characters, when the log record is formatted.
+    """
+
+    __slots__ = ('msg', 'maxlen')
+
+    def __init__(self, msg, maxlen):
+        self.msg = msg
+        self.maxlen = maxlen
+
+    def __str__(self):
+        if self.maxlen <= 0 or len(self.msg) <= self.maxlen:
+            return self.msg
+        return f"{self.msg[:self.maxlen]}... [truncated, {len(self.msg)} characters]"
+
+
+class WireLogger:
+    """
+    This class logs the engine wire traffic on debug level. Nothing is done if debug logging is not enabled. Only one
+    of every WIRE_LOG_SAMPLE messages is logged (default 1: all messages) and messages are truncated to WIRE_LOG_MAXLEN
+    characters (default 2000, 0 for no truncation). Settings are read on first use, after the .env file is loaded.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('qsapi.wire')
+        self.sample = None
+        self.maxlen = None
+        self.count = 0
+        return
+
+    def log(self, direction, msg):
+        """
+        Log a message.
+
+        :param direction: '>' for requests, '<' for replies and notifications.
+        :param msg: Message text.
+        :return:
+        """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        if self.sample is None:
+            self.sample = max(int(os.getenv('WIRE_LOG_SAMPLE', '1')), 1)
+            self.maxlen = int(os.getenv('WIRE_LOG_MAXLEN', '2000'))
+        self.count += 1
+        if self.count % self.sample == 0:
+            self.logger.debug("%s %s", direction, WireMessage(msg, self.maxlen), stacklevel=2)
+        return
+
+
+wire_log = WireLogger()
+
+
+class EngineTimeout(asyncio.TimeoutError):
+    """
+    The engine did not reply on a request before its deadline. The request has been cancelled on the engine.
+    """
+
+    def __init__(self, method, app, timeout):
+        super().__init__(f"{method} on {app} did not reply within {timeout:g} seconds")
+        self.method = method
+        self.app = app
+        self.timeout = timeout
+        return
+
+
+class EngineSession:
+    """
+    This class handles the JSON-RPC traffic on a websocket connection to the engine. Requests are sent without waiting
+    for the reply of the previous request, so many requests can be in flight on the same websocket. A reader task
+    routes each reply to the request with the same JSON-RPC id. The session owns the request id counter.
+    Latency and size of every request are registered in the engine metrics per method and application.
+    A request that does not get a reply before the deadline of its method is cancelled on the engine.
+    """
+
+    def __init__(self, websocket, app='global', deadlines=None):
+        """
+        Initialization of the session on an open websocket connection.
+
+        :param websocket: Websocket connection to the engine.
+        :param app: Application ID for the connection, used in the engine metrics.
+        :param deadlines: Dictionary with key method name (lowercase) or default and value the deadline in seconds,
+            see get_deadlines.
+        :return:
+        """
+        self.websocket = websocket
+        self.app = app
+        self.deadlines = deadlines or {}
+        self.sid = 0
+        self.pending = {}
+        self.connected = asyncio.Event()
+        self.closed = None
+        self.reader = None
+        return
+
+    async def __aenter__(self):
+        self.reader = asyncio.create_task(self.read_loop())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.reader.cancel()
+        try:
+            await self.reader
+        except asyncio.CancelledError:
+            pass
+        self.close_pending(ConnectionError("Engine session closed"))
+        return False
+
+    async def read_loop(self):
+        """
+        Read all messages from the websocket. Replies are handed to the future waiting for the request id, messages
+        without id are engine notifications (e.g. OnConnected). If the connection closes or a message cannot be
+        handled, all waiting requests fail with the error, so no request waits for a reply that will never be routed.
+
+        :return:
+        """
+        try:
+            async for msg in self.websocket:
+                wire_log.log('<', msg)
+                self.connected.set()
+                msg_json = json.loads(msg)
+                response_size = len(msg)
+                # Do not hold the text of a large reply while waiting for the next message.
+                del msg
+                try:
+                    future, method, start, request_size = self.pending.pop(msg_json['id'])
+                except KeyError:
+                    continue
+                metrics.observe(method, self.app, time.perf_counter() - start, request_size, response_size,
+                                error='error' in msg_json)
+                if not future.done():
+                    future.set_result(msg_json)
+        except websockets.ConnectionClosed as e:
+            self.close_pending(e)
+            return
+        except Exception as e:
+            logging.error(f"Engine session {self.app}: reader stopped, {type(e).__name__}: {e}")
+            self.close_pending(e)
+            return
+        self.close_pending(ConnectionError("Engine connection closed"))
+        return
+
+    def close_pending(self, exc):
+        """
+        Fail all requests that are still waiting for a reply. New requests on the session will fail as well.
+
+        :param exc: Exception to set on the waiting requests.
+        :return:
+        """
+        self.closed = exc
+        self.connected.set()
+        pending, self.pending = self.pending, {}
+        for future, *_ in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        return
+
+    async def submit(self, method, handle=-1, params=None):
+        """
+        Send a request to the engine without waiting for the reply.
+
+        :param method: Engine API method name.
+        :param handle: Handle of the object on which the method is called, -1 for the Global class.
+        :param params: Parameters for the method, list or dictionary.
+        :return: Tuple with request id and future that will hold the reply dictionary.
+        """
+        if self.closed:
+            raise self.closed
+        self.sid += 1
+        request_id = self.sid
+        future = asyncio.get_running_loop().create_future()
+        request = dict(
+            jsonrpc='2.0',
+            id=request_id,
+            handle=handle,
+            method=method,
+            params=[] if params is None else params
+        )
+        request_str = json.dumps(request)
+        self.pending[request_id] = (future, method, time.perf_counter(), len(request_str))
+        wire_log.log('>', request_str)
+        try:
+            await self.websocket.send(request_str)
+        except websockets.ConnectionClosed:
+            self.pending.pop(request_id, None)
+            raise
+        return request_id, future
+
+    async def call(self, method, handle=-1, params=None, timeout=None):
+        """
+        Send a request to the engine and wait for the reply. If there is no reply before the deadline, the request is
+        cancelled and EngineTimeout is raised.
+
+        :param method: Engine API method name.
+        :param handle: Handle of the object on which the method is called, -1 for the Global class.
+        :param params: Parameters for the method, list or dictionary.
+        :param timeout: Deadline in seconds, default the deadline for the method of the session.
+        :return: Reply dictionary.
+        """
+        request_id, future = await self.submit(method, handle, params)
+        if timeout is None:
+            timeout = self.deadlines.get(method.lower(), self.deadlines.get('default'))
+        if timeout is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            await self.cancel(request_id)
+            raise EngineTimeout(method, self.app, timeout)
+
+    async def cancel(self, request_id):
+        """
+        Stop waiting for a request and send CancelRequest for it, so the engine stops working on it. The request is
+        registered as an error in the engine metrics. The reply on CancelRequest is not awaited.
+
+        :param request_id: Request id of the request to cancel.
+        :return:
+        """
+        try:
+            future, method, start, request_size = self.pending.pop(request_id)
+        except KeyError:
+            return
+        metrics.observe(method, self.app, time.perf_counter() - start, request_size, 0, error=True)
+        if not future.done():
+            future.cancel()
+        if self.closed:
+            return
+        try:
+            _, cancel_future = await self.submit('CancelRequest', -1, dict(qRequestId=request_id))
+        except websockets.ConnectionClosed:
+            return
+        # Consume the reply, so a session that closes first is not reported as an unhandled exception.
+        cancel_future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return
+
+
+@contextlib.asynccontextmanager
+async def open_session(app_id=None, **props):
+    """
+    Async context manager that opens the websocket connection and returns the engine session on it. The session is
+    returned once the engine sent its first message (OnConnected notification). Request deadlines are in
+    props['deadlines'], see get_deadlines.
+
+    :param app_id: Application ID, to be attached to the URI
+    :param props: Dictionary with properties required for the connection.
+    :return: EngineSession
+    """
+    async with set_connection(app_id, **props) as websocket:
+        async with EngineSession(websocket, app_id or 'global', props.get('deadlines')) as session:
+            await session.connected.wait()
+            yield session
+
+
+def set_stream_dir(destination, meta, workdir, changes=None):
     """
     Function to calculate the stream directory for the application. If the directory does not exist, it will be created.
     If application is published then the name of the stream is the subdirectory where to publish the application
-    information. If application is local or not published, then stream is called 'Work'.
+    information. If application is local or not published, then stream is called 'Work'. Streams with the same name get
+    their own directory, the directory is claimed for the stream id in the ChangeSet.
 
     :param destination: Destination for query engine: Local (Desktop) or Remote
     :param meta: Application meta directory
     :param workdir: Work Directory (base) for the environment
+    :param changes: ChangeSet for the run
     :return: stream directory
     """
-    stream = 'Work'
+    stream = stream_id = 'Work'
     if destination == 'Remote' and meta['published']:
         stream = meta['stream']['name']
+        stream_id = meta['stream']['id']
     # Stream_dir is guaranteed valid.
-    stream_dir = my_env.get_valid_path(workdir, stream)
+    stream_dir = my_env.get_valid_path(workdir, stream, changes, stream_id)
     logging.debug(f"Collecting info for stream {stream} into {stream_dir}")
-    if not os.path.isdir(stream_dir):
+    if changes is not None:
+        changes.mkdir(stream_dir)
+    elif not os.path.isdir(stream_dir):
         os.mkdir(stream_dir)
     return stream_dir
 
 
-async def configure_reload(websocket, sid):
+async def cancel_request(session, request_id):
+    """
+    This method cancels a request that is in progress on the engine, e.g. a DoReload request.
+
+    :param session: Engine session for the connection
+    :param request_id: Request ID of the request to cancel
+    :return:
+    """
+    await session.call('CancelRequest', -1, dict(qRequestId=request_id))
+    return
+
+
+async def configure_reload(session):
     """
     This method runs a Configure Reload setting for the engine. It should run before the
     DoReload method.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :return: Handle for the dimension
     """
     # Runs on engine so handle is -1.
-    reload_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=-1,
-        method='ConfigureReload',
-        params=dict(
-            qCancelOnScriptError=False,
-            qUseErrorData=True,
-            qInteractOnError=False
-        )
+    params = dict(
+        qCancelOnScriptError=False,
+        qUseErrorData=True,
+        qInteractOnError=False
     )
-    await websocket.send(json.dumps(reload_object))
-    reload_str = await websocket.recv()
-    logging.debug(f"< {reload_str}")
+    await session.call('ConfigureReload', -1, params)
     return
 
 
-async def do_reload(websocket, sid, handle):
+async def start_reload(session, handle, partial=False, mode=0, debug=False):
+    """
+    This method sends the DoReload request for the application, but does not wait for the reply. The request id can
+    be used to follow the reload with get_progress.
+
+    :param session: Engine session for the connection
+    :param handle: Handle for the Application
+    :param partial: Set to True for a partial reload.
+    :param mode: Error handling mode: 0 default, 1 attempt recovery on all errors, 2 fail on all errors.
+    :param debug: Set to True to run the reload in debug mode.
+    :return: Tuple with request id and future for the reload reply
+    """
+    params = dict(
+        qMode=mode,
+        qPartial=partial,
+        qDebug=debug,
+    )
+    return await session.submit('DoReload', handle, params)
+
+
+async def do_reload(session, handle, partial=False, timeout=None):
     """
     This method runs a reload for the application. Remember to run a get_app_layout after do_reload to commit the
-    changes.
+    changes. A reload that does not finish within timeout seconds is cancelled and EngineTimeout is raised.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
+    :param partial: Set to True for a partial reload.
+    :param timeout: Deadline for the reload in seconds, None for no deadline.
     :return: Handle for the dimension
     """
-    reload_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='DoReload',
-        params=dict(
-            qMode=0,
-            qPartial=False,
-            qDebug=False,
-        )
-    )
-    await websocket.send(json.dumps(reload_object))
-    reload_str = await websocket.recv()
-    logging.debug(f"< {reload_str}")
-    reload_json = json.loads(reload_str)
+    request_id, future = await start_reload(session, handle, partial=partial)
+    try:
+        reload_json = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        await session.cancel(request_id)
+        raise EngineTimeout('DoReload', session.app, timeout)
     try:
         return reload_json['result']
     except KeyError:
         return False
 
 
-async def do_save(websocket, sid, handle):
+async def do_save(session, handle, attempts=5, delay=2.0, max_delay=30.0):
     """
     This method runs a save for the application. This should be done after a get_app_layout to ensure that changes have
     been committed.
-    Even if get progress status is finished, do_save may fail if index rebuild is ongoing.
+    Even if get progress status is finished, do_save may fail if index rebuild is ongoing. In that case the save is
+    retried, with a wait time that doubles after every attempt, for at most attempts times.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
-    :return: Handle for the dimension
-    """
-    sleep = 60
-    reload_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='DoSave',
-        params=dict(
-        )
-    )
-    await websocket.send(json.dumps(reload_object))
-    reload_str = await websocket.recv()
-    logging.debug(f"< {reload_str}")
-    reload_json = json.loads(reload_str)
-    try:
-        return reload_json['result']
-    except KeyError:
+    :param attempts: Maximum number of save attempts.
+    :param delay: Wait time in seconds before the first retry.
+    :param max_delay: Maximum wait time in seconds between retries.
+    :return: True if the application has been saved, False otherwise.
+    """
+    for attempt in range(1, attempts + 1):
+        reload_json = await session.call('DoSave', handle, dict())
+        if 'result' in reload_json:
+            return True
         try:
-            if reload_json['error']['message'] == 'Reload in progress':
-                logging.warning(f"Save app not successful, reload in progress. Wait {sleep} seconds to retry.")
-                await asyncio.sleep(sleep)
-                await do_save(websocket, sid+1, handle)
-            else:
-                logging.error(f"Save app failed with message {reload_json['error']['message']}")
+            msg = reload_json['error']['message']
         except KeyError:
-            logging.error(f"Save app failed {reload_str}")
+            logging.error(f"Save app failed {reload_json}")
+            return False
+        if msg != 'Reload in progress':
+            logging.error(f"Save app failed with message {msg}")
+            return False
+        if attempt < attempts:
+            logging.warning(f"Save app not successful, reload in progress. Wait {delay} seconds to retry "
+                            f"({attempt}/{attempts}).")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    logging.error(f"Save app failed, reload still in progress after {attempts} attempts.")
     return False
 
 
-async def get_all_infos(websocket, sid, handle):
+async def get_all_infos(session, handle):
     """
-    This method returns the handle for a measure object.
+    This method returns the qId and qType for all objects in the application.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
-    :return:
+    :return: List of qInfo dictionaries (qId, qType)
     """
-    all_infos_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetAllInfos',
-        params=dict()
-    )
-    await websocket.send(json.dumps(all_infos_object))
-    all_infos_str = await websocket.recv()
-    logging.debug(f"< {all_infos_str}")
-    return
+    all_infos_json = await session.call('GetAllInfos', handle, dict())
+    return all_infos_json['result']['qInfos']
 
 
-async def get_app_layout(websocket, sid, handle):
+async def get_app_layout(session, handle):
     """
     This method returns the Application Layout information.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return:
     """
-    applayout_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetAppLayout',
-        params=dict()
-    )
-    await websocket.send(json.dumps(applayout_object))
-    applayout_str = await websocket.recv()
-    logging.debug(f"< {applayout_str}")
-    applayout_json = json.loads(applayout_str)
+    applayout_json = await session.call('GetAppLayout', handle, dict())
     return applayout_json['result']['qLayout']
 
 
-async def get_app_properties(websocket, sid, handle):
+async def get_app_properties(session, handle):
     """
     This method returns the Application Property information.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return:
     """
-    app_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetAppProperties',
-        params=dict()
-    )
-    await websocket.send(json.dumps(app_object))
-    app_str = await websocket.recv()
-    logging.debug(f"< {app_str}")
-    app_json = json.loads(app_str)
+    app_json = await session.call('GetAppProperties', handle, dict())
     return app_json['result']['qProp']
 
 
-async def get_authenticated_user(websocket, sid):
+async def get_authenticated_user(session):
     """
     This method returns the Authenticated User information.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :return:
     """
-    app_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=-1,
-        method='GetAuthenticatedUser',
-        params=dict()
-    )
-    await websocket.send(json.dumps(app_object))
-    app_str = await websocket.recv()
-    logging.debug(f"< {app_str}")
+    await session.call('GetAuthenticatedUser', -1, dict())
     return
 
 
-async def get_child_infos(websocket, sid, handle):
+async def get_child_infos(session, handle):
     """
     This method returns the Child Info dictionary.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Parent
     :return:
     """
-    all_infos_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetChildInfos',
-        params=dict()
-    )
-    await websocket.send(json.dumps(all_infos_object))
-    all_infos_str = await websocket.recv()
-    logging.debug(f"< {all_infos_str}")
-    all_infos_json = json.loads(all_infos_str)
+    all_infos_json = await session.call('GetChildInfos', handle, dict())
     return all_infos_json['result']['qInfos']
 
 
-async def get_connections(websocket, sid, handle):
+async def get_connections(session, handle):
     """
     This method returns the connections for the application.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Parent
     :return:
     """
-    all_infos_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetConnections',
-        params=dict()
-    )
-    await websocket.send(json.dumps(all_infos_object))
-    all_infos_str = await websocket.recv()
-    logging.debug(f"< {all_infos_str}")
-    all_infos_json = json.loads(all_infos_str)
+    all_infos_json = await session.call('GetConnections', handle, dict())
     return all_infos_json['result']['qConnections']
 
 
-async def get_dimension(websocket, sid, handle, qid):
+async def get_dimension(session, handle, qid):
     """
     This method returns the handle for a dimension object.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :param qid: Id for the dimension that need to be retrieved
     :return: Handle for the dimension
     """
-    dimension_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetDimension',
-        params=dict(qId=qid)
-    )
-    await websocket.send(json.dumps(dimension_object))
-    dimension_str = await websocket.recv()
-    logging.debug(f"< {dimension_str}")
-    dimension_json = json.loads(dimension_str)
+    dimension_json = await session.call('GetDimension', handle, dict(qId=qid))
     return dimension_json['result']['qReturn']['qHandle']
 
 
-async def get_doclist(websocket, sid):
+async def get_doclist(session):
     """
     Call GetDocList method from Global Class.
 
-    :param websocket: Websocket connection handler.
-    :param sid: Session ID
+    :param session: Engine session for the connection.
     :return: List of application dictionaries.
     """
-    doclist = dict(
-        jsonrpc='2.0',
-        handle=-1,
-        id=sid,
-        method='GetDocList',
-        params=[]
-    )
-    await websocket.send(json.dumps(doclist))
-    docstr = await websocket.recv()
-    logging.debug(f"< {docstr}")
-    docjson = json.loads(docstr)
+    docjson = await session.call('GetDocList', -1, [])
     return docjson['result']['qDocList']
 
 
-async def get_fullpropertytree(websocket, sid, handle):
+async def get_fullpropertytree(session, handle):
     """
     This method gets the full property tree of the object with handle.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return: Full Property Tree Dictionary
     """
-    layout = dict(
-        jsonrpc='2.0',
-        handle=handle,
-        id=sid,
-        method='GetFullPropertyTree',
-        params=[]
-    )
-    await websocket.send(json.dumps(layout))
-    object_str = await websocket.recv()
-    logging.debug(f"< {object_str}")
-    object_json = json.loads(object_str)
+    object_json = await session.call('GetFullPropertyTree', handle, [])
     return object_json['result']['qPropEntry']
 
 
-async def get_layout(websocket, sid, handle):
+async def get_layout(session, handle):
     """
     This method gets the Layout of the object with handle.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return: Layout Dictionary
     """
-    layout = dict(
-        jsonrpc='2.0',
-        handle=handle,
-        id=sid,
-        method='GetLayout',
-        params=[]
-    )
-    await websocket.send(json.dumps(layout))
-    layout_str = await websocket.recv()
-    # pprint.pprint(layout_str, indent=4)
-    logging.debug(f"< {layout_str}")
-    layout_json = json.loads(layout_str)
+    layout_json = await session.call('GetLayout', handle, [])
     return layout_json['result']['qLayout']
 
 
-async def get_measure(websocket, sid, handle, qid):
+async def get_measure(session, handle, qid):
     """
     This method returns the handle for a measure object.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :param qid: Id for the measure that need to be retrieved
     :return: Handle for the measure
     """
-    measure_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetMeasure',
-        params=dict(qId=qid)
-    )
-    await websocket.send(json.dumps(measure_object))
-    measure_str = await websocket.recv()
-    logging.debug(f"< {measure_str}")
-    measure_json = json.loads(measure_str)
+    measure_json = await session.call('GetMeasure', handle, dict(qId=qid))
     return measure_json['result']['qReturn']['qHandle']
 
 
-async def get_object(websocket, sid, handle, qid):
+async def get_object(session, handle, qid):
     """
     This method returns the handle for an object.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Parent
     :param qid: Id for the object that need to be retrieved
     :return: Handle for the object
     """
-    obj = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=handle,
-        method='GetObject',
-        params=dict(qId=qid)
-    )
-    await websocket.send(json.dumps(obj))
-    object_str = await websocket.recv()
-    logging.debug(f"< {object_str}")
-    object_json = json.loads(object_str)
+    object_json = await session.call('GetObject', handle, dict(qId=qid))
     return object_json['result']['qReturn']['qHandle']
 
 
-async def get_progress(websocket, sid, request_id):
+async def get_progress(session, request_id):
     """
     This method gets the progress for an application reload. Finished for a Reload Job means that reload is done, but
     rebuild of the index can be in progress.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session SID
+    :param session: Engine session for the connection
     :param request_id: Request ID for which progress is required
     :return:
     """
-    reload_object = dict(
-        jsonrpc='2.0',
-        id=sid,
-        handle=-1,
-        method='GetProgress',
-        params=dict(
-            qRequestId=request_id
-        )
-    )
-    await websocket.send(json.dumps(reload_object))
-    reload_str = await websocket.recv()
-    logging.debug(f"< {reload_str}")
-    reload_json = json.loads(reload_str)
+    reload_json = await session.call('GetProgress', -1, dict(qRequestId=request_id))
     return reload_json['result']
 
 
-async def get_properties(websocket, sid, handle):
+async def get_properties(session, handle):
     """
     This method gets the Properties of the object with handle.
 
-    :param websocket: Websocket connection for the handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle for the Application
     :return: Layout Dictionary
     """
-    layout = dict(
-        jsonrpc='2.0',
-        handle=handle,
-        id=sid,
-        method='GetProperties',
-        params=[]
-    )
-    await websocket.send(json.dumps(layout))
-    object_str = await websocket.recv()
-    # pprint.pprint(layout_str, indent=4)
-    logging.debug(f"< {object_str}")
-    object_json = json.loads(object_str)
+    object_json = await session.call('GetProperties', handle, [])
     return object_json['result']['qProp']
 
 
-async def get_script(websocket, sid, handle):
+async def get_script(session, handle):
     """
     Calls the GetScript method from the Doc class.
 
-    :param websocket: Websocket connection handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param handle: Handle ID for the method.
     :return: App script in bytestream format.
     """
-    getscript = dict(
-        jsonrpc='2.0',
-        handle=handle,
-        id=sid,
-        method='GetScript',
-        params={}
-    )
-    await websocket.send(json.dumps(getscript))
-    script_str = await websocket.recv()
-    logging.debug(f"< {script_str}")
-    script_json = json.loads(script_str)
+    script_json = await session.call('GetScript', handle, {})
     script = script_json['result']['qScript']
     return script
 
 
-async def open_app(websocket, sid, app_id):
+async def get_variable_by_name(session, handle, name):
+    """
+    This method returns the handle for a variable.
+
+    :param session: Engine session for the connection
+    :param handle: Handle for the Application
+    :param name: Name of the variable
+    :return: Handle for the variable, or None if the variable does not exist.
+    """
+    variable_json = await session.call('GetVariableByName', handle, dict(qName=name))
+    try:
+        return variable_json['result']['qReturn']['qHandle']
+    except (KeyError, TypeError):
+        return None
+
+
+async def open_app(session, app_id):
     """
     Calls the OpenDoc method from the Global class. qNoData is set to False to avoid 'Error: All expressions disabled'
     on the GetMeasure method, in case the measurement description is a formula.
     However setting qNoData to False will load data and may cause applications to fail. It also takes ages for
     applications to load, and the 'All expressions disabled' error does not add/hide valuable information.
 
-    :param websocket: Websocket connection handler
-    :param sid: Session ID
+    :param session: Engine session for the connection
     :param app_id: Application ID for application to open.
     :return: Application handle ID.
     """
-    opendoc = dict(
-        jsonrpc='2.0',
-        handle=-1,
-        id=sid,
-        method='OpenDoc',
-        params=dict(
-            qDocName=app_id,
-            qNoData=True
-        )
+    params = dict(
+        qDocName=app_id,
+        qNoData=True
     )
-    await websocket.send(json.dumps(opendoc))
-    appstr = await websocket.recv()
-    logging.debug(f"< {appstr}")
-    appjson = json.loads(appstr)
+    appjson = await session.call('OpenDoc', -1, params)
     try:
         handle = appjson['result']['qReturn']['qHandle']
         return handle
@@ -619,3 +769,16 @@ async def open_app(websocket, sid, app_id):
         log = f"Could not open application {app}: {msg}"
         logging.error(log)
         return log
+
+
+async def set_string_value(session, handle, value):
+    """
+    This method sets the value of a variable.
+
+    :param session: Engine session for the connection
+    :param handle: Handle for the variable
+    :param value: New value for the variable
+    :return: True if the value has been set, False otherwise.
+    """
+    variable_json = await session.call('SetStringValue', handle, dict(qVal=value))
+    return 'error' not in variable_json
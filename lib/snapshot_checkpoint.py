@@ -0,0 +1,117 @@
+"""
+This module keeps the checkpoint of a qlik_explore run: a json lines file in the state directory with the settings of
+the run on the first line and one line for every application that has been collected, with the files of the
+application and their status. A run that has been interrupted (crash, engine connection lost) continues from the
+checkpoint with --resume: collected applications are not collected again and their files are registered in the
+ChangeSet, so the changes report and the clean up at the end of the run are the same as for an uninterrupted run.
+The checkpoint is removed at the end of the run.
+"""
+
+import json
+import logging
+import os
+
+
+class Checkpoint:
+    """
+    This class handles the checkpoint file of the run.
+    """
+
+    def __init__(self, filename, workdir, settings, resume=False):
+        """
+        Start the checkpoint of a new run, or load the checkpoint of the interrupted run to resume.
+
+        :param filename: Full path of the checkpoint file.
+        :param workdir: Work Directory (base) of the snapshot. Paths are stored relative to workdir.
+        :param settings: Dictionary with the settings of the run, a run can only be resumed with the same settings.
+        :param resume: If set then continue the run of the checkpoint.
+        :return:
+        """
+        self.filename = filename
+        self.workdir = workdir
+        self.settings = settings
+        # qDocId -> list of (path, status, digest, size) of the collected applications.
+        self.apps = {}
+        if resume:
+            self.load()
+        else:
+            if os.path.isfile(filename):
+                logging.warning(f"Previous run did not finish, checkpoint {filename} is replaced by a new run.")
+            self.start()
+        return
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, 'w', encoding='utf-8') as fh:
+            fh.write(json.dumps(self.settings) + '\n')
+        return
+
+    def load(self):
+        """
+        Load the checkpoint of the interrupted run. Without checkpoint a new run is started.
+
+        :return:
+        """
+        try:
+            with open(self.filename, encoding='utf-8') as fh:
+                lines = fh.readlines()
+        except FileNotFoundError:
+            logging.info(f"No checkpoint found in {self.filename}, start a new run.")
+            self.start()
+            return
+        settings = json.loads(lines[0])
+        if settings != self.settings:
+            raise ValueError(f"Checkpoint {self.filename} is for a run with other settings: {settings}")
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a run that has been interrupted while the checkpoint was written.
+                logging.warning(f"Incomplete line in checkpoint {self.filename} ignored.")
+                continue
+            self.apps[entry['doc_id']] = entry['files']
+        logging.info(f"Resume run from checkpoint {self.filename}: {len(self.apps)} apps collected.")
+        return
+
+    def is_done(self, doc_id):
+        return doc_id in self.apps
+
+    def restore(self, changes):
+        """
+        Register the files of the collected applications in the ChangeSet.
+
+        :param changes: ChangeSet of the run.
+        :return:
+        """
+        for files in self.apps.values():
+            for path, status, digest, size in files:
+                changes.record(os.path.join(self.workdir, path), status, digest, size)
+        return
+
+    def add(self, doc_id, files, changes):
+        """
+        Register the application as collected. The line is written to disk before the next application is registered.
+
+        :param doc_id: qDocId of the application.
+        :param files: List with the full paths of the files of the application.
+        :param changes: ChangeSet of the run, with the status, content hash and size of the files.
+        :return:
+        """
+        entry = [(os.path.relpath(filepath, self.workdir),) + tuple(changes.files[filepath]) +
+                 (changes.sizes.get(filepath),) for filepath in dict.fromkeys(files)]
+        self.apps[doc_id] = entry
+        with open(self.filename, 'a', encoding='utf-8') as fh:
+            fh.write(json.dumps(dict(doc_id=doc_id, files=entry), ensure_ascii=False) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        return
+
+    def remove(self):
+        """
+        The run is complete, remove the checkpoint.
+
+        :return:
+        """
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        return
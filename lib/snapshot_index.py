@@ -0,0 +1,362 @@
+"""
+This module keeps a SQLite index of the snapshot in the state directory, next to the manifest. qlik_explore updates
+the index for every application it collects: the application and its stream, the sheets, sheet children, master
+dimensions and measures, variables and connections with their qId, type, title, file path, content hash and the time
+they were first seen, last changed and last seen. The master items that an object uses (qLibraryId) are in table refs,
+every added, modified or deleted file is logged in table changes. Questions as "which apps use measure X" or "what
+changed since Tuesday" are answered from the index (qlik_index) instead of a scan of the snapshot tree.
+Shard processes update the same index, SQLite serializes the updates.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from lib import my_env
+
+
+def get_time():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def get_library_ids(struct):
+    """
+    This function returns the master item IDs (qLibraryId) that are used in a structure, e.g. in the hypercube of a
+    chart.
+
+    :param struct: Property tree of the object.
+    :return: Set of qLibraryId values.
+    """
+    library_ids = set()
+    todo = [struct]
+    while todo:
+        node = todo.pop()
+        if isinstance(node, dict):
+            library_id = node.get('qLibraryId')
+            if isinstance(library_id, str) and library_id:
+                library_ids.add(library_id)
+            todo.extend(value for value in node.values() if isinstance(value, (dict, list)))
+        elif isinstance(node, list):
+            todo.extend(value for value in node if isinstance(value, (dict, list)))
+    return library_ids
+
+
+class AppObjects:
+    """
+    This class collects the objects and files of an application during exploration, for the update of the index when
+    all files of the application have been written.
+    """
+
+    def __init__(self):
+        # Object key (qId, parent) -> object dictionary.
+        self.objects = {}
+        # Files of the application in the order in which they have been written.
+        self.files = []
+        # qId -> set of qLibraryId used by the object.
+        self.refs = {}
+        # (qId, type, error) of the objects that have been skipped, they keep the files of the last snapshot.
+        self.skipped = []
+        return
+
+    def add(self, qtype, qid, title, filepath=None, parent='', struct=None):
+        """
+        Add an object of the application.
+
+        :param qtype: Object type: sheet, the visualization type of a sheet child, dimension, measure, variable or
+            connection.
+        :param qid: Id for the object.
+        :param title: Title of the object.
+        :param filepath: Full path of the file of the object. Objects without own file (variables, connections) have
+            the content hash of struct.
+        :param parent: qId of the parent object, the sheet for a sheet child.
+        :param struct: Object structure, for objects without own file.
+        :return:
+        """
+        digest = None
+        if filepath is None:
+            digest = my_env.get_digest(json.dumps(struct, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        else:
+            self.add_file(filepath)
+        self.objects[(qid, parent)] = dict(qid=qid, parent=parent, type=qtype, title=title, filepath=filepath,
+                                           digest=digest)
+        return
+
+    def skip(self, qid, qtype, error):
+        """
+        Register an object that could not be collected. Entries that have been added for the object are removed.
+
+        :param qid: Id for the object.
+        :param qtype: Object type.
+        :param error: Exception for the object.
+        :return:
+        """
+        self.skipped.append((qid, qtype, error))
+        for key in [key for key in self.objects if key[0] == qid]:
+            del self.objects[key]
+        self.refs.pop(qid, None)
+        return
+
+    def keep(self, obj):
+        """
+        Add an object of the last snapshot that has not been collected, see SnapshotIndex.get_objects.
+
+        :param obj: Object dictionary from the index.
+        :return:
+        """
+        self.add(obj['type'], obj['qid'], obj['title'], obj['filepath'], parent=obj['parent'])
+        self.refs.setdefault(obj['qid'], set()).update(obj['library_ids'])
+        return
+
+    def add_file(self, filepath):
+        if filepath not in self.files:
+            self.files.append(filepath)
+        return
+
+    def add_refs(self, qid, struct):
+        """
+        Add the master items that are used by the object.
+
+        :param qid: Id for the object.
+        :param struct: Property tree of the object.
+        :return:
+        """
+        self.refs.setdefault(qid, set()).update(get_library_ids(struct))
+        return
+
+
+class SnapshotIndex:
+    """
+    This class handles the snapshot index database.
+    """
+
+    def __init__(self, filename, workdir):
+        """
+        Open the snapshot index, the database is created if it does not exist.
+
+        :param filename: Full path of the database file.
+        :param workdir: Work Directory (base) of the snapshot. Paths are stored relative to workdir, with / as
+            separator.
+        :return:
+        """
+        self.filename = filename
+        self.workdir = workdir
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Shards update the index at the same time, a shard waits until the other shard has finished its update.
+        # The connection can be used from another thread than the one that opened it, one thread at a time.
+        self.conn = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        try:
+            # Queries do not block the updates. The journal mode is kept in the database, it is set once.
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            # Another shard is setting the journal mode.
+            pass
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS streams (
+                stream_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                path TEXT,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS apps (
+                doc_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                doc_name TEXT,
+                stream_id TEXT,
+                path TEXT NOT NULL,
+                modified_date TEXT,
+                last_reload TEXT,
+                file_size INTEGER,
+                first_seen TEXT NOT NULL,
+                collected TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS objects (
+                doc_id TEXT NOT NULL,
+                qid TEXT NOT NULL,
+                parent TEXT NOT NULL DEFAULT '',
+                type TEXT NOT NULL,
+                title TEXT,
+                path TEXT,
+                digest TEXT,
+                first_seen TEXT NOT NULL,
+                changed TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                PRIMARY KEY (doc_id, qid, parent)
+            );
+            CREATE INDEX IF NOT EXISTS objects_title ON objects (title);
+            CREATE INDEX IF NOT EXISTS objects_type ON objects (type, doc_id);
+            CREATE TABLE IF NOT EXISTS refs (
+                doc_id TEXT NOT NULL,
+                qid TEXT NOT NULL,
+                library_id TEXT NOT NULL,
+                PRIMARY KEY (doc_id, qid, library_id)
+            );
+            CREATE INDEX IF NOT EXISTS refs_library_id ON refs (library_id);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                digest TEXT,
+                size INTEGER,
+                first_seen TEXT NOT NULL,
+                changed TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_doc_id ON files (doc_id);
+            CREATE TABLE IF NOT EXISTS changes (
+                id INTEGER PRIMARY KEY,
+                time TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS changes_time ON changes (time);
+        """)
+        return
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.workdir).replace(os.sep, '/')
+
+    def update_app(self, doc, app_path, objects, changes, seen):
+        """
+        Update the index for an application that has been collected. Objects and files of the application that have
+        not been collected in this run are removed from the index.
+
+        :param doc: Application dictionary from the doclist.
+        :param app_path: Application path in the snapshot.
+        :param objects: AppObjects with the objects and files of the application.
+        :param changes: ChangeSet (snapshot store) of the run, with the content hash and size of the files.
+        :param seen: Time of the run (UTC, ISO format).
+        :return:
+        """
+        doc_id = doc['qDocId']
+        meta = doc['qMeta']
+        stream = meta.get('stream') if meta.get('published') else None
+        files = {}
+        for filepath in objects.files:
+            filepath = os.path.normpath(filepath)
+            status, digest = changes.files.get(filepath, (None, None))
+            if status is None or status == 'deleted':
+                continue
+            files[filepath] = (status, digest, changes.sizes.get(filepath))
+        with self.conn:
+            if stream:
+                self.conn.execute("INSERT INTO streams (stream_id, name, path, first_seen, last_seen) "
+                                  "VALUES (?, ?, ?, ?, ?) ON CONFLICT (stream_id) DO UPDATE SET name = excluded.name, "
+                                  "path = excluded.path, last_seen = excluded.last_seen",
+                                  (stream['id'], stream['name'], self.relpath(os.path.dirname(app_path)), seen, seen))
+            self.conn.execute("INSERT INTO apps (doc_id, title, doc_name, stream_id, path, modified_date, last_reload, "
+                              "file_size, first_seen, collected, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                              "ON CONFLICT (doc_id) DO UPDATE SET title = excluded.title, "
+                              "doc_name = excluded.doc_name, stream_id = excluded.stream_id, path = excluded.path, "
+                              "modified_date = excluded.modified_date, last_reload = excluded.last_reload, "
+                              "file_size = excluded.file_size, collected = excluded.collected, "
+                              "last_seen = excluded.last_seen",
+                              (doc_id, doc['qTitle'], doc.get('qDocName'), stream['id'] if stream else None,
+                               self.relpath(app_path), meta.get('modifiedDate'), doc.get('qLastReloadTime'),
+                               doc.get('qFileSize'), seen, seen, seen))
+            for filepath, (status, digest, size) in files.items():
+                self.conn.execute("INSERT INTO files (path, doc_id, digest, size, first_seen, changed, last_seen) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                                  "doc_id = excluded.doc_id, digest = excluded.digest, size = excluded.size, "
+                                  "changed = CASE WHEN files.digest IS excluded.digest THEN files.changed "
+                                  "ELSE excluded.changed END, last_seen = excluded.last_seen",
+                                  (self.relpath(filepath), doc_id, digest, size, seen, seen, seen))
+                if status != 'unchanged':
+                    self.conn.execute("INSERT INTO changes (time, doc_id, path, status) VALUES (?, ?, ?, ?)",
+                                      (seen, doc_id, self.relpath(filepath), status))
+            for obj in objects.objects.values():
+                path, digest = None, obj['digest']
+                if obj['filepath'] is not None:
+                    path = self.relpath(obj['filepath'])
+                    digest = files.get(os.path.normpath(obj['filepath']), (None, None, None))[1]
+                self.conn.execute("INSERT INTO objects (doc_id, qid, parent, type, title, path, digest, first_seen, "
+                                  "changed, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                  "ON CONFLICT (doc_id, qid, parent) DO UPDATE SET type = excluded.type, "
+                                  "title = excluded.title, path = excluded.path, digest = excluded.digest, "
+                                  "changed = CASE WHEN objects.digest IS excluded.digest THEN objects.changed "
+                                  "ELSE excluded.changed END, last_seen = excluded.last_seen",
+                                  (doc_id, obj['qid'], obj['parent'], obj['type'], obj['title'], path, digest, seen,
+                                   seen, seen))
+            self.conn.execute("DELETE FROM refs WHERE doc_id = ?", (doc_id,))
+            self.conn.executemany("INSERT INTO refs (doc_id, qid, library_id) VALUES (?, ?, ?)",
+                                  [(doc_id, qid, library_id) for qid, library_ids in objects.refs.items()
+                                   for library_id in sorted(library_ids)])
+            self.conn.execute("DELETE FROM objects WHERE doc_id = ? AND last_seen < ?", (doc_id, seen))
+            self.conn.execute("INSERT INTO changes (time, doc_id, path, status) SELECT ?, doc_id, path, 'deleted' "
+                              "FROM files WHERE doc_id = ? AND last_seen < ?", (seen, doc_id, seen))
+            self.conn.execute("DELETE FROM files WHERE doc_id = ? AND last_seen < ?", (doc_id, seen))
+        return
+
+    def get_objects(self, doc_id, qid):
+        """
+        Return the objects of the last snapshot for an object that has not been collected: the object and, for a sheet,
+        the sheet children.
+
+        :param doc_id: qDocId of the application.
+        :param qid: Id for the object.
+        :return: List of object dictionaries with qid, parent, type, title, filepath (full path) and library_ids.
+        """
+        rows = self.conn.execute("SELECT qid, parent, type, title, path FROM objects WHERE doc_id = ? "
+                                 "AND (qid = ? OR parent = ?) AND path IS NOT NULL", (doc_id, qid, qid)).fetchall()
+        refs = {}
+        for row in self.conn.execute("SELECT qid, library_id FROM refs WHERE doc_id = ? AND qid IN "
+                                     "(SELECT qid FROM objects WHERE doc_id = ? AND (qid = ? OR parent = ?))",
+                                     (doc_id, doc_id, qid, qid)):
+            refs.setdefault(row['qid'], set()).add(row['library_id'])
+        return [dict(qid=row['qid'], parent=row['parent'], type=row['type'], title=row['title'],
+                     filepath=os.path.normpath(os.path.join(self.workdir, row['path'])),
+                     library_ids=refs.get(row['qid'], set())) for row in rows]
+
+    def touch_app(self, doc_id, seen):
+        """
+        Register that the application is still available and did not change (incremental run).
+
+        :param doc_id: qDocId of the application.
+        :param seen: Time of the run (UTC, ISO format).
+        :return:
+        """
+        with self.conn:
+            self.conn.execute("UPDATE apps SET last_seen = ? WHERE doc_id = ?", (seen, doc_id))
+            self.conn.execute("UPDATE streams SET last_seen = ? WHERE stream_id = "
+                              "(SELECT stream_id FROM apps WHERE doc_id = ?)", (seen, doc_id))
+        return
+
+    def remove_deleted(self, doclist, seen):
+        """
+        Remove the applications that are no longer on the engine from the index. Their files are logged as deleted.
+        Streams without applications are removed as well.
+
+        :param doclist: List of application dictionaries from the engine.
+        :param seen: Time of the run (UTC, ISO format).
+        :return: List of qDocId of the removed applications.
+        """
+        doc_ids = set(doc['qDocId'] for doc in doclist)
+        deleted = [row['doc_id'] for row in self.conn.execute("SELECT doc_id FROM apps")
+                   if row['doc_id'] not in doc_ids]
+        with self.conn:
+            for doc_id in deleted:
+                self.conn.execute("INSERT INTO changes (time, doc_id, path, status) "
+                                  "SELECT ?, doc_id, path, 'deleted' FROM files WHERE doc_id = ?", (seen, doc_id))
+                for table in ('files', 'refs', 'objects', 'apps'):
+                    self.conn.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM streams WHERE stream_id NOT IN "
+                              "(SELECT stream_id FROM apps WHERE stream_id IS NOT NULL)")
+        return deleted
+
+    def query(self, sql, params=()):
+        """
+        Run a query on the index.
+
+        :param sql: SQL statement.
+        :param params: Parameters for the statement.
+        :return: Tuple with the list of column names and the list of rows.
+        """
+        cursor = self.conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description or []]
+        return columns, [tuple(row) for row in cursor.fetchall()]
+
+    def close(self):
+        self.conn.close()
+        return
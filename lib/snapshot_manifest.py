@@ -0,0 +1,148 @@
+"""
+This module keeps the snapshot manifest: for every application (qDocId) in the snapshot it remembers the values from
+GetDocList that tell if the application changed, and the path of the application directory in the snapshot.
+The manifest allows an incremental snapshot to skip applications that did not change since the last successful run.
+"""
+
+import json
+import logging
+import os
+
+
+def get_fingerprint(doc):
+    """
+    This function returns the values from the doclist entry that change when the application changes.
+
+    :param doc: Application dictionary from the doclist.
+    :return: Dictionary with modifiedDate, qLastReloadTime and qFileSize.
+    """
+    fingerprint = dict(
+        modifiedDate=doc['qMeta'].get('modifiedDate'),
+        qLastReloadTime=doc.get('qLastReloadTime'),
+        qFileSize=doc.get('qFileSize')
+    )
+    return fingerprint
+
+
+class Manifest:
+    """
+    This class handles the persistent snapshot manifest. The manifest is a json file with key qDocId and value the
+    fingerprint and relative application path of the application.
+    """
+
+    def __init__(self, filename, workdir, reset=False, source=None):
+        """
+        Load the manifest from file. A missing file results in an empty manifest.
+
+        :param filename: Full path of the manifest file.
+        :param workdir: Work Directory (base) of the snapshot. Application paths are stored relative to workdir.
+        :param reset: If set then start with an empty manifest.
+        :param source: Full path of the manifest file to load, default filename. A shard loads the manifest of the site
+            and saves its own manifest.
+        :return:
+        """
+        self.filename = filename
+        self.workdir = workdir
+        self.apps = {}
+        if not reset:
+            source = source or filename
+            try:
+                with open(source, encoding='utf-8') as fh:
+                    self.apps = json.load(fh)
+            except FileNotFoundError:
+                logging.info(f"No manifest found in {source}, all apps will be collected.")
+        return
+
+    def get_path(self, doc_id):
+        """
+        Return the application path for the doc_id as registered in the manifest.
+
+        :param doc_id: qDocId of the application.
+        :return: Full application path, or None if the application is not in the manifest.
+        """
+        try:
+            return os.path.join(self.workdir, self.apps[doc_id]['path'])
+        except KeyError:
+            return None
+
+    def is_unchanged(self, doc, app_path, isdir=os.path.isdir):
+        """
+        Check if the application did not change since the last successful collection. The application path must be
+        the same and still available in the snapshot.
+
+        :param doc: Application dictionary from the doclist.
+        :param app_path: Application path calculated for this run.
+        :param isdir: Function to check if the application path is in the snapshot, default on disk.
+        :return: True if the application can be skipped, False otherwise.
+        """
+        try:
+            entry = self.apps[doc['qDocId']]
+        except KeyError:
+            return False
+        if entry['fingerprint'] != get_fingerprint(doc):
+            return False
+        if os.path.join(self.workdir, entry['path']) != app_path:
+            return False
+        return isdir(app_path)
+
+    def update(self, doc, app_path):
+        """
+        Register the application after successful collection.
+
+        :param doc: Application dictionary from the doclist.
+        :param app_path: Application path where the application information is stored.
+        :return:
+        """
+        self.apps[doc['qDocId']] = dict(
+            title=doc['qTitle'],
+            path=os.path.relpath(app_path, self.workdir),
+            fingerprint=get_fingerprint(doc)
+        )
+        return
+
+    def remove(self, doc_id):
+        """
+        Remove the application from the manifest.
+
+        :param doc_id: qDocId of the application.
+        :return:
+        """
+        self.apps.pop(doc_id, None)
+        return
+
+    def restrict(self, doc_ids):
+        """
+        Keep only the applications in doc_ids, e.g. the applications of a shard.
+
+        :param doc_ids: qDocIds of the applications to keep.
+        :return:
+        """
+        doc_ids = set(doc_ids)
+        self.apps = {doc_id: entry for doc_id, entry in self.apps.items() if doc_id in doc_ids}
+        return
+
+    def deleted(self, doclist):
+        """
+        Return the qDocIds in the manifest that are no longer in the doclist.
+
+        :param doclist: List of application dictionaries from the engine.
+        :return: List of qDocIds.
+        """
+        current = set(doc['qDocId'] for doc in doclist)
+        return [doc_id for doc_id in self.apps if doc_id not in current]
+
+    def save(self, apps=None):
+        """
+        Write the manifest to file. The file is replaced in one step, so an interrupted run never leaves a partial
+        manifest.
+
+        :param apps: Copy of the manifest to write, default the manifest. A copy can be written in another thread while
+            the manifest changes.
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp_file = f"{self.filename}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as fh:
+            json.dump(self.apps if apps is None else apps, fh, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.filename)
+        return
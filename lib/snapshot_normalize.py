@@ -0,0 +1,121 @@
+"""
+This module normalizes the layouts that qlik_explore writes to the snapshot. Layouts contain runtime content (hypercube
+data pages, selection state, calculated values) that changes on every run, even if nobody changed the application.
+The normalizer removes these volatile values, sorts arrays for which the order has no meaning and optionally sorts
+dictionary keys, so a change in the snapshot is a real change in the application. Property trees and properties are
+written as they are, they have no runtime content.
+Normalization is enabled in section Normalize of the ini file, it changes the content of the layout files on the first
+run. A rule is a key, or a dotted key path (e.g. qHyperCube.qSize) that matches the end of the path of dictionary keys
+to the value. A rule that starts with / matches the path from the root of the layout (e.g. /qSelectionInfo). List
+positions are not part of the path.
+"""
+
+import json
+import logging
+import threading
+
+default_drop = ['/qSelectionInfo', 'qHyperCube.qDataPages', 'qHyperCube.qPivotDataPages',
+                'qHyperCube.qStackedDataPages', 'qHyperCube.qGrandTotalRow', 'qHyperCube.qSize',
+                'qHyperCube.qLastExpandedPos', 'qListObject.qDataPages', 'qListObject.qSize',
+                'qDimensionInfo.qCardinal', 'qDimensionInfo.qCardinalities', 'qDimensionInfo.qStateCounts',
+                'qDimensionInfo.qMin', 'qDimensionInfo.qMax', 'qMeasureInfo.qMin', 'qMeasureInfo.qMax']
+default_sort = ['tags', 'qChildList.qItems']
+
+
+def get_rules(value):
+    """
+    Convert a comma or newline separated list of rules into key path tuples. The tuple of a rule that matches from
+    the root starts with /.
+
+    :param value: Rules from the ini file.
+    :return: List of key path tuples.
+    """
+    rules = [rule.strip() for line in value.splitlines() for rule in line.split(',')]
+    return [('/',) + tuple(rule[1:].split('.')) if rule.startswith('/') else tuple(rule.split('.'))
+            for rule in rules if rule]
+
+
+def canonical(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+class Normalizer:
+    """
+    This class normalizes a structure: volatile values are removed, unordered arrays and dictionary keys are sorted.
+    The structure is not changed, a normalized copy is returned. The normalizer can be used from several threads.
+    """
+
+    def __init__(self, drop=(), sort=(), sort_keys=False):
+        """
+        Initialization of the normalizer.
+
+        :param drop: List of key path tuples for values that are removed.
+        :param sort: List of key path tuples for arrays that are sorted.
+        :param sort_keys: If set then dictionary keys are sorted.
+        :return:
+        """
+        # Rules by last key, so only the rules that can match are checked.
+        self.drop = {}
+        for rule in drop:
+            self.drop.setdefault(rule[-1], []).append(rule)
+        self.sort = {}
+        for rule in sort:
+            self.sort.setdefault(rule[-1], []).append(rule)
+        self.sort_keys = sort_keys
+        self.dropped = 0
+        self.lock = threading.Lock()
+        return
+
+    def __call__(self, struct):
+        return self.normalize(struct, ())
+
+    @staticmethod
+    def matches(rules, path):
+        if not path:
+            return False
+        for rule in rules.get(path[-1], ()):
+            if path == rule[1:] if rule[0] == '/' else path[-len(rule):] == rule:
+                return True
+        return False
+
+    def normalize(self, value, path):
+        """
+        Return the normalized copy of the value.
+
+        :param value: Value to normalize.
+        :param path: Tuple with the dictionary keys to the value.
+        :return: Normalized value.
+        """
+        if isinstance(value, dict):
+            result = {}
+            for key in (sorted(value) if self.sort_keys else value):
+                key_path = path + (key,)
+                if self.matches(self.drop, key_path):
+                    with self.lock:
+                        self.dropped += 1
+                    continue
+                result[key] = self.normalize(value[key], key_path)
+            return result
+        if isinstance(value, list):
+            result = [self.normalize(item, path) for item in value]
+            if self.matches(self.sort, path):
+                result.sort(key=canonical)
+            return result
+        return value
+
+
+def get_normalizer(config):
+    """
+    This function creates the normalizer from section Normalize of the ini file: enabled (default no), drop and sort
+    (comma or newline separated rules, default the built-in rules) and sort_keys (default no).
+
+    :param config: ini file handle.
+    :return: Normalizer, or None if normalization is disabled.
+    """
+    section = config['Normalize'] if 'Normalize' in config else {}
+    if section.get('enabled', 'no').strip().lower() not in ('yes', 'true', 'on', '1'):
+        return None
+    drop = get_rules(section.get('drop', ', '.join(default_drop)))
+    sort = get_rules(section.get('sort', ', '.join(default_sort)))
+    sort_keys = section.get('sort_keys', 'no').strip().lower() in ('yes', 'true', 'on', '1')
+    return Normalizer(drop, sort, sort_keys)
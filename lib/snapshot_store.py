@@ -0,0 +1,530 @@
+"""
+This module has the snapshot stores for qlik_explore. The default store is the directory tree in the work directory
+(my_env.ChangeSet), git_processing commits the changes. The git store writes the snapshot straight into the object
+database of a git repository with git fast-import and commits at the end of the run, nothing is written to a working
+tree. Snapshots of several sites can be kept in one (bare) repository on different branches.
+The content-addressed store writes every file content once in the objects directory of the work directory, under its
+content hash. Every application directory has a manifest with the content hash for each file of the application.
+qlik_materialize recreates the directory tree from the manifests.
+"""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from lib import my_env
+
+# Name of the manifest file in the directories of the content-addressed store.
+cas_manifest = '_manifest.json'
+# Directory with the file contents in the content-addressed store.
+cas_objects = 'objects'
+
+
+def get_store(store, workdir, gitdir=None, branch='master'):
+    """
+    This function returns the snapshot store for the run.
+
+    :param store: Store type: directory, git or cas.
+    :param workdir: Work Directory (base) of the snapshot.
+    :param gitdir: Git repository for the git store, default is the work directory.
+    :param branch: Branch for the git store.
+    :return: ChangeSet for the run.
+    """
+    if store == 'git':
+        return GitFastImportStore(workdir, gitdir or workdir, branch)
+    elif store == 'cas':
+        return ContentAddressedStore(workdir)
+    return my_env.ChangeSet(workdir)
+
+
+def quote_path(path):
+    """
+    Quote a path for the fast-import stream if required: paths starting with a double quote or with a newline must be
+    written as C-style string.
+
+    :param path: Path relative to the repository root, with / as separator.
+    :return: Path for the fast-import stream.
+    """
+    if not path.startswith('"') and '\n' not in path:
+        return path
+    quoted = path.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{quoted}"'
+
+
+def get_manifest_dir(path):
+    """
+    Return the directory of the manifest for a file in the content-addressed store: the application directory
+    (stream/application), or the parent directory for files on a higher level.
+
+    :param path: Path relative to the snapshot root, with / as separator.
+    :return: Manifest directory relative to the snapshot root, empty string for the snapshot root.
+    """
+    parts = path.split('/')
+    return '/'.join(parts[:min(2, len(parts) - 1)])
+
+
+def object_path(workdir, digest):
+    return os.path.join(workdir, cas_objects, digest[:2], digest[2:])
+
+
+def read_manifests(workdir):
+    """
+    Read all manifests of the content-addressed store.
+
+    :param workdir: Work Directory (base) of the snapshot.
+    :return: Dictionary with key the file path relative to the snapshot root (/ as separator) and value the content
+        hash.
+    """
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(workdir):
+        if dirpath == workdir:
+            for skip in ('.git', cas_objects):
+                if skip in dirnames:
+                    dirnames.remove(skip)
+        if cas_manifest not in filenames:
+            continue
+        with open(os.path.join(dirpath, cas_manifest), encoding='utf-8') as fh:
+            files = json.load(fh)
+        manifest_dir = os.path.relpath(dirpath, workdir).replace(os.sep, '/')
+        for filename, digest in files.items():
+            tree[filename if manifest_dir == '.' else f"{manifest_dir}/{filename}"] = digest
+    return tree
+
+
+class TreeStore(my_env.ChangeSet):
+    """
+    This class is the base for snapshot stores that keep the snapshot tree in memory: a dictionary with key the path
+    relative to the snapshot root and value the content hash (git blob id). The tree of the last snapshot is the base,
+    the subclass stores the content of new files (store_content, store_file for large content in a temporary file) and
+    saves the tree at the end of the run (close). Files can be written from several threads, the tree is changed and the
+    content is stored under a lock.
+    """
+
+    def __init__(self, workdir, base, tmpdir=None):
+        """
+        Initialization of the tree store.
+
+        :param workdir: Work Directory (base) of the snapshot, the root of the snapshot tree.
+        :param base: Tree of the last snapshot.
+        :param tmpdir: Directory for the temporary files of large content, default the system temporary directory.
+        :return:
+        """
+        super().__init__(workdir)
+        self.tmpdir = tmpdir
+        self.lock = threading.Lock()
+        self.base = base
+        self.tree = dict(base)
+        # Number of files below every directory, for isdir.
+        self.dirs = {}
+        for path in self.tree:
+            self.count_dirs(path, 1)
+        return
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.workdir).replace(os.sep, '/')
+
+    def count_dirs(self, path, delta):
+        parts = path.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            dirname = '/'.join(parts[:i])
+            self.dirs[dirname] = self.dirs.get(dirname, 0) + delta
+        return
+
+    def store_content(self, digest, data):
+        raise NotImplementedError
+
+    def store_file(self, digest, tmp_file, size):
+        raise NotImplementedError
+
+    def register(self, filepath, digest, size):
+        """
+        Register the file in the snapshot tree.
+
+        :param filepath: Full path of the file.
+        :param digest: Content hash of the file.
+        :param size: Size of the file in bytes.
+        :return: Status: added, modified or unchanged.
+        """
+        path = self.relpath(filepath)
+        old = self.tree.get(path)
+        if old == digest:
+            status = 'unchanged'
+        else:
+            status = 'modified' if path in self.base else 'added'
+            if old is None:
+                self.count_dirs(path, 1)
+            self.tree[path] = digest
+        self.record(filepath, status, digest, size)
+        return status
+
+    def write(self, filepath, data):
+        """
+        Register the file in the snapshot tree. The content is stored if the file is new or changed.
+
+        :param filepath: Full path of the file.
+        :param data: File content as bytes.
+        :return: True if the file has been written, False if the file did not change.
+        """
+        digest = my_env.get_digest(data)
+        with self.lock:
+            if self.register(filepath, digest, len(data)) == 'unchanged':
+                return False
+            self.store_content(digest, data)
+        return True
+
+    def write_chunks(self, filepath, chunks):
+        """
+        Register the file with the text chunks in the snapshot tree. Large content is stored from a temporary file.
+
+        :param filepath: Full path of the file.
+        :param chunks: Iterable with text chunks, e.g. from json.JSONEncoder.iterencode.
+        :return: True if the file has been written, False if the file did not change.
+        """
+        data, tmp_file, size = my_env.spool_chunks(chunks, self.tmpdir)
+        if data is not None:
+            return self.write(filepath, data)
+        try:
+            digest = my_env.get_file_digest(tmp_file, size)
+            with self.lock:
+                if self.register(filepath, digest, size) == 'unchanged':
+                    return False
+                self.store_file(digest, tmp_file, size)
+            return True
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def isdir(self, path):
+        path = self.relpath(path)
+        return path == '.' or self.dirs.get(path, 0) > 0
+
+    def mkdir(self, path):
+        # Directories are implicit in the snapshot tree.
+        return
+
+    def rmdir(self, path):
+        return
+
+    def init_staging(self, name):
+        # The snapshot tree is saved at the end of the run, it is never half written.
+        return
+
+    def stage(self, path):
+        self.staged[path] = []
+        return
+
+    def discard(self, path):
+        """
+        Discard the files registered for the application, the application keeps the files of the last snapshot.
+
+        :param path: Application directory in the snapshot.
+        :return:
+        """
+        with self.lock:
+            for filepath in self.staged.pop(path, []):
+                self.files.pop(filepath, None)
+                self.sizes.pop(filepath, None)
+                relpath = self.relpath(filepath)
+                if relpath in self.base:
+                    if relpath not in self.tree:
+                        self.count_dirs(relpath, 1)
+                    self.tree[relpath] = self.base[relpath]
+                elif relpath in self.tree:
+                    del self.tree[relpath]
+                    self.count_dirs(relpath, -1)
+        self.keep(path)
+        return
+
+    def keep(self, path):
+        for relpath in self.files_below(path):
+            filepath = os.path.normpath(os.path.join(self.workdir, relpath))
+            if filepath not in self.files:
+                self.record(filepath, 'unchanged', self.tree[relpath])
+        return
+
+    def keep_file(self, filepath):
+        filepath = os.path.normpath(filepath)
+        if filepath in self.files:
+            return self.files[filepath][0] != 'deleted'
+        relpath = self.relpath(filepath)
+        with self.lock:
+            digest = self.tree.get(relpath)
+        if digest is None:
+            return False
+        self.record(filepath, 'unchanged', digest)
+        return True
+
+    def files_below(self, path):
+        prefix = self.relpath(path)
+        with self.lock:
+            if prefix == '.':
+                return list(self.tree)
+            return [p for p in self.tree if p.startswith(f"{prefix}/")]
+
+    def remove(self, path):
+        with self.lock:
+            del self.tree[path]
+            self.count_dirs(path, -1)
+        self.record(os.path.join(self.workdir, path), 'deleted')
+        return
+
+    def remove_tree(self, path):
+        """
+        Remove a directory from the snapshot. All files in the directory are registered as deleted.
+
+        :param path: Directory to remove.
+        :return:
+        """
+        for filepath in self.files_below(path):
+            self.remove(filepath)
+        return
+
+    def sweep(self, path):
+        """
+        Remove all files below path that have not been registered in this run.
+
+        :param path: Directory to clean up.
+        :return:
+        """
+        for filepath in self.files_below(path):
+            if os.path.normpath(os.path.join(self.workdir, filepath)) not in self.files:
+                self.remove(filepath)
+        return
+
+    def sweep_snapshot(self):
+        """
+        Remove all files of the snapshot that have not been registered in this run. The tree has the snapshot files
+        only.
+
+        :return:
+        """
+        self.sweep(self.workdir)
+        return
+
+    def tree_changes(self):
+        """
+        Compare the snapshot tree with the last snapshot.
+
+        :return: Tuple with sorted lists of changed (added or modified) and deleted paths.
+        """
+        changed = sorted(p for p, digest in self.tree.items() if self.base.get(p) != digest)
+        deleted = sorted(p for p in self.base if p not in self.tree)
+        return changed, deleted
+
+
+class GitFastImportStore(TreeStore):
+    """
+    This class stores the snapshot in a git repository. The files of the last snapshot are read from the branch with
+    git ls-tree. A file is only sent to git fast-import if the repository does not have its content yet. At the end of
+    the run the added, modified and deleted files are committed on the branch. Paths are calculated as for the
+    directory tree, relative to the work directory.
+    git fast-import does not update the index and working tree, so the branch must not be checked out in the repository.
+    """
+
+    def __init__(self, workdir, gitdir, branch='master'):
+        """
+        Initialization of the git store.
+
+        :param workdir: Work Directory (base) of the snapshot, the root of the snapshot tree. Nothing is written here.
+        :param gitdir: Git repository, bare or with working tree.
+        :param branch: Branch for the snapshot commits, not checked out in a working tree of the repository.
+        :return:
+        """
+        self.gitdir = gitdir
+        self.ref = f"refs/heads/{branch}"
+        if self.checked_out():
+            raise ValueError(f"Branch {branch} is checked out in {gitdir}, use a bare repository or another branch "
+                             f"for the git store")
+        self.parent = self.git('rev-parse', '--verify', '--quiet', f"{self.ref}^{{commit}}", check=False) or None
+        base = {}
+        if self.parent:
+            listing = self.git('ls-tree', '-r', '-z', '--full-tree', self.parent)
+            for entry in filter(None, listing.split('\0')):
+                info, path = entry.split('\t', 1)
+                base[path] = info.split()[2]
+        super().__init__(workdir, base)
+        self.blobs = set(base.values())
+        # Blob id -> fast-import mark for the blobs sent in this run.
+        self.sent = {}
+        self.importer = None
+        logging.info(f"Git store {gitdir} {self.ref}: {len(base)} files in last snapshot {self.parent}")
+        return
+
+    def checked_out(self):
+        """
+        This method checks if the branch is checked out in the main or a linked working tree of the repository.
+
+        :return: True if the branch is checked out, False otherwise.
+        """
+        listing = self.git('worktree', 'list', '--porcelain')
+        return f"branch {self.ref}" in listing.splitlines()
+
+    def git(self, *args, check=True):
+        res = subprocess.run(['git', '-C', self.gitdir] + list(args), capture_output=True, text=True)
+        if check and res.returncode != 0:
+            raise RuntimeError(f"git {' '.join(args)} failed: {res.stderr.strip()}")
+        return res.stdout.strip()
+
+    def send(self, data):
+        if self.importer is None:
+            self.importer = subprocess.Popen(['git', '-C', self.gitdir, 'fast-import', '--quiet', '--done'],
+                                             stdin=subprocess.PIPE)
+        self.importer.stdin.write(data)
+        return
+
+    def store_content(self, digest, data):
+        if digest not in self.blobs and digest not in self.sent:
+            mark = len(self.sent) + 1
+            self.send(b"blob\nmark :%d\ndata %d\n" % (mark, len(data)) + data + b"\n")
+            self.sent[digest] = f":{mark}"
+        return
+
+    def store_file(self, digest, tmp_file, size):
+        if digest not in self.blobs and digest not in self.sent:
+            mark = len(self.sent) + 1
+            self.send(b"blob\nmark :%d\ndata %d\n" % (mark, size))
+            with open(tmp_file, 'rb') as fh:
+                shutil.copyfileobj(fh, self.importer.stdin)
+            self.send(b"\n")
+            self.sent[digest] = f":{mark}"
+        return
+
+    def close(self, message):
+        """
+        Commit the changes of the run on the branch. No commit is made if nothing changed.
+
+        :param message: Commit message.
+        :return: Commit id, or None if there is no commit.
+        """
+        changed, deleted = self.tree_changes()
+        if not changed and not deleted:
+            if self.importer is not None:
+                self.send(b"done\n")
+                self.importer.stdin.close()
+                self.importer.wait()
+            logging.info("Git store: no changes, no commit.")
+            return None
+        name = self.git('config', 'user.name', check=False) or 'qsapi'
+        email = self.git('config', 'user.email', check=False) or 'qsapi@localhost'
+        tz = time.strftime('%z')
+        msg = message.encode('utf-8')
+        lines = [f"commit {self.ref}", f"committer {name} <{email}> {int(time.time())} {tz}"]
+        stream = '\n'.join(lines).encode('utf-8') + b"\ndata %d\n" % len(msg) + msg + b"\n"
+        if self.parent:
+            stream += f"from {self.parent}\n".encode('utf-8')
+        for path in deleted:
+            stream += f"D {quote_path(path)}\n".encode('utf-8')
+        for path in changed:
+            dataref = self.sent.get(self.tree[path], self.tree[path])
+            stream += f"M 100644 {dataref} {quote_path(path)}\n".encode('utf-8')
+        stream += b"\ndone\n"
+        self.send(stream)
+        self.importer.stdin.close()
+        if self.importer.wait() != 0:
+            raise RuntimeError(f"git fast-import failed for {self.gitdir}")
+        commit = self.git('rev-parse', self.ref)
+        logging.info(f"Git store: commit {commit} on {self.ref}, {len(changed)} files written, {len(deleted)} deleted.")
+        return commit
+
+
+class ContentAddressedStore(TreeStore):
+    """
+    This class stores every file content once, in objects/<2 characters>/<38 characters> of the content hash. The
+    application directories have a manifest (_manifest.json) with key the file path in the directory and value the
+    content hash. Objects that are no longer in a manifest are removed at the end of the run.
+    The report has the objects and manifests that changed, as these are the files in the work directory.
+    """
+
+    def __init__(self, workdir):
+        """
+        Initialization of the content-addressed store. The tree of the last snapshot is read from the manifests.
+
+        :param workdir: Work Directory (base) of the snapshot.
+        :return:
+        """
+        super().__init__(workdir, read_manifests(workdir), tmpdir=os.path.join(workdir, cas_objects))
+        # Changed files in the work directory: objects and manifests.
+        self.stored = {}
+        logging.info(f"Content-addressed store {workdir}: {len(self.base)} files in last snapshot, "
+                     f"{len(set(self.base.values()))} objects")
+        return
+
+    def store_content(self, digest, data):
+        filepath = object_path(self.workdir, digest)
+        if os.path.isfile(filepath):
+            return
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_file = f"{filepath}.tmp"
+        with open(tmp_file, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_file, filepath)
+        self.stored[filepath] = ('added', digest)
+        return
+
+    def store_file(self, digest, tmp_file, size):
+        # The temporary file is in the objects directory, it is moved to the object path.
+        filepath = object_path(self.workdir, digest)
+        if os.path.isfile(filepath):
+            return
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(tmp_file, filepath)
+        self.stored[filepath] = ('added', digest)
+        return
+
+    def close(self, message):
+        """
+        Write the manifests of the directories that changed and remove the objects that are no longer used.
+
+        :param message: Not used, git_processing commits the changes.
+        :return: None, no commit has been made.
+        """
+        changed, deleted = self.tree_changes()
+        manifest_dirs = set(get_manifest_dir(path) for path in changed + deleted)
+        manifests = {manifest_dir: {} for manifest_dir in manifest_dirs}
+        for path, digest in self.tree.items():
+            manifest_dir = get_manifest_dir(path)
+            if manifest_dir in manifests:
+                manifests[manifest_dir][path[len(manifest_dir) + 1:] if manifest_dir else path] = digest
+        for manifest_dir, files in manifests.items():
+            dirpath = os.path.join(self.workdir, manifest_dir)
+            filepath = os.path.join(dirpath, cas_manifest)
+            if files:
+                os.makedirs(dirpath, exist_ok=True)
+                data = json.dumps(files, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+                status, digest = my_env.write_file(filepath, data)
+                self.stored[filepath] = (status, digest)
+            elif os.path.isfile(filepath):
+                os.remove(filepath)
+                self.stored[filepath] = ('deleted', None)
+                if manifest_dir:
+                    try:
+                        # Remove the directory and its parents, as long as they are empty.
+                        os.removedirs(dirpath)
+                    except OSError:
+                        pass
+        # Remove the objects that are no longer in a manifest.
+        used = set(self.tree.values())
+        for digest in set(self.base.values()) - used:
+            filepath = object_path(self.workdir, digest)
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+                self.stored[filepath] = ('deleted', None)
+        logging.info(f"Content-addressed store: {len(changed)} files written, {len(deleted)} deleted, "
+                     f"{len(manifests)} manifests updated, {len(used)} objects for {len(self.tree)} files")
+        return None
+
+    def report(self):
+        """
+        Create the changed paths report for the files in the work directory: objects and manifests.
+
+        :return: Dictionary with lists of added, modified and deleted paths and the count of unchanged files.
+        """
+        report = dict(added=[], modified=[], deleted=[])
+        for filepath, (status, _) in sorted(self.stored.items()):
+            if status != 'unchanged':
+                report[status].append(os.path.relpath(filepath, self.workdir))
+        report['unchanged'] = sum(1 for status, _ in self.files.values() if status == 'unchanged')
+        return report
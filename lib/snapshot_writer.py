@@ -0,0 +1,143 @@
+"""
+This module has the write-behind stage of qlik_explore. Normalizing, serializing, hashing and writing the snapshot
+files is done in a thread pool, so the event loop keeps reading engine replies while files are written and network
+time and disk time overlap. Collected structures wait in a bounded queue: if the writes fall behind, collection waits
+for a free place in the queue.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+from lib import my_env
+
+
+class SnapshotWriter:
+    """
+    This class runs the snapshot writes in a thread pool. At most queue_size writes are waiting or running, a new
+    write waits for a free place. Writes of the same file are done in the order in which they are submitted, so the
+    last write wins as with direct writes.
+    """
+
+    def __init__(self, changes, normalize=None, workers=2, queue_size=100):
+        """
+        Initialization of the writer.
+
+        :param changes: ChangeSet (snapshot store) for the run. The store must accept writes from several threads.
+        :param normalize: Function that returns the normalized layout, e.g. lib.snapshot_normalize.Normalizer.
+        :param workers: Number of writer threads.
+        :param queue_size: Maximum number of writes that are waiting or running.
+        :return:
+        """
+        self.changes = changes
+        self.normalize = normalize
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='writer')
+        self.slots = asyncio.Semaphore(queue_size)
+        # Last submitted write per file.
+        self.last = {}
+        # Number of writes that had to wait for a free place in the queue.
+        self.waits = 0
+        return
+
+    @staticmethod
+    def run(previous, func, *args, **kwargs):
+        # The previous write of the file was submitted first, so it is running or done.
+        if previous is not None:
+            concurrent.futures.wait([previous])
+        return func(*args, **kwargs)
+
+    async def submit(self, filepath, func, *args, **kwargs):
+        """
+        Coroutine to queue a write. The coroutine waits until there is a free place in the queue.
+
+        :param filepath: Full path of the file that is written.
+        :param func: Function that writes the file.
+        :param args: Arguments for the function.
+        :param kwargs: Keyword arguments for the function.
+        :return: asyncio future for the result of the function.
+        """
+        if self.slots.locked():
+            self.waits += 1
+        await self.slots.acquire()
+        future = self.executor.submit(self.run, self.last.get(filepath), func, *args, **kwargs)
+        self.last[filepath] = future
+        result = asyncio.wrap_future(future)
+        result.add_done_callback(lambda _: self.done(filepath, future))
+        return result
+
+    def done(self, filepath, future):
+        if self.last.get(filepath) is future:
+            del self.last[filepath]
+        self.slots.release()
+        return
+
+    def group(self):
+        return WriteGroup(self)
+
+    def close(self):
+        """
+        Wait until all writes are done and stop the writer threads.
+
+        :return:
+        """
+        self.executor.shutdown(wait=True)
+        return
+
+
+class WriteGroup:
+    """
+    This class collects the writes of an application. Used as async context manager, the exit waits until all writes
+    of the group are done. A failed write is raised at the exit.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.futures = []
+        return
+
+    async def dump(self, struct, path, filename, sort_keys=False, layout=False):
+        """
+        Coroutine to queue a structure for my_env.dump_structure.
+
+        :param struct: Python structure that need to be written to file.
+        :param path: Path of the resulting file.
+        :param filename: Filename of the required file.
+        :param sort_keys: If set then sort on Keys.
+        :param layout: If set then the structure is a layout with runtime content, it is normalized.
+        :return:
+        """
+        normalize = self.writer.normalize if layout else None
+        self.futures.append(await self.writer.submit(os.path.join(path, filename), my_env.dump_structure, struct, path,
+                                                     filename, sort_keys=sort_keys, changes=self.writer.changes,
+                                                     normalize=normalize))
+        return
+
+    async def write(self, filepath, data):
+        """
+        Coroutine to queue file data for my_env.write_if_changed.
+
+        :param filepath: Full path of the file.
+        :param data: File content as bytes.
+        :return:
+        """
+        self.futures.append(await self.writer.submit(filepath, my_env.write_if_changed, filepath, data,
+                                                     self.writer.changes))
+        return
+
+    async def wait(self):
+        """
+        Coroutine to wait until all writes of the group are done.
+
+        :return: List with the exceptions of the failed writes.
+        """
+        results = await asyncio.gather(*self.futures, return_exceptions=True)
+        self.futures = []
+        return [res for res in results if isinstance(res, BaseException)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        errors = await self.wait()
+        if errors and exc_type is None:
+            raise errors[0]
+        return False
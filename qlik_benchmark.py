@@ -0,0 +1,249 @@
+#!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to benchmark the explore, reload and git stages against fixed workloads on the local
+Engine simulator. Results are saved as json, so runs can be compared over time. If a baseline result file is given,
+the run fails when a stage is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from lib import my_env
+from lib.engine_simulator import SiteModel, EngineSimulator
+
+# Fixed workloads. Site parameters are passed to SiteModel, latency is per request in seconds.
+workloads = dict(
+    small=dict(site=dict(streams=2, apps=10, sheets=3, children=5, dimensions=5, measures=5, variables=5),
+               latency=0.005, reload_apps=3),
+    medium=dict(site=dict(streams=5, apps=100, sheets=5, children=8, dimensions=20, measures=20, variables=10),
+                latency=0.005, reload_apps=10),
+    large=dict(site=dict(streams=20, apps=1000, sheets=5, children=8, dimensions=20, measures=20, variables=10),
+               latency=0.005, reload_apps=20)
+)
+# Metrics that are checked against the baseline. Lower is better for all of them.
+checked_metrics = ['wall_time', 'round_trips', 'bytes_in', 'bytes_out', 'files_written', 'peak_rss_kb']
+
+
+class SimulatorThread(threading.Thread):
+    """
+    This class runs the Engine simulator on its own event loop in a background thread, so the simulator statistics
+    are available to the benchmark.
+    """
+
+    def __init__(self, simulator):
+        super().__init__(daemon=True)
+        self.simulator = simulator
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.port = None
+        return
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(self.simulator.serve('localhost', 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+        return
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+        return
+
+
+def run_stage(script_name, env, *script_args):
+    """
+    Run a script from the project directory and measure wall time and peak memory of the process.
+
+    :param script_name: Name of the script.
+    :param env: Environment for the script.
+    :param script_args: Arguments for the script.
+    :return: Dictionary with wall time in seconds, peak RSS in kB and return code.
+    """
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script_name)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, script_path] + list(script_args), env=env)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        logging.error(f"{script_name} {' '.join(script_args)} ended with return code {proc.returncode}")
+    # ru_maxrss is in kB on Linux.
+    return dict(wall_time=round(wall_time, 3), peak_rss_kb=rusage.ru_maxrss, returncode=proc.returncode)
+
+
+def stats_delta(simulator, before):
+    """
+    Calculate round trips and bytes on the wire since the statistics snapshot before.
+
+    :param simulator: EngineSimulator
+    :param before: Statistics snapshot.
+    :return: Dictionary with round trips, bytes in and bytes out.
+    """
+    stats = simulator.stats
+    return dict(round_trips=stats['requests'] - before['requests'],
+                bytes_in=stats['bytes_in'] - before['bytes_in'],
+                bytes_out=stats['bytes_out'] - before['bytes_out'])
+
+
+def init_repo(basedir):
+    """
+    Create the snapshot repository with a bare origin, as git_processing expects.
+
+    :param basedir: Directory for the repositories.
+    :return: Path of the snapshot repository.
+    """
+    origin = os.path.join(basedir, 'origin.git')
+    workdir = os.path.join(basedir, 'snapshot')
+    subprocess.run(['git', 'init', '-q', '--bare', origin], check=True)
+    subprocess.run(['git', 'init', '-q', '-b', 'master', workdir], check=True)
+    for key, value in [('user.name', 'qsapi benchmark'), ('user.email', 'benchmark@localhost')]:
+        subprocess.run(['git', '-C', workdir, 'config', key, value], check=True)
+    subprocess.run(['git', '-C', workdir, 'remote', 'add', 'origin', origin], check=True)
+    return workdir
+
+
+def run_workload(name, workload):
+    """
+    Run the explore, git and reload stages for the workload.
+
+    :param name: Name of the workload.
+    :param workload: Workload definition.
+    :return: Dictionary with the results per stage.
+    """
+    logging.info(f"Start workload {name}")
+    site = SiteModel(seed=args.seed, **workload['site'])
+    simulator = EngineSimulator(site, latency=workload['latency'], reload_time=args.reload_time, seed=args.seed)
+    sim_thread = SimulatorThread(simulator)
+    sim_thread.start()
+    sim_thread.started.wait()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"qsapi_bench_{name}_") as basedir:
+            workdir = init_repo(basedir)
+            statedir = os.path.join(basedir, 'state')
+            inifile = os.path.join(basedir, 'qlik.ini')
+            reload_apps = [doc['qTitle'] for doc in site.doclist()[:workload['reload_apps']]]
+            with open(inifile, 'w', encoding='utf-8') as fh:
+                fh.write(f"[Reload]\napps = {', '.join(reload_apps)}\n")
+            env = os.environ.copy()
+            env.update(LOCAL_URI=f"ws://localhost:{sim_thread.port}/app/", LOCAL_WORKDIR=workdir,
+                       LOCAL_STATEDIR=statedir, INIFILE=inifile)
+            # Explore
+            before = dict(simulator.stats)
+            results['explore'] = run_stage('qlik_explore.py', env, '-t', 'Local', '-c', str(args.concurrency))
+            results['explore'].update(stats_delta(simulator, before))
+            try:
+                with open(os.path.join(statedir, 'changes.json'), encoding='utf-8') as fh:
+                    report = json.load(fh)
+                results['explore']['files_written'] = len(report['added']) + len(report['modified'])
+            except FileNotFoundError:
+                results['explore']['files_written'] = None
+            # Git
+            results['git'] = run_stage('git_processing.py', env, '-t', 'Local')
+            # Reload
+            before = dict(simulator.stats)
+            results['reload'] = run_stage('qlik_reload.py', env, '-t', 'Local')
+            results['reload'].update(stats_delta(simulator, before))
+            results['reload']['apps'] = len(reload_apps)
+    finally:
+        sim_thread.stop()
+    logging.info(f"Workload {name}: {results}")
+    return results
+
+
+def get_revision():
+    """
+    Get the git revision of the qsapi project.
+
+    :return: Revision hash, or None if not available.
+    """
+    res = subprocess.run(['git', '-C', os.path.dirname(os.path.abspath(__file__)), 'rev-parse', 'HEAD'],
+                         capture_output=True, text=True)
+    return res.stdout.strip() or None
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with the baseline results.
+
+    :param results: Benchmark results.
+    :param baseline: Baseline benchmark results.
+    :param threshold: Allowed relative increase, e.g. 0.2 for 20%.
+    :return: List of regression messages.
+    """
+    regressions = []
+    for name, stages in results['workloads'].items():
+        for stage, metrics in stages.items():
+            try:
+                base_metrics = baseline['workloads'][name][stage]
+            except KeyError:
+                continue
+            for metric in checked_metrics:
+                value = metrics.get(metric)
+                base_value = base_metrics.get(metric)
+                if not value or not base_value:
+                    continue
+                if value > base_value * (1 + threshold):
+                    regressions.append(f"{name}/{stage}/{metric}: {value} vs baseline {base_value} "
+                                       f"(+{100 * (value / base_value - 1):.0f}%)")
+    return regressions
+
+
+# Initialize Environment
+projectname = "qlik"
+config = my_env.init_env(projectname, __file__)
+# Configure command line arguments and environment
+parser = argparse.ArgumentParser(description="Benchmark explore, reload and git stages on the Engine simulator")
+parser.add_argument('-w', '--workloads', nargs='+', default=list(workloads), choices=list(workloads),
+                    help='Workloads to run.')
+parser.add_argument('-o', '--output', type=str, default='benchmark.json', help='Result file (json).')
+parser.add_argument('-b', '--baseline', type=str, help='Baseline result file to compare with.')
+parser.add_argument('--threshold', type=float, default=0.2,
+                    help='Allowed relative increase compared with the baseline, default 0.2 (20%%).')
+parser.add_argument('-c', '--concurrency', type=int, default=4, help='Explore concurrency.')
+parser.add_argument('--reload-time', type=float, default=0.2, help='Simulated reload duration in seconds.')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the simulated site.')
+args = parser.parse_args()
+logging.info("Arguments: {a}".format(a=args))
+
+bench = dict(
+    timestamp=datetime.datetime.now().isoformat(timespec='seconds'),
+    revision=get_revision(),
+    host=platform.node(),
+    python=platform.python_version(),
+    concurrency=args.concurrency,
+    workloads={name: run_workload(name, workloads[name]) for name in args.workloads}
+)
+with open(args.output, 'w', encoding='utf-8') as fh:
+    json.dump(bench, fh, indent=2)
+print(json.dumps(bench['workloads'], indent=2))
+failed_stages = [f"{name}/{stage}" for name, stages in bench['workloads'].items() for stage, metrics in stages.items()
+                 if metrics['returncode'] != 0]
+if failed_stages:
+    print(f"FAILED stages: {', '.join(failed_stages)}")
+    logging.error(f"Failed stages: {failed_stages}")
+    sys.exit(1)
+if args.baseline:
+    with open(args.baseline, encoding='utf-8') as fh:
+        baseline_results = json.load(fh)
+    regressions = compare(bench, baseline_results, args.threshold)
+    if regressions:
+        print("PERFORMANCE REGRESSION against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        logging.error(f"Performance regression: {regressions}")
+        sys.exit(1)
+logging.info("End Application")
@@ -7,138 +7,610 @@ git_processing.
 """
 
 import argparse
-import shutil
+import concurrent.futures
+import datetime
+from lib.engine_metrics import metrics
+from lib.explore_shards import get_shard, get_shard_dir, parse_shard
+from lib.run_report import RunReport
 from lib.sense_engine_api import *
+from lib.snapshot_checkpoint import Checkpoint
+from lib.snapshot_index import AppObjects, SnapshotIndex, get_time
+from lib.snapshot_manifest import Manifest
+from lib.snapshot_normalize import get_normalizer
+from lib.snapshot_store import get_store
+from lib.snapshot_writer import SnapshotWriter
 
 
-async def dimensions(websocket, handle, dim_list, app_path):
+async def in_state_thread(func, *args):
+    """
+    Coroutine to run a function on the state of the run (snapshot index, manifest) in the state thread. The index update
+    can wait for the database lock of another shard and the manifest file is written for every application, the
+    event loop keeps handling the engine sessions in the meantime. The state thread runs one function at a time, in
+    the order in which they are submitted.
+
+    :param func: Function to run.
+    :param args: Arguments for the function.
+    :return: Result of the function.
+    """
+    return await asyncio.get_running_loop().run_in_executor(state_pool, func, *args)
+
+
+async def cancel_tasks(tasks):
+    """
+    Coroutine to cancel the tasks and wait until they are finished.
+
+    :param tasks: List of tasks.
+    :return:
+    """
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return
+
+
+async def gather(*aws, return_exceptions=False):
+    """
+    Coroutine to run awaitables at the same time, as asyncio.gather. If one of them fails, or the coroutine is
+    cancelled, the other awaitables are cancelled and finished before the exception is raised. So no request of an
+    application is still running, and writing files, when the application is discarded.
+
+    :param aws: Coroutines or tasks.
+    :param return_exceptions: If set then exceptions are returned as results, as for asyncio.gather.
+    :return: List with the results, in the order of the awaitables.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    except BaseException:
+        await cancel_tasks(tasks)
+        raise
+
+
+async def get_master_item(session, handle, qid, get_item, object_slots, objects, qtype):
+    """
+    Coroutine to get the properties of a master item. The number of objects that are collected at the same time is
+    limited by object_slots. A master item for which the engine does not reply in time is skipped.
+
+    :param session: Engine session for the application
+    :param handle: Handle to connect to - this is for the app.
+    :param qid: Id for the master item.
+    :param get_item: Engine API method to get the handle for the master item (get_dimension, get_measure).
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param objects: AppObjects of the application for the snapshot index.
+    :param qtype: dimension or measure.
+    :return: Properties of the master item, None if the master item has been skipped.
+    """
+    async with object_slots:
+        try:
+            item_handle = await get_item(session, handle, qid)
+            return await get_properties(session, item_handle)
+        except EngineTimeout as e:
+            objects.skip(qid, qtype, e)
+            return None
+
+
+def claim_file(path, title, qid):
+    """
+    Claim the json file for an object. An object with the title of an object that has been written before in this run
+    gets the object id in the filename, so objects with the same title do not overwrite each other.
+
+    :param path: Directory for the file.
+    :param title: Title of the object.
+    :param qid: Id for the object.
+    :return: Tuple (path, filename) for the file.
+    """
+    filepath = changes.claim(os.path.join(path, my_env.get_valid_filename(f"{title}.json")), qid, ext='.json')
+    return os.path.split(filepath)
+
+
+async def dimensions(session, handle, dim_list, app_path, object_slots, writes, objects):
     """
     Coroutine to collect dimension information in dictionary with key dimension name and value the dictionary for this
-    dimension.
+    dimension. All dimensions are collected at the same time, files are written in the order of the dimension list.
 
-    :param websocket: Websocket connection
+    :param session: Engine session for the application
     :param handle: Handle to connect to - this is for the app.
     :param dim_list: List with dimensions from the application.
     :param app_path: Path for the Application information.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param writes: WriteGroup of the application, files are written by the snapshot writer.
+    :param objects: AppObjects of the application for the snapshot index.
     :return: Dictionary with key dimension name and value the dictionary for the dimension.
     """
-    global sid
-    for dim in dim_list:
-        dimension_handle = await get_dimension(websocket, sid := sid + 1, handle, dim['qInfo']['qId'])
-        dimension_data = await get_properties(websocket, sid := sid + 1, dimension_handle)
+    dimension_list = await gather(*[get_master_item(session, handle, dim['qInfo']['qId'], get_dimension,
+                                                    object_slots, objects, 'dimension') for dim in dim_list])
+    for dimension_data in dimension_list:
+        if dimension_data is None:
+            continue
         title = dimension_data["qDim"]["title"]
-        my_env.dump_structure(dimension_data, os.path.join(app_path, 'QSMasterDimensions'), f"{title}.json")
+        qid = dimension_data['qInfo']['qId']
+        path, filename = claim_file(os.path.join(app_path, 'QSMasterDimensions'), title, qid)
+        objects.add('dimension', qid, title, os.path.join(path, filename))
+        await writes.dump(dimension_data, path, filename)
     return
 
 
-async def measurements(websocket, handle, measure_list, app_path):
+async def measurements(session, handle, measure_list, app_path, object_slots, writes, objects):
     """
     Coroutine to collect measurement information in dictionary with key measurement name and value the dictionary for
-    this measurement.
+    this measurement. All measurements are collected at the same time, files are written in the order of the
+    measurement list.
 
-    :param websocket: Websocket connection
+    :param session: Engine session for the application
     :param handle: Handle to connect to - this is for the app.
     :param measure_list: List with measurements from the application.
     :param app_path: Path for the Application storage.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param writes: WriteGroup of the application, files are written by the snapshot writer.
+    :param objects: AppObjects of the application for the snapshot index.
     :return: Dictionary with key measurement name and value the dictionary for the measurement.
     """
-    global sid
-    for measure in measure_list:
-        measure_handle = await get_measure(websocket, sid := sid + 1, handle, measure['qInfo']['qId'])
-        measure_data = await get_properties(websocket, sid := sid+1, measure_handle)
+    measure_list = await gather(*[get_master_item(session, handle, measure['qInfo']['qId'], get_measure,
+                                                  object_slots, objects, 'measure') for measure in measure_list])
+    for measure_data in measure_list:
+        if measure_data is None:
+            continue
         title = measure_data['qMeasure']['qLabel']
-        my_env.dump_structure(measure_data, os.path.join(app_path, 'QSMasterMeasures'), f"{title}.json")
+        qid = measure_data['qInfo']['qId']
+        path, filename = claim_file(os.path.join(app_path, 'QSMasterMeasures'), title, qid)
+        objects.add('measure', qid, title, os.path.join(path, filename))
+        await writes.dump(measure_data, path, filename)
+    return
+
+
+async def get_app_lists(session, handle):
+    """
+    Coroutine to create the session object with the sheet, dimension, measure and variable lists and get its layout.
+
+    :param session: Engine session for the application
+    :param handle: Handle to connect to - this is for the app.
+    :return: Layout of the lists session object.
+    """
+    objects_handle = await create_app_objectlist(session, handle)
+    return await get_layout(session, objects_handle)
+
+
+# Object types from GetAllInfos that are never a sheet child.
+no_child_types = {'sheet', 'dimension', 'measure', 'masterobject', 'variable', 'bookmark', 'story', 'slide',
+                  'slideitem', 'snapshot', 'embeddedsnapshot', 'appprops', 'LoadModel', 'AppLists'}
+
+
+async def fetch_object(session, handle, qid, object_slots):
+    """
+    Coroutine to get the full property tree for an object. The number of objects that are collected at the same time
+    is limited by object_slots.
+
+    :param session: Engine session for the application
+    :param handle: Handle to connect to - this is for the app.
+    :param qid: Id for the object.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :return: Full property tree.
+    """
+    async with object_slots:
+        object_handle = await get_object(session, handle, qid)
+        return await get_fullpropertytree(session, object_handle)
+
+
+async def fetch_sheet(session, handle, qid, object_slots, objects):
+    """
+    Coroutine to get the layout and the properties of a sheet. The full property tree of a sheet has the property trees
+    of all sheet children, these are collected as separate objects. A sheet for which the engine does not reply in
+    time is skipped with its children.
+
+    :param session: Engine session for the application
+    :param handle: Handle to connect to - this is for the app.
+    :param qid: Id for the sheet.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return: Tuple (layout, properties), None if the sheet has been skipped.
+    """
+    async with object_slots:
+        try:
+            object_handle = await get_object(session, handle, qid)
+            return await gather(get_layout(session, object_handle), get_properties(session, object_handle))
+        except EngineTimeout as e:
+            objects.skip(qid, 'sheet', e)
+            return None
+
+
+async def write_child(session, handle, qid, object_slots, targets, targets_ready, writes, objects):
+    """
+    Coroutine to collect a candidate sheet child and write it as soon as the sheet layouts tell where it goes. The
+    object keeps its slot until it is queued for the writer, so at most object_slots property trees are in memory at
+    the same time, plus the trees in the write queue.
+
+    :param session: Engine session for the application
+    :param handle: Handle to connect to - this is for the app.
+    :param qid: Id for the object.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param targets: Dictionary with key child id and value the list of (child path, filename) for the child files.
+    :param targets_ready: Event that is set when targets is complete.
+    :param writes: WriteGroup of the application, files are written by the snapshot writer.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return: True if the object is a sheet child and has been written, False otherwise.
+    """
+    async with object_slots:
+        object_handle = await get_object(session, handle, qid)
+        tree = await get_fullpropertytree(session, object_handle)
+        await targets_ready.wait()
+        if qid in targets:
+            objects.add_refs(qid, tree)
+        for child_path, filename in targets.get(qid, []):
+            await writes.dump(tree, child_path, filename)
+    return qid in targets
+
+
+def skip_child(qid, qtype, error, targets, objects):
+    """
+    Skip a sheet child for which the engine did not reply in time. The files of the child keep the content of the last
+    snapshot.
+
+    :param qid: Id for the object.
+    :param qtype: Object type.
+    :param error: EngineTimeout for the request.
+    :param targets: Dictionary with key child id and value the list of (child path, filename) for the child files.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return:
+    """
+    objects.skip(qid, qtype, error)
+    for child_path, filename in targets[qid]:
+        changes.keep_file(os.path.join(child_path, filename))
     return
 
 
-async def handle_sheets(websocket, handle, sheet_list, app_path):
+async def handle_sheets(session, handle, sheet_list, app_path, object_slots, writes, objects):
     """
     Coroutine to collect sheet information and sheet child information.
+    All objects in the application are enumerated up front with GetAllInfos. Sheets and candidate child objects are then
+    collected at the same time, so the child requests do not have to wait for the sheet layouts. A child is written as
+    soon as it is available and the sheet layouts are known, so memory use does not grow with the application size.
 
-    :param websocket: Websocket connection
+    :param session: Engine session for the application
     :param handle: Handle to connect to - this is for the app.
-    :param sheet_list: List with measurements from the application.
+    :param sheet_list: List with sheets from the application.
     :param app_path: Path for application information.
-    :return: Dictionary with key measurement name and value the dictionary for the measurement.
+    :param object_slots: Semaphore that limits the number of objects in flight for the application.
+    :param writes: WriteGroup of the application, files are written by the snapshot writer.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return:
     """
-    global sid
-    for sheet in sheet_list:
-        sheet_handle = await get_object(websocket, sid := sid + 1, handle, sheet['qInfo']['qId'])
-        sheet_name = sheet['qMeta']['title']
-        sheet_path = my_env.get_valid_path(app_path, sheet_name)
-        sheet_layout = await get_layout(websocket, sid := sid + 1, sheet_handle)
-        sheet_props = await get_fullpropertytree(websocket, sid := sid + 1, sheet_handle)
-        title = sheet_props['qProperty']['qMetaDef']['title']
-        my_env.dump_structure(sheet_layout, sheet_path, f'{title}.json')
-        sheet_children = sheet_layout['qChildList']['qItems']
-        for child in sheet_children:
-            try:
-                child_id = child['qInfo']['qId']
-                child_type = child['qInfo']['qType']
-            except KeyError:
-                logging.error(f"Issue with child collection on sheet {sheet_name}")
+    all_infos = await get_all_infos(session, handle)
+    sheet_ids = [sheet['qInfo']['qId'] for sheet in sheet_list]
+    child_types = {info['qId']: info['qType'] for info in all_infos
+                   if info['qType'] not in no_child_types and info['qId'] not in sheet_ids}
+    child_ids = list(child_types)
+    targets = {}
+    targets_ready = asyncio.Event()
+    # Sheet requests are started first, so they get an object slot before the children that wait for the layouts.
+    sheet_tasks = [asyncio.ensure_future(fetch_sheet(session, handle, qid, object_slots, objects)) for qid in sheet_ids]
+    # An object that cannot be collected is only an issue if it is a sheet child.
+    child_tasks = [asyncio.ensure_future(write_child(session, handle, qid, object_slots, targets, targets_ready, writes,
+                                                     objects)) for qid in child_ids]
+    try:
+        sheet_results = await gather(*sheet_tasks)
+        # Child files are claimed in sheet order. A child with the title of another child gets its id in the filename.
+        for sheet, sheet_result in zip(sheet_list, sheet_results):
+            sheet_name = sheet['qMeta']['title']
+            sheet_id = sheet['qInfo']['qId']
+            sheet_path = my_env.get_valid_path(app_path, sheet_name, changes, sheet_id)
+            if sheet_result is None:
+                # Skipped sheet, the sheet and its children keep the files of the last snapshot.
+                changes.keep(sheet_path)
                 continue
-            else:
-                child_path = my_env.get_valid_path(sheet_path, child_type)
-                title = child['qData']['title']
-                if isinstance(title, dict) or len(title) == 0:
-                    title = child_id
-                child_handle = await get_object(websocket, sid := sid + 1, handle, child_id)
-                child_layout = await get_fullpropertytree(websocket, sid := sid+1, child_handle)
-                my_env.dump_structure(child_layout, child_path, f"{title}.json")
+            sheet_layout, sheet_props = sheet_result
+            title = sheet_props['qMetaDef']['title']
+            sheet_file = my_env.get_valid_filename(f'{title}.json')
+            objects.add('sheet', sheet_id, title, os.path.join(sheet_path, sheet_file))
+            await writes.dump(sheet_layout, sheet_path, sheet_file, layout=True)
+            sheet_children = sheet_layout['qChildList']['qItems']
+            for child in sheet_children:
+                try:
+                    child_id = child['qInfo']['qId']
+                    child_type = child['qInfo']['qType']
+                except KeyError:
+                    logging.error(f"Issue with child collection on sheet {sheet_name}")
+                    continue
+                else:
+                    child_path = my_env.get_valid_path(sheet_path, child_type, changes)
+                    title = child['qData']['title']
+                    if isinstance(title, dict) or len(title) == 0:
+                        title = child_id
+                    child_file = claim_file(child_path, title, child_id)
+                    objects.add(child_type, child_id, title, os.path.join(*child_file), parent=sheet_id)
+                    files = targets.setdefault(child_id, [])
+                    if child_file not in files:
+                        files.append(child_file)
+        targets_ready.set()
+        child_results = await gather(*child_tasks, return_exceptions=True)
+    except BaseException:
+        # No child is still running, and writing, when the application is discarded.
+        await cancel_tasks(child_tasks)
+        raise
+    written = set()
+    for qid, res in zip(child_ids, child_results):
+        if res is True:
+            written.add(qid)
+        elif isinstance(res, EngineTimeout) and qid in targets:
+            skip_child(qid, child_types[qid], res, targets, objects)
+            written.add(qid)
+    for child_id, files in targets.items():
+        if child_id in written:
+            continue
+        # Child not in GetAllInfos or first request failed, collect it now.
+        try:
+            child_layout = await fetch_object(session, handle, child_id, object_slots)
+        except EngineTimeout as e:
+            skip_child(child_id, child_types.get(child_id, 'object'), e, targets, objects)
+            continue
+        objects.add_refs(child_id, child_layout)
+        for child_path, filename in files:
+            await writes.dump(child_layout, child_path, filename)
+    return
+
+
+async def collect_app(doc, app_path, objects):
+    """
+    Coroutine to collect the information of an application and write it to the application path. The application has
+    its own connection and session.
+
+    :param doc: Application dictionary from the doclist.
+    :param app_path: Path for the Application information.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return: True if the application information has been collected, False if the application could not be opened.
+    """
+    doc_id = doc['qDocId']
+    # New websocket connection is required for each open app. All files of the app are written at the exit of writes.
+    async with writer.group() as writes, open_session(doc_id, **props) as session:
+        # Open Application
+        app_handle = await open_app(session, doc_id)
+        if isinstance(app_handle, str):
+            # Error message found, app_handle needs to be int
+            run_report.add_app(doc, 'failed', app_handle)
+            return False
+        # App Properties, Script, Object lists (with variables) and Connections are independent requests.
+        app_props, script, layout, connections = await gather(
+            get_app_properties(session, app_handle),
+            get_script(session, app_handle),
+            get_app_lists(session, app_handle),
+            get_connections(session, app_handle))
+        await writes.dump(app_props, app_path, "app_properties.json")
+        doc_name = os.path.splitext(doc['qDocName'])[0]
+        load_script = my_env.get_valid_path(app_path, f"{doc_name}.qvs", changes)
+        await writes.write(load_script, str.encode(script))
+        # Get variable list
+        variables = layout['qVariableList']['qItems']
+        await writes.dump(variables, app_path, "variables.json", sort_keys=True)
+        await writes.dump(connections, app_path, "connections.json")
+        objects.add_file(load_script)
+        for filename in ("app_properties.json", "variables.json", "connections.json"):
+            objects.add_file(os.path.join(app_path, filename))
+        for variable in variables:
+            objects.add('variable', variable['qInfo']['qId'], variable.get('qName'), struct=variable)
+        for connection in connections:
+            objects.add('connection', connection['qId'], connection.get('qName'), struct=connection)
+        # Collect master dimension, master measurement and sheet information at the same time.
+        object_slots = asyncio.Semaphore(args.batch)
+        await gather(
+            dimensions(session, app_handle, layout['qDimensionList']['qItems'], app_path, object_slots, writes,
+                       objects),
+            measurements(session, app_handle, layout['qMeasureList']['qItems'], app_path, object_slots, writes,
+                         objects),
+            handle_sheets(session, app_handle, layout['qAppObjectList']['qItems'], app_path, object_slots, writes,
+                          objects))
+    return True
+
+
+def get_app_deadline(doc):
+    """
+    This function returns the deadline in seconds for the collection of the application: the deadline for the
+    application title in section ExploreDeadlines of the ini file (case insensitive), default key app_deadline in
+    section Explore.
+
+    :param doc: Application dictionary from the doclist.
+    :return: Deadline in seconds, None for no deadline.
+    """
+    deadline = config['Explore'].get('app_deadline') if 'Explore' in config else None
+    if 'ExploreDeadlines' in config:
+        deadlines = {key.lower(): value for key, value in config['ExploreDeadlines'].items()}
+        deadline = deadlines.get(doc['qTitle'].lower(), deadline)
+    return float(deadline) if deadline else None
+
+
+async def keep_skipped(doc, objects):
+    """
+    Coroutine to register the objects that have been skipped in the run report. A skipped object keeps the files of
+    the last snapshot, a skipped sheet keeps the files of its children as well. The objects and files of the last
+    snapshot are found in the snapshot index, so the index keeps the skipped objects.
+
+    :param doc: Application dictionary from the doclist.
+    :param objects: AppObjects of the application for the snapshot index.
+    :return:
+    """
+    for qid, qtype, error in objects.skipped:
+        logging.warning(f"App {doc['qDocName']}: {qtype} {qid} skipped, {error}")
+        run_report.add_object(doc, qid, qtype, error)
+        for obj in await in_state_thread(index.get_objects, doc['qDocId'], qid):
+            if (obj['qid'], obj['parent']) not in objects.objects and changes.keep_file(obj['filepath']):
+                objects.keep(obj)
+    return
+
+
+async def explore_app(doc):
+    """
+    Coroutine to collect all information for one application. In incremental mode the application is skipped if it
+    did not change since the last successful run, an application that has been collected before the resumed run was
+    interrupted is skipped as well.
+    The application is written to a staging directory that is swapped in when the application is complete. If the
+    collection fails or does not finish before the deadline of the application, the application keeps the files of
+    the last snapshot. Objects that have been skipped keep the files of the last snapshot, the application is collected
+    again in the next incremental run.
+
+    :param doc: Application dictionary from the doclist.
+    :return: True if the application information is available in the snapshot, False otherwise.
+    """
+    app_name = doc['qTitle']
+    doc_id = doc['qDocId']
+    stream_dir = set_stream_dir(args.target, doc['qMeta'], workdir, changes)
+    # Set and create Application Path
+    app_path = my_env.get_valid_path(stream_dir, app_name, changes, doc_id)
+    if checkpoint is not None and checkpoint.is_done(doc_id):
+        logging.debug(f"App {doc['qDocName']} collected before the run was interrupted, skipped.")
+        return True
+    if args.incremental:
+        if manifest.is_unchanged(doc, app_path, changes.isdir):
+            logging.debug(f"App {doc['qDocName']} did not change, skipped.")
+            await in_state_thread(index.touch_app, doc_id, seen)
+            return True
+        # Remove previous version of the application if it has been renamed or moved to another stream.
+        old_path = manifest.get_path(doc_id)
+        if old_path and old_path != app_path and changes.isdir(old_path):
+            changes.remove_tree(old_path)
+        manifest.remove(doc_id)
+    logging.info(f"Collecting info for {doc['qDocName']} on {stream_dir}")
+    changes.stage(app_path)
+    objects = AppObjects()
+    deadline = get_app_deadline(doc)
+    try:
+        collected = await asyncio.wait_for(collect_app(doc, app_path, objects), deadline)
+        if collected:
+            await keep_skipped(doc, objects)
+            # Remove files of objects that no longer exist in the application.
+            changes.sweep(app_path)
+    except asyncio.TimeoutError as e:
+        # Timeout of a request for the application (EngineTimeout) or of the application. The session is closed.
+        changes.discard(app_path)
+        msg = str(e) if isinstance(e, EngineTimeout) else f"not collected within {deadline:g} seconds"
+        logging.error(f"Exploration of app {doc['qDocName']} ({app_name}) skipped: {msg}")
+        run_report.add_app(doc, 'timeout', msg)
+        return False
+    except BaseException:
+        changes.discard(app_path)
+        raise
+    if not collected:
+        changes.discard(app_path)
+        return False
+    files = changes.commit(app_path)
+    await in_state_thread(index.update_app, doc, app_path, objects, changes, seen)
+    if not objects.skipped:
+        manifest.update(doc, app_path)
+        # The manifest changes while the copy is written.
+        await in_state_thread(manifest.save, dict(manifest.apps))
+    if checkpoint is not None:
+        checkpoint.add(doc_id, files, changes)
+    return True
+
+
+async def explore_app_bounded(doc, app_slots):
+    """
+    Coroutine to explore an application as soon as a connection slot is available. A failure is logged and returned,
+    so it does not stop the exploration of the other applications.
+
+    :param doc: Application dictionary from the doclist.
+    :param app_slots: Semaphore that limits the number of applications explored at the same time.
+    :return: True if the application information is available in the snapshot, False otherwise.
+    """
+    async with app_slots:
+        try:
+            return await explore_app(doc)
+        except Exception as e:
+            logging.exception(f"Exploration of app {doc['qDocName']} ({doc['qTitle']}) failed: {e}")
+            run_report.add_app(doc, 'failed', e)
+            return False
+
+
+def remove_deleted_apps(doclist):
+    """
+    This function removes the application directories for applications that are in the manifest but no longer on the
+    engine. Directories are removed one at a time, an empty stream directory is removed as well.
+
+    :param doclist: List of application dictionaries from the engine.
+    :return:
+    """
+    for doc_id in manifest.deleted(doclist):
+        app_path = manifest.get_path(doc_id)
+        logging.info(f"App {doc_id} no longer available, remove {app_path}")
+        if changes.isdir(app_path):
+            changes.remove_tree(app_path)
+        stream_dir = os.path.dirname(app_path)
+        if stream_dir != workdir:
+            changes.rmdir(stream_dir)
+        manifest.remove(doc_id)
+        manifest.save()
     return
 
 
 async def main():
-    global sid
     # Connect to engine and collect list of applications
-    async with set_connection(**props) as websocket:
-        msg = await websocket.recv()
-        logging.debug(f"< {msg}")
-        doclist_all = await get_doclist(websocket, sid := sid + 1)
+    async with open_session(**props) as session:
+        doclist_all = await get_doclist(session)
     doclist = [doc for doc in doclist_all if doc['qDocName'] != 'Operations Monitor']
+    if shard:
+        # The shard collects its own applications only, the coordinator removes deleted applications.
+        doclist = [doc for doc in doclist if get_shard(doc, shards, args.shard_by) == shard]
+        manifest.restrict(doc['qDocId'] for doc in doclist)
+        manifest.save()
+        logging.info(f"Shard {shard}/{shards} by {args.shard_by}: {len(doclist)} of {len(doclist_all)} apps")
+    elif args.incremental:
+        remove_deleted_apps(doclist)
     # For each application collect the information in the stream\application directory
-    for doc in doclist:
-        app_name = doc['qTitle']
-        stream_dir = set_stream_dir(args.target, doc['qMeta'], workdir)
-        logging.info(f"Collecting info for {doc['qDocName']} on {stream_dir}")
-        # Set and create Application Path
-        app_path = my_env.get_valid_path(stream_dir, app_name)
-        os.mkdir(app_path)
-        # New websocket connection is required for each open app.
-        doc_id = doc['qDocId']
-        async with set_connection(doc_id, **props) as websocket:
-            sid = 0
-            msg = await websocket.recv()
-            logging.debug(f"< {msg}")
-            # Open Application
-            app_handle = await open_app(websocket, sid := sid+1, doc_id)
-            if isinstance(app_handle, str):
-                # Error message found, app_handle needs to be int
-                continue
-            # Get App Properties
-            app_props = await get_app_properties(websocket, sid := sid+1, app_handle)
-            my_env.dump_structure(app_props, app_path, "app_properties.json")
-            # Get Script
-            script = await get_script(websocket, sid := sid+1, app_handle)
-            doc_name = os.path.splitext(doc['qDocName'])[0]
-            load_script = my_env.get_valid_path(app_path, f"{doc_name}.qvs")
-            with open(load_script, 'wb') as fh:
-                fh.write(str.encode(script))
-            # Collect Sheets, dimensions and measures layout
-            objects_handle = await create_app_objectlist(websocket, sid := sid+1, app_handle)
-            layout = await get_layout(websocket, sid := sid+1, objects_handle)
-            # Get variable list
-            variables = layout['qVariableList']['qItems']
-            my_env.dump_structure(variables, app_path, "variables.json", sort_keys=True)
-            connections = await get_connections(websocket, sid := sid+1, app_handle)
-            my_env.dump_structure(connections, app_path, "connections.json")
-            # Collect master dimension information
-            await dimensions(websocket, app_handle, layout['qDimensionList']['qItems'], app_path)
-            # Collect master measurement information
-            await measurements(websocket, app_handle, layout['qMeasureList']['qItems'], app_path)
-            # Collect Sheet Information
-            await handle_sheets(websocket, app_handle, layout['qAppObjectList']['qItems'], app_path)
+    # At most args.concurrency applications are explored at the same time.
+    app_slots = asyncio.Semaphore(args.concurrency)
+    results = await asyncio.gather(*[explore_app_bounded(doc, app_slots) for doc in doclist])
+    writer.close()
+    state_pool.shutdown()
+    changes.close_staging()
+    logging.info(f"Write queue full {writer.waits} times.")
+    failed = [doc['qTitle'] for doc, res in zip(doclist, results) if not res]
+    if failed:
+        logging.error(f"Exploration failed for {len(failed)} of {len(doclist)} apps: {', '.join(failed)}")
+    if run_report.objects:
+        logging.warning(f"{len(run_report.objects)} objects skipped, see run_report.json.")
+    run_report.dump(statedir, len(doclist))
+    if not shard:
+        # The coordinator removes deleted applications from the index of a sharded run.
+        index.remove_deleted(doclist, seen)
+    index.close()
+    if not args.incremental and not shard:
+        # Remove all files that have not been collected in this run.
+        changes.sweep_snapshot()
+    commit = changes.close("Snapshot from {now:%d-%m-%Y %H:%M:%S}".format(now=datetime.datetime.now()))
+    report = changes.report()
+    if normalize is not None:
+        logging.info(f"Normalization removed {normalize.dropped} volatile values.")
+    if args.store == 'git':
+        # The changes have been committed, git_processing only needs to push the branch.
+        report['commit'] = commit
+    elif not shard:
+        try:
+            with open(os.path.join(props['statedir'], 'changes.json'), encoding='utf-8') as fh:
+                previous = json.load(fh)
+            if 'commit' not in previous:
+                report = my_env.merge_change_reports(previous, report, workdir)
+                logging.info("Changes of a previous run have not been committed, merged with the changes of this run.")
+        except FileNotFoundError:
+            pass
+    my_env.dump_structure(report, statedir, 'changes.json')
+    if shard:
+        # The coordinator needs all files of the shard to clean up the snapshot after a full run.
+        result = dict(
+            shard=shard,
+            shards=shards,
+            shard_by=args.shard_by,
+            incremental=args.incremental,
+            docs=[doc['qDocId'] for doc in doclist],
+            failed=[doc['qDocId'] for doc, res in zip(doclist, results) if not res],
+            files=sorted(os.path.relpath(filepath, workdir) for filepath, (status, _) in changes.files.items()
+                         if status != 'deleted')
+        )
+        my_env.dump_structure(result, statedir, 'result.json')
+    logging.info(f"{len(report['added'])} files added, {len(report['modified'])} modified, "
+                 f"{len(report['deleted'])} deleted, {report['unchanged']} unchanged")
+    largest = ', '.join(f"{path} ({size / 1024 / 1024:.1f} MB)" for path, size in changes.largest_files())
+    logging.info(f"Largest files: {largest}")
+    metrics.dump(statedir)
+    logging.info(f"Engine API time per method: {metrics.summary()}")
+    if checkpoint is not None:
+        checkpoint.remove()
     logging.info("End Application")
 
 
@@ -149,19 +621,79 @@ config = my_env.init_env(projectname, __file__)
 parser = argparse.ArgumentParser(description="Specify target environment")
 parser.add_argument('-t', '--target', type=str, default='Remote', choices=['Local', 'Remote'],
                     help='Please provide the target environment (Local, Remote).')
+parser.add_argument('-c', '--concurrency', type=int, default=1,
+                    help='Number of applications that are explored at the same time. Each application has its own '
+                         'connection to the engine.')
+parser.add_argument('-b', '--batch', type=int, default=50,
+                    help='Maximum number of object requests in flight for an application.')
+parser.add_argument('-w', '--writers', type=int, default=2,
+                    help='Number of threads that serialize and write the snapshot files.')
+parser.add_argument('-q', '--write-queue', type=int, default=100,
+                    help='Maximum number of files waiting to be written, collection waits if the queue is full.')
+parser.add_argument('-i', '--incremental', action='store_true',
+                    help='If set then collect only applications that changed since the last successful run. '
+                         'Otherwise the work directory is cleared and all applications are collected.')
+parser.add_argument('-s', '--store', type=str, default='directory', choices=['directory', 'git', 'cas'],
+                    help='Snapshot store: directory tree in the work directory (default), git to commit straight into '
+                         'branch <TARGET>_BRANCH of the git repository (<TARGET>_GITDIR, default the work directory) '
+                         'with git fast-import, the branch must not be checked out, or cas to store every file '
+                         'content once under its content hash (see qlik_materialize).')
+parser.add_argument('--shard', type=str,
+                    help='Collect only shard K of N (e.g. 2/8) of the applications, for the directory store. Use '
+                         'qlik_explore_shards to run all shards and merge the results.')
+parser.add_argument('--shard-by', type=str, default='docid', choices=['docid', 'stream'],
+                    help='Assign applications to shards by application ID (default) or by stream.')
+parser.add_argument('-r', '--resume', action='store_true',
+                    help='Continue the run that has been interrupted, for the directory store. Applications that have '
+                         'been collected before the interruption are not collected again.')
 args = parser.parse_args()
+if args.concurrency < 1:
+    parser.error("concurrency must be at least 1")
+if args.batch < 1:
+    parser.error("batch must be at least 1")
+if args.writers < 1 or args.write_queue < 1:
+    parser.error("writers and write queue must be at least 1")
+shard, shards = None, None
+if args.shard:
+    try:
+        shard, shards = parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.store != 'directory':
+        parser.error("shard requires the directory store")
+if args.resume and args.store != 'directory':
+    parser.error("resume requires the directory store, the other stores save the snapshot at the end of the run")
 logging.info("Arguments: {a}".format(a=args))
 props = init_env(args.target)
+props['deadlines'] = get_deadlines(config)
 workdir = props['workdir']
-
-# Remove all stream directories
-items = os.listdir(workdir)
-items2remove = [item for item in items if item != '.git']
-for item in items2remove:
-    path = os.path.join(workdir, item)
-    if os.path.isdir(path):
-        shutil.rmtree(path)
-
-sid = 0
+# A shard keeps its manifest, changes report and metrics in its own state directory.
+statedir = get_shard_dir(props['statedir'], shard) if shard else props['statedir']
+try:
+    changes = get_store(args.store, workdir, props['gitdir'], props['branch'])
+except ValueError as e:
+    parser.error(str(e))
+checkpoint = None
+if args.store == 'directory':
+    # The directory store writes every application when it is complete, the run continues from the checkpoint.
+    settings = dict(incremental=args.incremental, shard=args.shard, shard_by=args.shard_by)
+    try:
+        checkpoint = Checkpoint(os.path.join(statedir, 'checkpoint.jsonl'), workdir, settings, args.resume)
+    except ValueError as e:
+        parser.error(str(e))
+    checkpoint.restore(changes)
+    changes.init_staging(f"shard_{shard}" if shard else 'explore')
+# The manifest of a resumed full run has the applications that have been collected.
+manifest = Manifest(os.path.join(statedir, 'manifest.json'), workdir,
+                    reset=not args.incremental and not (checkpoint and checkpoint.apps),
+                    source=os.path.join(props['statedir'], 'manifest.json'))
+normalize = get_normalizer(config)
+writer = SnapshotWriter(changes, normalize, args.writers, args.write_queue)
+# The index of the site is in the state directory of the site, also for a shard.
+index = SnapshotIndex(os.path.join(props['statedir'], 'snapshot_index.db'), workdir)
+# The index and the manifest are updated in one thread, the index connection is used by one thread at a time.
+state_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+seen = get_time()
+run_report = RunReport()
 
 asyncio.run(main())
@@ -0,0 +1,215 @@
+#!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to collect the snapshot of a large site with several qlik_explore processes. The
+applications from GetDocList are split in shards (by application ID or by stream), every shard is explored by its own
+qlik_explore process. The shard results are merged into one manifest and one changes report for git_processing.
+The coordinator is the only process that removes content from the snapshot: directories of deleted applications and,
+after a full run, all files that no shard collected.
+Shards can also run on other hosts with the same work and state directory (qlik_explore --shard K/N), then use
+--merge-only to merge the results.
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+from lib.explore_shards import get_shard, read_shard_file, shards_dir
+from lib.run_report import merge_run_reports
+from lib.sense_engine_api import *
+from lib.snapshot_index import SnapshotIndex, get_time
+from lib.snapshot_manifest import Manifest
+
+
+async def get_apps():
+    async with open_session(**props) as session:
+        return await get_doclist(session)
+
+
+def run_shards():
+    """
+    Start one qlik_explore process per shard and wait until all processes are finished. To resume, shards that
+    finished are not started again and the other shards continue from their checkpoint.
+
+    :return: Dictionary with key shard number and value the exit code of the process.
+    """
+    if not args.resume:
+        shutil.rmtree(os.path.join(statedir, shards_dir), ignore_errors=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qlik_explore.py')
+    procs = {}
+    for shard in range(1, args.shards + 1):
+        if args.resume and read_shard_file(statedir, shard, 'result.json') is not None:
+            logging.info(f"Shard {shard} finished before the run was interrupted.")
+            continue
+        cmd = [sys.executable, script, '-t', args.target, '--shard', f"{shard}/{args.shards}", '--shard-by',
+               args.shard_by, '-c', str(args.concurrency), '-b', str(args.batch), '-w', str(args.writers), '-q',
+               str(args.write_queue)]
+        if args.incremental:
+            cmd.append('-i')
+        if args.resume:
+            cmd.append('--resume')
+        logging.debug(cmd)
+        procs[shard] = subprocess.Popen(cmd, env=os.environ.copy())
+    logging.info(f"{len(procs)} shards started")
+    return {shard: proc.wait() for shard, proc in procs.items()}
+
+
+def get_results():
+    """
+    Read the result of every shard. A shard result is only used if the shard finished with the same settings as this
+    run.
+
+    :return: Dictionary with key shard number and value the shard result, None if the shard did not finish.
+    """
+    results = {}
+    for shard in range(1, args.shards + 1):
+        result = read_shard_file(statedir, shard, 'result.json')
+        if result is not None and (result['shards'], result['shard_by'], result['incremental']) != \
+                (args.shards, args.shard_by, args.incremental):
+            logging.error(f"Shard {shard} ran with other settings: {result['shards']} shards by "
+                          f"{result['shard_by']}, incremental {result['incremental']}")
+            result = None
+        results[shard] = result
+    return results
+
+
+def merge_manifests(doclist, results):
+    """
+    Merge the manifests of the finished shards into the manifest of the site. An application of a shard that did not
+    finish keeps its entry from the last run in incremental mode, it is collected again if it changed.
+
+    :param doclist: List of application dictionaries from the engine.
+    :param results: Dictionary with the shard results.
+    :return: Merged manifest.
+    """
+    shard_manifests = {shard: read_shard_file(statedir, shard, 'manifest.json') if result is not None else None
+                       for shard, result in results.items()}
+    merged = Manifest(os.path.join(statedir, 'manifest.json'), workdir, reset=True)
+    for doc in doclist:
+        doc_id = doc['qDocId']
+        shard_manifest = shard_manifests[get_shard(doc, args.shards, args.shard_by)]
+        if shard_manifest is not None:
+            if doc_id in shard_manifest:
+                merged.apps[doc_id] = shard_manifest[doc_id]
+        elif args.incremental and doc_id in manifest.apps:
+            merged.apps[doc_id] = manifest.apps[doc_id]
+    return merged
+
+
+def remove_deleted_apps(doclist):
+    """
+    This function removes the application directories for applications that are in the manifest of the last run but
+    no longer on the engine. An empty stream directory is removed as well.
+
+    :param doclist: List of application dictionaries from the engine.
+    :return:
+    """
+    for doc_id in manifest.deleted(doclist):
+        app_path = manifest.get_path(doc_id)
+        logging.info(f"App {doc_id} no longer available, remove {app_path}")
+        if changes.isdir(app_path):
+            changes.remove_tree(app_path)
+        stream_dir = os.path.dirname(app_path)
+        if stream_dir != workdir:
+            changes.rmdir(stream_dir)
+    return
+
+
+def merge_reports(results):
+    """
+    Merge the changes reports of the shards and the clean up of the coordinator into one report. Changes of a previous
+    run that have not been committed are merged as well.
+
+    :param results: Dictionary with the shard results.
+    :return: Changes report for git_processing.
+    """
+    report = changes.report()
+    # Files of the shards are registered for the sweep only, the shard reports count them.
+    report['unchanged'] = 0
+    for shard in results:
+        shard_report = read_shard_file(statedir, shard, 'changes.json')
+        if shard_report is None:
+            continue
+        for status in ('added', 'modified', 'deleted'):
+            report[status].extend(shard_report[status])
+        report['unchanged'] += shard_report['unchanged']
+    for status in ('added', 'modified', 'deleted'):
+        report[status].sort()
+    try:
+        with open(os.path.join(statedir, 'changes.json'), encoding='utf-8') as fh:
+            previous = json.load(fh)
+        if 'commit' not in previous:
+            report = my_env.merge_change_reports(previous, report, workdir)
+            logging.info("Changes of a previous run have not been committed, merged with the changes of this run.")
+    except FileNotFoundError:
+        pass
+    return report
+
+
+# Initialize Environment
+projectname = "qlik"
+config = my_env.init_env(projectname, __file__)
+# Configure command line arguments and environment
+parser = argparse.ArgumentParser(description="Run qlik_explore in shards and merge the results")
+parser.add_argument('-t', '--target', type=str, default='Remote', choices=['Local', 'Remote'],
+                    help='Please provide the target environment (Local, Remote).')
+parser.add_argument('-n', '--shards', type=int, default=os.cpu_count(),
+                    help='Number of shards, one qlik_explore process per shard. Default is the number of cores.')
+parser.add_argument('--shard-by', type=str, default='docid', choices=['docid', 'stream'],
+                    help='Assign applications to shards by application ID (default) or by stream.')
+parser.add_argument('-c', '--concurrency', type=int, default=1,
+                    help='Number of applications that are explored at the same time by every shard.')
+parser.add_argument('-b', '--batch', type=int, default=50,
+                    help='Maximum number of object requests in flight for an application.')
+parser.add_argument('-w', '--writers', type=int, default=2,
+                    help='Number of threads that serialize and write the snapshot files in every shard.')
+parser.add_argument('-q', '--write-queue', type=int, default=100,
+                    help='Maximum number of files waiting to be written in every shard.')
+parser.add_argument('-i', '--incremental', action='store_true',
+                    help='If set then collect only applications that changed since the last successful run.')
+parser.add_argument('-r', '--resume', action='store_true',
+                    help='Continue the run that has been interrupted, every shard continues from its checkpoint.')
+parser.add_argument('--merge-only', action='store_true',
+                    help='Do not start the shards, merge the results of shards that ran on other hosts.')
+args = parser.parse_args()
+if args.shards < 1:
+    parser.error("shards must be at least 1")
+logging.info("Arguments: {a}".format(a=args))
+props = init_env(args.target)
+props['deadlines'] = get_deadlines(config)
+workdir = props['workdir']
+statedir = props['statedir']
+manifest = Manifest(os.path.join(statedir, 'manifest.json'), workdir)
+changes = my_env.ChangeSet(workdir)
+
+doclist = asyncio.run(get_apps())
+failed = []
+if not args.merge_only:
+    failed = [shard for shard, returncode in run_shards().items() if returncode != 0]
+results = get_results()
+failed = sorted(set(failed) | set(shard for shard, result in results.items() if result is None))
+if failed:
+    logging.error(f"Shard(s) {', '.join(str(shard) for shard in failed)} of {args.shards} failed, the snapshot is "
+                  f"not cleaned up.")
+remove_deleted_apps(doclist)
+# The shards update the index for their applications, deleted applications are removed by the coordinator.
+index = SnapshotIndex(os.path.join(statedir, 'snapshot_index.db'), workdir)
+index.remove_deleted(doclist, get_time())
+index.close()
+if not args.incremental and not failed:
+    # Remove all files that have not been collected by a shard.
+    for result in results.values():
+        for path in result['files']:
+            changes.record(os.path.join(workdir, path), 'unchanged')
+    changes.sweep_snapshot()
+merge_manifests(doclist, results).save()
+report = merge_reports(results)
+my_env.dump_structure(report, statedir, 'changes.json')
+run_report = merge_run_reports([read_shard_file(statedir, shard, 'run_report.json') for shard in results])
+my_env.dump_structure(run_report, statedir, 'run_report.json')
+apps_failed = sum(len(result['failed']) for result in results.values() if result is not None)
+logging.info(f"{len(report['added'])} files added, {len(report['modified'])} modified, {len(report['deleted'])} "
+             f"deleted, {report['unchanged']} unchanged by {args.shards} shards, {apps_failed} apps failed, "
+             f"{len(run_report['skipped'])} objects skipped")
+logging.info("End Application")
+if failed:
+    raise SystemExit(1)
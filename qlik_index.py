@@ -0,0 +1,84 @@
+#!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to query the snapshot index that qlik_explore keeps in the state directory: applications,
+objects by title, objects that use a master item and the files that changed since a date. Results are printed as tab
+separated lines with a header line.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+from lib import my_env
+from lib.sense_engine_api import init_env
+from lib.snapshot_index import SnapshotIndex
+
+
+def like(pattern):
+    # Title patterns use * as wildcard, as in the other scripts.
+    return pattern.replace('*', '%')
+
+
+def get_query():
+    """
+    Return the query for the command line arguments.
+
+    :return: Tuple with SQL statement and parameters.
+    """
+    if args.apps is not None:
+        return ("SELECT a.title AS app, COALESCE(s.name, 'Work') AS stream, a.doc_id, a.path, a.modified_date, "
+                "a.last_reload, a.collected FROM apps a LEFT JOIN streams s USING (stream_id) WHERE a.title LIKE ? "
+                "ORDER BY stream, app", (like(args.apps),))
+    if args.find is not None:
+        return ("SELECT a.title AS app, o.type, o.title, o.qid, o.path, o.changed FROM objects o JOIN apps a "
+                "USING (doc_id) WHERE o.title LIKE ? AND (? IS NULL OR o.type = ?) ORDER BY app, o.type, o.title",
+                (like(args.find), args.type, args.type))
+    if args.uses is not None:
+        return ("SELECT a.title AS app, m.type AS item_type, m.title AS item, o.type, o.title, o.path FROM refs r "
+                "JOIN objects m ON m.doc_id = r.doc_id AND m.qid = r.library_id AND m.type IN ('dimension', 'measure') "
+                "JOIN apps a ON a.doc_id = r.doc_id LEFT JOIN objects o ON o.doc_id = r.doc_id AND o.qid = r.qid "
+                "WHERE (r.library_id = ? OR m.title LIKE ?) AND (? IS NULL OR m.type = ?) "
+                "ORDER BY app, item, o.path", (args.uses, like(args.uses), args.type, args.type))
+    if args.changed_since is not None:
+        return ("SELECT c.time, c.status, c.path, a.title AS app FROM changes c LEFT JOIN apps a USING (doc_id) "
+                "WHERE c.time >= ? ORDER BY c.time, c.path", (args.changed_since,))
+    return args.sql, ()
+
+
+# Initialize Environment
+projectname = "qlik"
+config = my_env.init_env(projectname, __file__)
+# Configure command line arguments and environment
+parser = argparse.ArgumentParser(description="Query the snapshot index")
+parser.add_argument('-t', '--target', type=str, default='Remote', choices=['Local', 'Remote'],
+                    help='Please provide the target environment (Local, Remote).')
+query = parser.add_mutually_exclusive_group(required=True)
+query.add_argument('--apps', type=str, nargs='?', const='*', help='Applications with title pattern (e.g. "Sales*").')
+query.add_argument('--find', type=str, help='Objects with title pattern (e.g. "*Revenue*"), see --type.')
+query.add_argument('--uses', type=str,
+                   help='Objects that use the master dimension or measure with this qId or title pattern.')
+query.add_argument('--changed-since', type=str,
+                   help='Files added, modified or deleted since this date or time (UTC, e.g. 2024-05-14).')
+query.add_argument('--sql', type=str, help='SQL statement, see lib/snapshot_index.py for the tables.')
+parser.add_argument('--type', type=str, help='Only objects of this type (e.g. sheet, barchart, measure).')
+args = parser.parse_args()
+logging.info("Arguments: {a}".format(a=args))
+props = init_env(args.target)
+filename = os.path.join(props['statedir'], 'snapshot_index.db')
+if not os.path.isfile(filename):
+    print(f"No snapshot index {filename}, run qlik_explore first.", file=sys.stderr)
+    raise SystemExit(1)
+index = SnapshotIndex(filename, props['workdir'])
+try:
+    columns, rows = index.query(*get_query())
+except sqlite3.Error as e:
+    print(f"Query failed: {e}", file=sys.stderr)
+    raise SystemExit(1)
+finally:
+    index.close()
+print('\t'.join(columns))
+for row in rows:
+    print('\t'.join('' if value is None else str(value) for value in row))
+logging.info(f"{len(rows)} rows")
+logging.info("End Application")
@@ -0,0 +1,77 @@
+#!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to recreate the snapshot directory tree (stream/application/...) from the
+content-addressed store that qlik_explore writes with --store cas. Every file in the application manifests is copied
+(or hard linked) from the objects directory to the output directory.
+"""
+
+import argparse
+import fnmatch
+import logging
+import os
+import shutil
+from lib import my_env
+from lib.sense_engine_api import init_env
+from lib.snapshot_store import object_path, read_manifests
+
+
+def materialize(path, digest):
+    """
+    Create the file in the output directory from the object with the content hash.
+
+    :param path: File path relative to the snapshot root, with / as separator.
+    :param digest: Content hash of the file.
+    :return: True if the file has been created, False if the object is missing or damaged.
+    """
+    source = object_path(workdir, digest)
+    target = os.path.join(args.output, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if args.verify:
+        try:
+            with open(source, 'rb') as fh:
+                if my_env.get_digest(fh.read()) != digest:
+                    logging.error(f"Object {digest} for {path} is damaged.")
+                    return False
+        except FileNotFoundError:
+            pass
+    try:
+        if os.path.lexists(target):
+            os.remove(target)
+        if args.link:
+            os.link(source, target)
+        else:
+            shutil.copyfile(source, target)
+    except FileNotFoundError:
+        logging.error(f"Object {digest} for {path} not found.")
+        return False
+    return True
+
+
+# Initialize Environment
+projectname = "qlik"
+config = my_env.init_env(projectname, __file__)
+# Configure command line arguments and environment
+parser = argparse.ArgumentParser(description="Recreate the snapshot directory tree from the content-addressed store")
+parser.add_argument('-t', '--target', type=str, default='Remote', choices=['Local', 'Remote'],
+                    help='Please provide the target environment (Local, Remote).')
+parser.add_argument('-o', '--output', type=str, required=True, help='Output directory for the directory tree.')
+parser.add_argument('-a', '--apps', type=str, nargs='+',
+                    help='Only these directories, as stream/application path pattern (e.g. "Work/Sales*").')
+parser.add_argument('-l', '--link', action='store_true',
+                    help='Hard link the files to the objects instead of copying. Do not edit the linked files.')
+parser.add_argument('--verify', action='store_true', help='Verify the content hash of every object.')
+args = parser.parse_args()
+logging.info("Arguments: {a}".format(a=args))
+props = init_env(args.target)
+workdir = props['workdir']
+
+tree = read_manifests(workdir)
+if args.apps:
+    tree = {path: digest for path, digest in tree.items()
+            if any(fnmatch.fnmatch(path, f"{pattern}/*") for pattern in args.apps)}
+failed = [path for path, digest in sorted(tree.items()) if not materialize(path, digest)]
+logging.info(f"{len(tree) - len(failed)} files materialized in {args.output} from {len(set(tree.values()))} objects")
+if failed:
+    logging.error(f"{len(failed)} files could not be materialized.")
+    raise SystemExit(1)
+logging.info("End Application")
@@ -1,22 +1,221 @@
 #!/opt/envs/qlik/bin/python
 """"
-The purpose of this script is to reload Qlik applications. Applications are reloaded in sequence.
+The purpose of this script is to reload Qlik applications. Applications are reloaded in dependency order, independent
+applications are reloaded in parallel. Reload dependencies are defined in section ReloadDependencies of the ini file.
 """
 
 import argparse
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
 # import asyncio
 from lib import my_env
+from lib.engine_metrics import metrics
+from lib.reload_history import ReloadHistory
+from lib.reload_monitor import ReloadMonitor
+from lib.reload_scheduler import ReloadScheduler, get_dependencies
 from lib.sense_engine_api import *
 
 
+async def set_reload_variables(session, handle, app, variables):
+    """
+    Set the reload variables in the application before the reload. The variables must exist in the application.
+
+    :param session: Engine session for the application.
+    :param handle: Handle for the application.
+    :param app: Application name.
+    :param variables: Dictionary with key variable name and value the variable value.
+    :return: True if all variables have been set, False otherwise.
+    """
+    for name, value in variables.items():
+        variable_handle = await get_variable_by_name(session, handle, name)
+        if variable_handle is None:
+            logging.error(f"Reload variable {name} not found in app {app}.")
+            return False
+        if not await set_string_value(session, variable_handle, value):
+            logging.error(f"Could not set reload variable {name} in app {app}.")
+            return False
+        logging.info(f"App {app}: reload variable {name} set to {value}")
+    return True
+
+
+async def reload_app(app, doc_id, dryrun=False, deadline=None, mode='full', variables=None):
+    """
+    Coroutine to reload and save an application. The application has its own connection and session.
+
+    :param app: Application name.
+    :param doc_id: Application ID.
+    :param dryrun: If set then only open the application, do not reload.
+    :param deadline: Time (time.monotonic) at which the reload is cancelled, None for no deadline.
+    :param mode: Reload mode: full or partial.
+    :param variables: Dictionary with reload variables to set before the reload.
+    :return: True if the application has been reloaded and saved (or opened in dryrun), False otherwise.
+    """
+    logging.info(f"App {app} {mode} reload started.")
+    async with open_session(doc_id, **props) as session:
+        # Open Application
+        app_handle = await open_app(session, doc_id)
+        if isinstance(app_handle, str):
+            # Error message found, app_handle needs to be int
+            logging.fatal(f"Cannot open app {app} for reload.")
+            return False
+        if dryrun:
+            return True
+        if variables and not await set_reload_variables(session, app_handle, app, variables):
+            return False
+        # Configure Engine for Reload
+        await configure_reload(session)
+        # Reload
+        start = datetime.now(timezone.utc)
+        request_id, reload_future = await start_reload(session, app_handle, partial=(mode == 'partial'))
+        monitor = ReloadMonitor(session, app, deadline=deadline)
+        result = await monitor.wait(request_id, reload_future)
+        if result['status'] != 'ok':
+            logging.error(f"Issue with reload of app {app}: {result['status']} after {result['duration']} seconds.")
+            history.record(app, doc_id, mode, start, result['duration'], result['status'], messages=result['messages'])
+            return False
+        logging.info(f"App {app} reload done in {result['duration']} seconds, now commit change")
+        # await get_app_layout(session, app_handle)
+        save_start = time.monotonic()
+        saved = await do_save(session, app_handle)
+        save_duration = round(time.monotonic() - save_start, 3)
+    full_duration = history.average_duration(app, 'full')
+    slow = history.is_slow(app, mode, result['duration'], factor=float(config['Reload'].get('slow_factor', '2')))
+    if slow:
+        slow_apps.append(app)
+        logging.warning(f"App {app} {mode} reload took {result['duration']} seconds, much slower than the usual "
+                        f"{history.expected_duration(app, mode):.1f} seconds.")
+    history.record(app, doc_id, mode, start, result['duration'], 'ok' if saved else 'save_failed',
+                   save_duration=save_duration, messages=result['messages'], slow=slow)
+    if mode == 'partial' and full_duration:
+        logging.info(f"App {app} partial reload took {result['duration']} seconds, average full reload "
+                     f"{full_duration:.1f} seconds: {full_duration - result['duration']:.1f} seconds saved.")
+    return saved
+
+
+def get_app_option(section, app, default=None):
+    """
+    This function returns the value for the app from an ini file section. App names are matched case insensitive,
+    since the ini file keys are lowercase.
+
+    :param section: Name of the section in the ini file.
+    :param app: Application name.
+    :param default: Value if the section or the app is not in the ini file.
+    :return: Value for the app.
+    """
+    if section not in config:
+        return default
+    values = {key.lower(): value for key, value in config[section].items()}
+    return values.get(app.lower(), default)
+
+
+def get_reload_mode(app):
+    """
+    This function returns the reload mode for the app. The mode is --mode on the command line, or the mode for the app
+    in section ReloadModes, or key mode in section Reload, default full.
+    For mode partial_if_recent_full a partial reload is done if the last successful full reload is less than
+    full_max_age hours ago (section Reload, default 24), otherwise a full reload is done.
+
+    :param app: Application name.
+    :return: Reload mode for this run: full or partial.
+    """
+    mode = args.mode or get_app_option('ReloadModes', app, config['Reload'].get('mode', 'full'))
+    mode = mode.strip().lower()
+    if mode not in reload_modes:
+        logging.error(f"Unknown reload mode {mode} for app {app}, full reload is done.")
+        return 'full'
+    if mode == 'partial_if_recent_full':
+        hours = history.hours_since_full(app)
+        max_age = float(config['Reload'].get('full_max_age', '24'))
+        if hours is not None and hours <= max_age:
+            return 'partial'
+        logging.info(f"App {app}: no full reload in the last {max_age} hours, full reload is done.")
+        return 'full'
+    return mode
+
+
+def get_reload_variables(app):
+    """
+    This function returns the reload variables for the app from section ReloadVariables. The value is a semicolon
+    separated list of name=value pairs, e.g. vStartDate=2024-01-01; vRegion=EU.
+
+    :param app: Application name.
+    :return: Dictionary with key variable name and value the variable value.
+    """
+    variables = {}
+    value = get_app_option('ReloadVariables', app, '')
+    for pair in value.split(';'):
+        if not pair.strip():
+            continue
+        try:
+            name, var_value = pair.split('=', 1)
+        except ValueError:
+            logging.error(f"Reload variable {pair} for app {app} ignored, expected name=value.")
+            continue
+        variables[name.strip()] = var_value.strip()
+    return variables
+
+
+def get_deadline(app, start):
+    """
+    This function calculates the deadline for the reload of the app: the earliest of the application deadline and the
+    global deadline. The application deadline (seconds) is in section ReloadDeadlines of the ini file, default is key
+    deadline in section Reload. Key global_deadline in section Reload is the maximum duration of the full batch.
+
+    :param app: Application name.
+    :param start: Start time of the batch (time.monotonic).
+    :return: Deadline as time.monotonic value, or None for no deadline.
+    """
+    deadlines = []
+    app_deadline = get_app_option('ReloadDeadlines', app, config['Reload'].get('deadline'))
+    if app_deadline:
+        deadlines.append(time.monotonic() + float(app_deadline))
+    global_deadline = config['Reload'].get('global_deadline')
+    if global_deadline:
+        deadlines.append(start + float(global_deadline))
+    return min(deadlines) if deadlines else None
+
+
+def get_expected_durations(apps, modes):
+    """
+    This function returns the expected reload duration for the apps from the reload history. Apps without history
+    get the median of the apps with history.
+
+    :param apps: List of apps to reload.
+    :param modes: Dictionary with key app and value the reload mode for this run.
+    :return: Tuple with dictionary key app and value expected duration in seconds, and list of apps without history.
+    """
+    durations = {}
+    unknown = []
+    for app in apps:
+        duration = history.expected_duration(app, modes[app])
+        if duration is None:
+            unknown.append(app)
+        else:
+            durations[app] = duration
+    default = statistics.median(durations.values()) if durations else 0
+    for app in unknown:
+        durations[app] = default
+    return durations, unknown
+
+
+def format_eta(seconds):
+    """
+    Format an estimated duration as duration and time of day.
+
+    :param seconds: Estimated duration in seconds.
+    :return: String with duration and ETA.
+    """
+    eta = datetime.now() + timedelta(seconds=seconds)
+    return f"{timedelta(seconds=round(seconds))} (ETA {eta.strftime('%H:%M:%S')})"
+
+
 async def main(dryrun=False):
-    global sid, config
+    global config
     # Connect to engine and collect list of applications
-    async with set_connection(**props) as websocket:
-        msg = await websocket.recv()
-        logging.debug(f"< {msg}")
+    async with open_session(**props) as session:
         # Get Doclist with all applications
-        doclist = await get_doclist(websocket, sid := sid+1)
+        doclist = await get_doclist(session)
     # Convert doclist into dictionary with key title and value ID of the document.
     application = {}
     duplicates = []
@@ -30,56 +229,57 @@ async def main(dryrun=False):
     reload_group = config['Reload']["apps"]
     reload_list = reload_group.split(",")
     reload_list = [app.strip() for app in reload_list]
-    for app in reload_list:
-        logging.info(f"App {app} reload started.")
+    concurrency = max(args.concurrency or int(config['Reload'].get('concurrency', '1')), 1)
+    modes = {app: get_reload_mode(app) for app in reload_list}
+    durations, unknown = get_expected_durations(reload_list, modes)
+    if concurrency > 1:
+        # Longest reloads first, apps without history before all others as their duration is unknown.
+        priority = {app: -float('inf') if app in unknown else -durations[app] for app in reload_list}
+    else:
+        priority = None
+    start = time.monotonic()
+
+    async def reload_scheduled(app):
         try:
             doc_id = application[app]
         except KeyError:
             logging.fatal(f"App {app} not found in Qlik")
-            break
+            return False
         if app in duplicates:
             logging.warning(f"Duplicate entries found for app {app}, docId {doc_id} is used.")
-        async with set_connection(doc_id, **props) as websocket:
-            msg = await websocket.recv()
-            logging.debug(f"< {msg}")
-            # Open Application
-            app_handle = await open_app(websocket, sid := sid+1, doc_id)
-            if isinstance(app_handle, str):
-                # Error message found, app_handle needs to be int
-                logging.fatal(f"Cannot open app {app} for reload, exiting...")
-                break
-            if not dryrun:
-                # Configure Engine for Reload
-                msg = await configure_reload(websocket, sid := sid + 1)
-                logging.debug(f"< {msg}")
-                # Reload
-                request_id = sid
-                try:
-                    await asyncio.wait_for(do_reload(websocket, sid := sid+1, app_handle), timeout=60.0)
-                    progress = await get_progress(websocket, sid := sid+1, request_id)
-                    finished = progress['qProgressData']['qFinished']
-                except asyncio.TimeoutError:
-                    # Reload takes longer than allowed wait time
-                    finished = False
-                    while not finished:
-                        sleep = 60
-                        logging.info(f"Wait {sleep} seconds for App {app} reload.")
-                        await asyncio.sleep(sleep)
-                        progress = await get_progress(websocket, sid := sid+1, request_id)
-                        try:
-                            finished = progress['qProgressData']['qFinished']
-                        except KeyError:
-                            finished = False
-                if finished:
-                    logging.info(f"App {app} reload done, now commit change")
-                    # await get_app_layout(websocket, sid := sid+1, app_handle)
-                    await do_save(websocket, sid := sid+1, app_handle)
-                else:
-                    logging.fatal(f"Issue with reload of app {app}, exiting.")
-                    break
+        deadline = get_deadline(app, start)
+        if deadline is not None and deadline <= time.monotonic():
+            logging.error(f"App {app} not reloaded, global deadline reached.")
+            return False
+        return await reload_app(app, doc_id, dryrun, deadline, modes[app], get_reload_variables(app))
+
+    def reload_finished(app):
+        done = sum(1 for status in scheduler.status.values() if status in ('ok', 'failed', 'skipped'))
+        if done < len(reload_list):
+            logging.info(f"{done}/{len(reload_list)} apps done, remaining "
+                         f"{format_eta(scheduler.estimate_remaining(durations))}")
+
+    dependencies = get_dependencies(config, reload_list)
+    scheduler = ReloadScheduler(reload_list, dependencies, reload_scheduled, concurrency=concurrency,
+                                priority=priority, on_finished=reload_finished)
+    if unknown:
+        logging.info(f"No reload history for apps {', '.join(unknown)}, estimate {durations[unknown[0]]:.1f} seconds.")
+    logging.info(f"Reload {len(reload_list)} apps, estimated duration "
+                 f"{format_eta(scheduler.estimate_remaining(durations))}")
+    status = await scheduler.run()
+    for app in reload_list:
+        logging.info(f"App {app}: {status[app]}{' (slow)' if app in slow_apps else ''}")
+    logging.info(f"Batch done in {timedelta(seconds=round(time.monotonic() - start))}")
+    if slow_apps:
+        logging.warning(f"Apps much slower than usual: {', '.join(slow_apps)}")
+    history.close()
+    metrics.dump(props['statedir'])
+    logging.info(f"Engine API time per method: {metrics.summary()}")
     logging.info("End Application")
 
 
+reload_modes = ['full', 'partial', 'partial_if_recent_full']
+
 # Initialize Environment
 projectname = "qlik"
 config = my_env.init_env(projectname, __file__)
@@ -89,10 +289,17 @@ parser.add_argument('-t', '--target', type=str, default='Local', choices=['Local
                     help='Please provide the target environment (Local, Remote).')
 parser.add_argument('-d', '--dryrun', action='store_true',
                     help="If set then Dry Run - test on existence of app on engine only but do not reload.")
+parser.add_argument('-c', '--concurrency', type=int,
+                    help='Maximum number of reloads at the same time. Default is concurrency in section Reload of the '
+                         'ini file, or 1.')
+parser.add_argument('-m', '--mode', type=str, choices=reload_modes,
+                    help='Reload mode for all applications. Default is the mode per application in section ReloadModes '
+                         'of the ini file, or mode in section Reload, or full.')
 args = parser.parse_args()
 logging.info("Arguments: {a}".format(a=args))
 props = init_env(args.target)
 workdir = props['workdir']
-sid = 0
+history = ReloadHistory(os.path.join(props['statedir'], 'reload_history.db'))
+slow_apps = []
 
 asyncio.run(main(args.dryrun))
@@ -0,0 +1,64 @@
+#!/opt/envs/qlik/bin/python
+""""
+The purpose of this script is to run a local Qlik Sense Engine simulator with synthetic applications. Set LOCAL_URI to
+ws://<host>:<port>/app/ and use target Local to run qlik_explore or qlik_reload against the simulator.
+"""
+
+import argparse
+import asyncio
+import logging
+from lib import my_env
+from lib.engine_simulator import SiteModel, EngineSimulator
+
+
+async def main():
+    site = SiteModel(streams=args.streams, apps=args.apps, sheets=args.sheets, children=args.children,
+                     dimensions=args.dimensions, measures=args.measures, variables=args.variables,
+                     payload=args.payload, seed=args.seed)
+    simulator = EngineSimulator(site, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                error_rate=args.error_rate, reload_time=args.reload_time,
+                                partial_reload_time=args.partial_reload_time, volatile=args.volatile,
+                                seed=args.seed, hang_rate=args.hang_rate)
+    server = await simulator.serve(args.host, args.port)
+    print(f"Serving {args.apps} apps on ws://{args.host}:{args.port}/app/ - Ctrl-C to stop.")
+    try:
+        await asyncio.Future()
+    finally:
+        server.close()
+        logging.info(f"Simulator statistics: {simulator.stats}")
+        logging.info("End Application")
+
+
+# Initialize Environment
+projectname = "qlik"
+config = my_env.init_env(projectname, __file__)
+# Configure command line arguments and environment
+parser = argparse.ArgumentParser(description="Run a local Qlik Sense Engine simulator")
+parser.add_argument('--host', type=str, default='localhost', help='Host to listen on.')
+parser.add_argument('--port', type=int, default=4848, help='Port to listen on.')
+parser.add_argument('--streams', type=int, default=2, help='Number of streams.')
+parser.add_argument('--apps', type=int, default=10, help='Number of applications.')
+parser.add_argument('--sheets', type=int, default=3, help='Number of sheets per application.')
+parser.add_argument('--children', type=int, default=5, help='Number of child objects per sheet.')
+parser.add_argument('--dimensions', type=int, default=5, help='Number of master dimensions per application.')
+parser.add_argument('--measures', type=int, default=5, help='Number of master measures per application.')
+parser.add_argument('--variables', type=int, default=5, help='Number of variables per application.')
+parser.add_argument('--payload', type=int, default=0, help='Padding bytes in the property tree of every child.')
+parser.add_argument('--latency', type=float, default=0.0, help='Response latency in milliseconds.')
+parser.add_argument('--jitter', type=float, default=0.0, help='Random extra latency in milliseconds.')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail (0 - 1).')
+parser.add_argument('--hang-rate', type=float, default=0.0,
+                    help='Fraction of requests that get no reply until they are cancelled (0 - 1).')
+parser.add_argument('--reload-time', type=float, default=1.0, help='Duration of an application reload in seconds.')
+parser.add_argument('--partial-reload-time', type=float,
+                    help='Duration of a partial reload in seconds, default a quarter of the reload time.')
+parser.add_argument('--volatile', action='store_true',
+                    help='Sheet layouts have runtime content that changes on every request.')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the generated site, latency jitter and errors.')
+args = parser.parse_args()
+logging.info("Arguments: {a}".format(a=args))
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    pass
@@ -9,12 +9,9 @@ from pprint import pprint
 
 
 async def main():
-    global sid
     # Connect to engine and collect list of applications
-    async with set_connection(**props) as websocket:
-        msg = await websocket.recv()
-        logging.debug(f"< {msg}")
-        doclist_all = await get_doclist(websocket, sid := sid + 1)
+    async with open_session(**props) as session:
+        doclist_all = await get_doclist(session)
     pprint(doclist_all)
     # for doc in doclist_all:
     #     print(f"{doc['qDocName']} - {doc['qMeta']['createdDate']} {doc['qMeta']['privileges']}")
@@ -33,6 +30,4 @@ args = parser.parse_args()
 logging.info("Arguments: {a}".format(a=args))
 props = init_env(args.target)
 
-sid = 0
-
 asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Engine simulator and script runner for the tests. The simulator serves on a free port in a thread with its own event
+loop, the scripts run as a separate process with the target Local on the simulator.
+"""
+
+import asyncio
+import os
+import platform
+import subprocess
+import sys
+import threading
+from lib.engine_simulator import EngineSimulator, SiteModel
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SimulatorThread:
+    """
+    This class runs the engine simulator in a thread. Use it as context manager.
+    """
+
+    def __init__(self, site=None, **kwargs):
+        """
+        Initialization of the simulator.
+
+        :param site: SiteModel to serve, default a SiteModel with default parameters.
+        :param kwargs: Parameters for the EngineSimulator, e.g. latency or hang_rate.
+        :return:
+        """
+        self.simulator = EngineSimulator(site or SiteModel(), **kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = None
+        return
+
+    def __enter__(self):
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(self.simulator.serve('localhost', 0), self.loop).result(10)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+        self.loop.close()
+        return False
+
+    @property
+    def uri(self):
+        return f"ws://localhost:{self.server.sockets[0].getsockname()[1]}/app/"
+
+
+def get_command(script, args, tmpdir, uri, workdir, statedir, ini='', loglevel='info'):
+    """
+    Return the command and the environment to run a script of the package with target Local.
+
+    :param script: Script name, e.g. qlik_explore.py.
+    :param args: List with the command line arguments, besides the target.
+    :param tmpdir: Directory for the log file and the ini file.
+    :param uri: URI of the engine simulator.
+    :param workdir: Work directory of the snapshot.
+    :param statedir: State directory.
+    :param ini: Content of the ini file.
+    :param loglevel: Log level of the script.
+    :return: Tuple (command, environment)
+    """
+    inifile = os.path.join(tmpdir, 'test.ini')
+    with open(inifile, 'w', encoding='utf-8') as fh:
+        fh.write(ini)
+    env = dict(os.environ, LOGDIR=tmpdir, LOGLEVEL=loglevel, LOCAL_URI=uri, LOCAL_WORKDIR=workdir,
+               LOCAL_STATEDIR=statedir, INIFILE=inifile)
+    return [sys.executable, os.path.join(package_dir, script), '-t', 'Local'] + list(args), env
+
+
+def run_script(script, args, tmpdir, uri, workdir, statedir, ini='', loglevel='info', check=True, timeout=120):
+    """
+    Run a script of the package with target Local. The parameters are the parameters of get_command.
+
+    :param check: If set then a non-zero exit code raises CalledProcessError.
+    :param timeout: Timeout in seconds for the script.
+    :return: CompletedProcess
+    """
+    command, env = get_command(script, args, tmpdir, uri, workdir, statedir, ini, loglevel)
+    return subprocess.run(command, env=env, check=check, timeout=timeout, capture_output=True, text=True)
+
+
+def start_script(script, args, tmpdir, uri, workdir, statedir, ini='', loglevel='info'):
+    """
+    Start a script of the package with target Local, e.g. to interrupt the run. The parameters are the parameters of
+    get_command.
+
+    :return: Popen
+    """
+    command, env = get_command(script, args, tmpdir, uri, workdir, statedir, ini, loglevel)
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def read_log(tmpdir, script):
+    """
+    Return the log of the script, the log file name has the module name and the host name.
+
+    :param tmpdir: Log directory.
+    :param script: Script name without extension, e.g. qlik_explore.
+    :return: Text of the log file.
+    """
+    with open(os.path.join(tmpdir, f"{script}_{platform.node()}.log"), encoding='utf-8') as fh:
+        return fh.read()
@@ -0,0 +1,106 @@
+"""
+Tests for git_processing. The script runs as a separate process on a temporary snapshot repository, with the changes
+report of qlik_explore in the state directory.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import git
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'git_processing.py')
+
+
+class GitProcessingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = os.path.join(self.tmp.name, 'work')
+        self.statedir = os.path.join(self.tmp.name, 'state')
+        os.makedirs(os.path.join(self.workdir, 'Work', 'App'))
+        os.makedirs(self.statedir)
+        self.repo = git.Repo.init(self.workdir)
+        with self.repo.config_writer() as cw:
+            cw.set_value('user', 'name', 'test')
+            cw.set_value('user', 'email', 'test@example.com')
+        return
+
+    def tearDown(self):
+        self.repo.close()
+        self.tmp.cleanup()
+        return
+
+    def write(self, path, content):
+        with open(os.path.join(self.workdir, path), 'w', encoding='utf-8') as fh:
+            fh.write(content)
+        return
+
+    def run_script(self, report):
+        if report is not None:
+            with open(os.path.join(self.statedir, 'changes.json'), 'w', encoding='utf-8') as fh:
+                json.dump(report, fh)
+        env = dict(os.environ, LOGDIR=self.tmp.name, LOGLEVEL='info', LOCAL_WORKDIR=self.workdir,
+                   LOCAL_STATEDIR=self.statedir, INIFILE=os.path.join(self.tmp.name, 'none.ini'))
+        subprocess.run([sys.executable, script, '-t', 'Local'], env=env, check=True)
+        return
+
+    def head_files(self):
+        return sorted(blob.path for blob in self.repo.head.commit.tree.traverse() if blob.type == 'blob')
+
+    def test_glob_characters_are_literal(self):
+        # A title with glob characters must not match other files of the snapshot.
+        names = ['KPI*.json', 'KPI total.json', 'KPI x.json', 'KPI [x].json', 'KPI?.json']
+        for name in names:
+            self.write(os.path.join('Work', 'App', name), name)
+        self.repo.index.add([os.path.join('Work', 'App', name) for name in names])
+        self.repo.index.commit('initial')
+        os.remove(os.path.join(self.workdir, 'Work', 'App', 'KPI*.json'))
+        self.write(os.path.join('Work', 'App', 'KPI?.json'), 'changed')
+        self.write(os.path.join('Work', 'App', 'KPI [x].json'), 'changed')
+        self.run_script(dict(added=[], modified=[os.path.join('Work', 'App', 'KPI?.json')],
+                             deleted=[os.path.join('Work', 'App', 'KPI*.json')], unchanged=3))
+        self.assertEqual(self.head_files(), sorted(f"Work/App/{name}" for name in names if name != 'KPI*.json'))
+        # Only the modified file is committed, not the file that matches the pattern.
+        self.assertEqual(self.repo.git.show('HEAD:Work/App/KPI?.json'), 'changed')
+        self.assertEqual(self.repo.git.show('HEAD:Work/App/KPI [x].json'), 'KPI [x].json')
+        return
+
+    def test_without_report_staging_excluded(self):
+        # An interrupted qlik_explore run left its staging directory, all other changes are committed.
+        self.write(os.path.join('Work', 'App', 'Sheet.json'), 'sheet')
+        os.makedirs(os.path.join(self.workdir, '.staging', 'run', 'app'))
+        self.write(os.path.join('.staging', 'run', 'app', 'Sheet.json'), 'half written')
+        self.run_script(None)
+        self.assertEqual(self.head_files(), ['Work/App/Sheet.json'])
+        return
+
+    def test_git_store_pushes_earlier_commit(self):
+        # The push after an earlier run failed, the run without changes writes commit null: the commit is pushed.
+        self.write('file.json', 'content')
+        self.repo.index.add(['file.json'])
+        commit = self.repo.index.commit('initial')
+        remote = git.Repo.init(os.path.join(self.tmp.name, 'remote.git'), bare=True)
+        self.repo.create_remote('origin', remote.working_dir)
+        self.run_script(dict(added=[], modified=[], deleted=[], unchanged=1, commit=None))
+        self.assertEqual(remote.commit(self.repo.active_branch.name).hexsha, commit.hexsha)
+        self.assertTrue(os.path.isfile(os.path.join(self.statedir, 'changes.committed.json')))
+        remote.close()
+        return
+
+    def test_git_store_push(self):
+        self.write('file.json', 'content')
+        self.repo.index.add(['file.json'])
+        commit = self.repo.index.commit('initial')
+        remote = git.Repo.init(os.path.join(self.tmp.name, 'remote.git'), bare=True)
+        self.repo.create_remote('origin', remote.working_dir)
+        self.run_script(dict(added=['file.json'], modified=[], deleted=[], unchanged=0, commit=commit.hexsha))
+        self.assertEqual(remote.commit(self.repo.active_branch.name).hexsha, commit.hexsha)
+        remote.close()
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
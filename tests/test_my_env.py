@@ -0,0 +1,186 @@
+"""
+Tests for the ChangeSet of the directory store: the clean up of the snapshot after a full run, the names claimed
+for objects with the same title and the staging of applications.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from lib import my_env
+from lib.engine_simulator import SiteModel
+from simulator import SimulatorThread, run_script
+
+
+class ChangeSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = self.tmp.name
+        self.changes = my_env.ChangeSet(self.workdir)
+        return
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        return
+
+    def path(self, *parts):
+        return os.path.join(self.workdir, *parts)
+
+    def create(self, *parts):
+        os.makedirs(os.path.dirname(self.path(*parts)), exist_ok=True)
+        with open(self.path(*parts), 'w', encoding='utf-8') as fh:
+            fh.write('/'.join(parts))
+        return
+
+    def test_sweep_snapshot_keeps_repository_files(self):
+        for parts in [('README.md',), ('.gitignore',), ('.git', 'HEAD'), ('.github', 'workflows', 'ci.yml'),
+                      ('Work', 'App', 'Sheet.json'), ('Work', 'App', 'Old sheet.json'),
+                      ('Deleted stream', 'App', 'Sheet.json')]:
+            self.create(*parts)
+        self.changes.write(self.path('Work', 'App', 'Sheet.json'), b'Work/App/Sheet.json')
+        self.changes.sweep_snapshot()
+        for parts in [('README.md',), ('.gitignore',), ('.git', 'HEAD'), ('.github', 'workflows', 'ci.yml'),
+                      ('Work', 'App', 'Sheet.json')]:
+            self.assertTrue(os.path.isfile(self.path(*parts)), os.path.join(*parts))
+        self.assertFalse(os.path.exists(self.path('Work', 'App', 'Old sheet.json')))
+        self.assertFalse(os.path.exists(self.path('Deleted stream')))
+        report = self.changes.report()
+        self.assertEqual(report['deleted'], [os.path.join('Deleted stream', 'App', 'Sheet.json'),
+                                             os.path.join('Work', 'App', 'Old sheet.json')])
+        self.assertEqual(report['unchanged'], 1)
+        return
+
+    def read(self, *parts):
+        with open(self.path(*parts), encoding='utf-8') as fh:
+            return fh.read()
+
+    def stage_app(self):
+        # Application with two files, the sheet is changed in the staging directory.
+        self.create('Work', 'App', 'Sheet.json')
+        self.create('Work', 'App', 'Chart.json')
+        self.changes.init_staging('explore')
+        app_path = self.path('Work', 'App')
+        self.changes.stage(app_path)
+        self.changes.write(self.path('Work', 'App', 'Sheet.json'), b'new sheet')
+        self.changes.write(self.path('Work', 'App', 'Chart.json'), b'Work/App/Chart.json')
+        self.assertEqual(self.read('Work', 'App', 'Sheet.json'), 'Work/App/Sheet.json')
+        return app_path
+
+    def test_stage_commit(self):
+        app_path = self.stage_app()
+        inode = os.stat(self.path('Work', 'App', 'Chart.json')).st_ino
+        files = self.changes.commit(app_path)
+        self.assertEqual(sorted(files), [self.path('Work', 'App', 'Chart.json'),
+                                         self.path('Work', 'App', 'Sheet.json')])
+        self.assertEqual(self.read('Work', 'App', 'Sheet.json'), 'new sheet')
+        # The unchanged file is a hard link to the file of the last snapshot.
+        self.assertEqual(os.stat(self.path('Work', 'App', 'Chart.json')).st_ino, inode)
+        self.changes.close_staging()
+        self.assertEqual(os.listdir(self.workdir), ['Work'])
+        return
+
+    def test_discard(self):
+        app_path = self.stage_app()
+        self.changes.discard(app_path)
+        self.assertEqual(self.read('Work', 'App', 'Sheet.json'), 'Work/App/Sheet.json')
+        self.assertEqual(self.changes.files[self.path('Work', 'App', 'Sheet.json')], ('unchanged', None))
+        self.assertEqual(os.listdir(self.changes.staging_root), [])
+        return
+
+    def interrupt_swap(self, app_path, move_app):
+        # Steps of commit until the process is killed.
+        stage_dir = self.changes.staging[app_path]
+        with open(f"{stage_dir}.swap", 'w', encoding='utf-8') as fh:
+            json.dump(dict(path=app_path, stage=stage_dir, old=f"{stage_dir}.old"), fh)
+        if move_app:
+            os.rename(app_path, f"{stage_dir}.old")
+        # The next run has a new ChangeSet.
+        my_env.ChangeSet(self.workdir).init_staging('explore')
+        return
+
+    def test_interrupted_swap(self):
+        self.interrupt_swap(self.stage_app(), move_app=True)
+        self.assertEqual(self.read('Work', 'App', 'Sheet.json'), 'new sheet')
+        self.assertEqual(self.read('Work', 'App', 'Chart.json'), 'Work/App/Chart.json')
+        self.assertEqual(os.listdir(self.changes.staging_root), [])
+        return
+
+    def test_swap_interrupted_before_move(self):
+        self.interrupt_swap(self.stage_app(), move_app=False)
+        self.assertEqual(self.read('Work', 'App', 'Sheet.json'), 'Work/App/Sheet.json')
+        self.assertEqual(os.listdir(self.changes.staging_root), [])
+        return
+
+    def test_claim(self):
+        path = self.path('Work', 'Sales')
+        self.assertEqual(self.changes.claim(path, 'app1'), path)
+        # The same object can claim the path again.
+        self.assertEqual(self.changes.claim(path, 'app1'), path)
+        # Names are compared case-insensitive.
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.changes.claim(self.path('Work', 'SALES'), 'app2'), self.path('Work', 'SALES (app2)'))
+        self.assertEqual(self.changes.claim(self.path('Work', 'SALES'), 'app2'), self.path('Work', 'SALES (app2)'))
+        # The owner is added before the extension.
+        filepath = self.path('Work', 'Sales', 'Chart.json')
+        self.assertEqual(self.changes.claim(filepath, 'id1', ext='.json'), filepath)
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.changes.claim(filepath, 'id/2', ext='.json'),
+                             self.path('Work', 'Sales', 'Chart (id2).json'))
+        return
+
+    def test_get_valid_path(self):
+        self.assertEqual(my_env.get_valid_path(self.workdir, 'Sheet', self.changes, 'sheet1'), self.path('Sheet'))
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(my_env.get_valid_path(self.workdir, 'sheet', self.changes, 'sheet2'),
+                             self.path('sheet (sheet2)'))
+        # Without owner the path is not claimed.
+        self.assertEqual(my_env.get_valid_path(self.workdir, 'SHEET', self.changes), self.path('SHEET'))
+        return
+
+
+class ExploreCollisionTest(unittest.TestCase):
+
+    def get_site(self):
+        # Two applications, two sheets and two charts on a sheet with the same name.
+        site = SiteModel(streams=0, apps=2, sheets=2, children=2)
+        self.doc_ids = list(site.docs)
+        for doc_id, title in zip(self.doc_ids, ['Sales', 'SALES']):
+            site.docs[doc_id]['qTitle'] = title
+        app = site.app(self.doc_ids[0])
+        self.sheet_ids = app.sheet_ids
+        for sheet_id in self.sheet_ids:
+            app.objects[sheet_id]['properties']['qMetaDef']['title'] = 'Sheet'
+        self.child_ids = app.objects[self.sheet_ids[0]]['children']
+        for child_id in self.child_ids:
+            child = app.objects[child_id]
+            child['qType'] = child['properties']['qInfo']['qType'] = child['properties']['visualization'] = 'table'
+            child['properties']['title'] = 'Chart'
+        return site
+
+    def test_same_names(self):
+        with tempfile.TemporaryDirectory() as tmpdir, SimulatorThread(self.get_site()) as simulator:
+            workdir = os.path.join(tmpdir, 'work')
+            statedir = os.path.join(tmpdir, 'state')
+            os.makedirs(workdir)
+            run_script('qlik_explore.py', [], tmpdir, simulator.uri, workdir, statedir)
+            stream_dir = os.path.join(workdir, 'Work')
+            apps = sorted(os.listdir(stream_dir))
+            app_dir = os.path.join(stream_dir, 'Sales')
+            sheets = sorted(os.listdir(app_dir))
+            charts = sorted(os.listdir(os.path.join(app_dir, 'Sheet', 'table')))
+            # The names are the same in the next run.
+            os.replace(os.path.join(statedir, 'changes.json'), os.path.join(statedir, 'changes.committed.json'))
+            run_script('qlik_explore.py', [], tmpdir, simulator.uri, workdir, statedir)
+            with open(os.path.join(statedir, 'changes.json'), encoding='utf-8') as fh:
+                report = json.load(fh)
+        self.assertEqual(apps, [f"SALES ({self.doc_ids[1]})", 'Sales'])
+        self.assertIn(f"Sheet ({self.sheet_ids[1]})", sheets)
+        self.assertIn('Sheet', sheets)
+        self.assertEqual(charts, [f"Chart ({self.child_ids[1]}).json", 'Chart.json'])
+        self.assertEqual((report['added'], report['modified'], report['deleted']), ([], [], []))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
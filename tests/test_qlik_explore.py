@@ -0,0 +1,89 @@
+"""
+Tests for the collection of sheets and sheet children by qlik_explore against the engine simulator: the files that are
+written and the requests that are needed for an application.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from lib.engine_simulator import SiteModel
+from simulator import SimulatorThread, run_script
+
+
+class HandleSheetsTest(unittest.TestCase):
+
+    sheets = 2
+    children = 5
+
+    def setUp(self):
+        self.site = SiteModel(streams=0, apps=1, sheets=self.sheets, children=self.children)
+        self.app = self.site.app(list(self.site.docs)[0])
+        return
+
+    def explore(self):
+        with tempfile.TemporaryDirectory() as tmpdir, SimulatorThread(self.site) as simulator:
+            workdir = os.path.join(tmpdir, 'work')
+            os.makedirs(workdir)
+            run_script('qlik_explore.py', [], tmpdir, simulator.uri, workdir, os.path.join(tmpdir, 'state'))
+            app_path = os.path.join(workdir, 'Work', self.app.doc['qTitle'])
+            files = {}
+            for dirpath, _, filenames in os.walk(app_path):
+                for fn in filenames:
+                    if fn.endswith('.json'):
+                        with open(os.path.join(dirpath, fn), encoding='utf-8') as fh:
+                            files[os.path.relpath(os.path.join(dirpath, fn), app_path)] = json.load(fh)
+        return files, simulator.simulator.stats['methods']
+
+    def get_child_file(self, sheet_id, child_id):
+        sheet = self.app.objects[sheet_id]['properties']['qMetaDef']['title']
+        child = self.app.objects[child_id]
+        return os.path.join(sheet, child['qType'], f"{child['properties']['title'] or child_id}.json")
+
+    def assert_sheets(self, files):
+        for sheet_id in self.app.sheet_ids:
+            sheet = self.app.objects[sheet_id]['properties']['qMetaDef']['title']
+            self.assertEqual(files[os.path.join(sheet, f"{sheet}.json")], self.app.layout(sheet_id))
+            for child_id in self.app.objects[sheet_id]['children']:
+                self.assertEqual(files[self.get_child_file(sheet_id, child_id)],
+                                 self.app.full_property_tree(child_id))
+        return
+
+    def test_sheets(self):
+        files, methods = self.explore()
+        self.assert_sheets(files)
+        sheet_files = [path for path in files if os.path.dirname(path).startswith('Sheet ')]
+        self.assertEqual(len(sheet_files), self.sheets * (1 + self.children))
+        # All objects are enumerated once, every child property tree is requested once.
+        self.assertEqual(methods['GetAllInfos'], 1)
+        self.assertEqual(methods['GetObject'], self.sheets + self.sheets * self.children)
+        self.assertEqual(methods['GetFullPropertyTree'], self.sheets * self.children)
+        return
+
+    def test_child_not_in_all_infos(self):
+        hidden_id = self.app.objects[self.app.sheet_ids[0]]['children'][0]
+        all_infos = self.app.all_infos
+        self.app.all_infos = lambda: [info for info in all_infos() if info['qId'] != hidden_id]
+        # An object that is not on a sheet is collected, but not written.
+        self.app.add('orphan', 'barchart', dict(qInfo=dict(qId='orphan', qType='barchart'), visualization='barchart',
+                                                title='Orphan'))
+        files, methods = self.explore()
+        self.assert_sheets(files)
+        self.assertNotIn('Orphan.json', [os.path.basename(path) for path in files])
+        self.assertEqual(methods['GetFullPropertyTree'], self.sheets * self.children + 1)
+        return
+
+    def test_child_on_two_sheets(self):
+        shared_id = self.app.objects[self.app.sheet_ids[0]]['children'][0]
+        self.app.objects[self.app.sheet_ids[1]]['children'].append(shared_id)
+        files, methods = self.explore()
+        self.assert_sheets(files)
+        self.assertEqual(files[self.get_child_file(self.app.sheet_ids[1], shared_id)],
+                         self.app.full_property_tree(shared_id))
+        # The child is requested once and written for both sheets.
+        self.assertEqual(methods['GetFullPropertyTree'], self.sheets * self.children)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
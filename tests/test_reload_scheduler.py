@@ -0,0 +1,150 @@
+"""
+Tests for the reload scheduler: dependency order, priority, the concurrency limit and the apps that are skipped when
+a parent fails. The last test runs qlik_reload against the engine simulator.
+"""
+
+import asyncio
+import configparser
+import os
+import sqlite3
+import tempfile
+import unittest
+from lib.engine_simulator import SiteModel
+from lib.reload_scheduler import ReloadScheduler, estimate_duration, get_dependencies
+from simulator import SimulatorThread, read_log, run_script
+
+
+class FakeReload:
+    """
+    Reload coroutine function that records the start and end order of the apps. Apps in fail return False, apps in
+    error raise an exception.
+    """
+
+    def __init__(self, fail=(), error=(), duration=0.01):
+        self.fail = set(fail)
+        self.error = set(error)
+        self.duration = duration
+        self.events = []
+        self.active = 0
+        self.max_active = 0
+        return
+
+    async def __call__(self, app):
+        self.events.append(('start', app))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.duration)
+        self.active -= 1
+        self.events.append(('end', app))
+        if app in self.error:
+            raise RuntimeError(f"Reload of {app} failed")
+        return app not in self.fail
+
+    def started(self):
+        return [app for event, app in self.events if event == 'start']
+
+    def position(self, event, app):
+        return self.events.index((event, app))
+
+
+class ReloadSchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_dependency_order(self):
+        apps = ['dashboard', 'transform', 'extract 1', 'extract 2']
+        dependencies = dict(dashboard={'transform'}, transform={'extract 1', 'extract 2'})
+        reload = FakeReload()
+        status = await ReloadScheduler(apps, dependencies, reload, concurrency=4).run()
+        self.assertEqual(set(status.values()), {'ok'})
+        self.assertEqual(reload.started()[:2], ['extract 1', 'extract 2'])
+        for child, parent in [('transform', 'extract 1'), ('transform', 'extract 2'), ('dashboard', 'transform')]:
+            self.assertGreater(reload.position('start', child), reload.position('end', parent))
+        return
+
+    async def test_priority(self):
+        apps = ['a', 'b', 'c', 'd']
+        reload = FakeReload()
+        await ReloadScheduler(apps, {}, reload, priority=dict(a=3, b=1, c=0, d=2)).run()
+        self.assertEqual(reload.started(), ['c', 'b', 'd', 'a'])
+        # Default priority is the order of the reload list.
+        reload = FakeReload()
+        await ReloadScheduler(apps, {}, reload).run()
+        self.assertEqual(reload.started(), apps)
+        return
+
+    async def test_concurrency(self):
+        apps = [f"app {i}" for i in range(10)]
+        reload = FakeReload()
+        status = await ReloadScheduler(apps, {}, reload, concurrency=3).run()
+        self.assertEqual(reload.max_active, 3)
+        self.assertEqual(len(status), 10)
+        return
+
+    async def test_failure_skips_dependents(self):
+        apps = ['extract', 'transform', 'dashboard', 'other', 'other dashboard']
+        dependencies = dict(transform={'extract'}, dashboard={'transform'}, **{'other dashboard': {'other'}})
+        reload = FakeReload(fail=['extract'], error=['other'])
+        finished = []
+        status = await ReloadScheduler(apps, dependencies, reload, concurrency=2, on_finished=finished.append).run()
+        self.assertEqual(status, dict(extract='failed', transform='skipped', dashboard='skipped', other='failed',
+                                      **{'other dashboard': 'skipped'}))
+        self.assertEqual(sorted(reload.started()), ['extract', 'other'])
+        self.assertEqual(sorted(finished), ['extract', 'other'])
+        return
+
+    async def test_failure_keeps_independent_apps(self):
+        apps = ['extract', 'transform', 'independent']
+        reload = FakeReload(fail=['extract'])
+        status = await ReloadScheduler(apps, dict(transform={'extract'}), reload).run()
+        self.assertEqual(status, dict(extract='failed', transform='skipped', independent='ok'))
+        return
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError):
+            ReloadScheduler(['a', 'b', 'c'], dict(a={'c'}, b={'a'}, c={'b'}), FakeReload())
+        return
+
+    def test_get_dependencies(self):
+        config = configparser.ConfigParser()
+        config.read_string("[ReloadDependencies]\nTransform = Extract 1, extract 2, Missing\nUnknown = Extract 1\n")
+        dependencies = get_dependencies(config, ['Extract 1', 'Extract 2', 'Transform'])
+        self.assertEqual(dependencies, {'Extract 1': set(), 'Extract 2': set(),
+                                        'Transform': {'Extract 1', 'Extract 2'}})
+        self.assertEqual(get_dependencies(configparser.ConfigParser(), ['a']), dict(a=set()))
+        return
+
+    def test_estimate_duration(self):
+        apps = ['extract 1', 'extract 2', 'transform']
+        dependencies = dict(transform={'extract 1', 'extract 2'})
+        durations = {'extract 1': 10, 'extract 2': 30, 'transform': 5}
+        self.assertEqual(estimate_duration(apps, dependencies, durations, concurrency=1), 45)
+        self.assertEqual(estimate_duration(apps, dependencies, durations, concurrency=2), 35)
+        # extract 2 is reloading, 20 seconds to go.
+        self.assertEqual(estimate_duration(['extract 1', 'transform'], dependencies, durations, concurrency=2,
+                                           running={'extract 2': 20}), 25)
+        return
+
+
+class QlikReloadTest(unittest.TestCase):
+
+    def test_reload_on_simulator(self):
+        ini = ("[Reload]\napps = App 0000, App 0001, App 0002, Missing, App 0003, App 0004\nconcurrency = 3\n"
+               "[ReloadDependencies]\nApp 0002 = App 0000, App 0001\nApp 0003 = Missing\nApp 0004 = App 0003\n")
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                SimulatorThread(SiteModel(apps=5), reload_time=0.2) as simulator:
+            statedir = os.path.join(tmpdir, 'state')
+            res = run_script('qlik_reload.py', [], tmpdir, simulator.uri, tmpdir, statedir, ini=ini, check=False)
+            self.assertEqual(res.returncode, 0, res.stderr)
+            conn = sqlite3.connect(os.path.join(statedir, 'reload_history.db'))
+            rows = conn.execute("SELECT app, status FROM reloads ORDER BY app").fetchall()
+            conn.close()
+            log = read_log(tmpdir, 'qlik_reload')
+        self.assertEqual(rows, [('App 0000', 'ok'), ('App 0001', 'ok'), ('App 0002', 'ok')])
+        self.assertIn("Reload of app App 0004 cancelled, parent app App 0003 did not reload.", log)
+        # App 0002 starts after both parents have been reloaded.
+        self.assertGreater(log.index("App App 0002 full reload started."),
+                           max(log.index("App App 0000 reload done"), log.index("App App 0001 reload done")))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Tests for the engine session: request deadlines and CancelRequest against the engine simulator, and replies that
+cannot be handled by the reader task.
+"""
+
+import asyncio
+import configparser
+import json
+import unittest
+from lib.engine_simulator import EngineSimulator, SiteModel
+from lib.sense_engine_api import EngineSession, EngineTimeout, get_deadlines, open_session
+
+
+class ReplyWebsocket:
+    """
+    Websocket that answers every request with the text returned by reply.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.messages = asyncio.Queue()
+        self.messages.put_nowait(json.dumps(dict(jsonrpc='2.0', method='OnConnected', params={})))
+        return
+
+    async def send(self, request_str):
+        self.messages.put_nowait(self.reply(json.loads(request_str)))
+        return
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.messages.get()
+
+
+class ReaderErrorTest(unittest.IsolatedAsyncioTestCase):
+
+    async def call_with_reply(self, reply):
+        async with EngineSession(ReplyWebsocket(reply)) as session:
+            await session.connected.wait()
+            # Without deadline the request would wait forever if the reader stopped without failing it.
+            with self.assertRaises(Exception) as cm:
+                await asyncio.wait_for(session.call('GetDocList'), 5)
+            self.assertNotIsInstance(cm.exception, asyncio.TimeoutError)
+            with self.assertRaises(type(cm.exception)):
+                await session.submit('GetDocList')
+        return cm.exception
+
+    async def test_invalid_json(self):
+        exc = await self.call_with_reply(lambda request: 'not json')
+        self.assertIsInstance(exc, json.JSONDecodeError)
+        return
+
+    async def test_reply_not_an_object(self):
+        exc = await self.call_with_reply(lambda request: json.dumps([request['id']]))
+        self.assertIsInstance(exc, TypeError)
+        return
+
+
+class DeadlineTest(unittest.IsolatedAsyncioTestCase):
+
+    async def serve(self, hang_rate=0.0):
+        self.simulator = EngineSimulator(SiteModel(streams=1, apps=3), hang_rate=hang_rate)
+        server = await self.simulator.serve('localhost', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        return dict(target='Local', uri=f"ws://localhost:{port}/app/")
+
+    async def cancelled(self, count):
+        # The simulator handles CancelRequest in its own task.
+        for _ in range(100):
+            if self.simulator.stats['cancelled'] >= count:
+                break
+            await asyncio.sleep(0.01)
+        return self.simulator.stats['cancelled']
+
+    def test_get_deadlines(self):
+        config = configparser.ConfigParser()
+        config.read_string("[EngineDeadlines]\ndefault = 30\nGetFullPropertyTree = 120\nGetLayout =\n")
+        self.assertEqual(get_deadlines(config), dict(default=30.0, getfullpropertytree=120.0))
+        self.assertEqual(get_deadlines(configparser.ConfigParser()), {})
+        return
+
+    async def test_reply_within_deadline(self):
+        props = await self.serve()
+        async with open_session(deadlines=dict(default=5), **props) as session:
+            reply = await session.call('GetDocList')
+        self.assertEqual(len(reply['result']['qDocList']), 3)
+        self.assertEqual(self.simulator.stats['methods'].get('CancelRequest', 0), 0)
+        return
+
+    async def test_deadline_cancels_request(self):
+        props = await self.serve(hang_rate=1.0)
+        async with open_session(deadlines=dict(default=0.1), **props) as session:
+            with self.assertRaises(EngineTimeout) as cm:
+                await session.call('GetDocList')
+            self.assertEqual(await self.cancelled(1), 1)
+            self.assertEqual(session.pending, {})
+        self.assertEqual((cm.exception.method, cm.exception.app, cm.exception.timeout), ('GetDocList', 'global', 0.1))
+        self.assertIsInstance(cm.exception, asyncio.TimeoutError)
+        return
+
+    async def test_method_deadline(self):
+        props = await self.serve(hang_rate=1.0)
+        async with open_session(deadlines=dict(default=30, getdoclist=0.1), **props) as session:
+            with self.assertRaises(EngineTimeout) as cm:
+                await session.call('GetDocList')
+            self.assertEqual(cm.exception.timeout, 0.1)
+            # The timeout of the call overrides the deadlines of the session.
+            with self.assertRaises(EngineTimeout) as cm:
+                await session.call('GetAuthenticatedUser', timeout=0.05)
+            self.assertEqual(cm.exception.timeout, 0.05)
+            self.assertEqual(await self.cancelled(2), 2)
+        return
+
+    async def test_no_deadline(self):
+        props = await self.serve(hang_rate=1.0)
+        async with open_session(**props) as session:
+            with self.assertRaises(asyncio.TimeoutError) as cm:
+                await asyncio.wait_for(session.call('GetDocList'), 0.2)
+            self.assertNotIsInstance(cm.exception, EngineTimeout)
+        self.assertEqual(self.simulator.stats['methods'].get('CancelRequest', 0), 0)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
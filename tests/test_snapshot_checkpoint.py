@@ -0,0 +1,139 @@
+"""
+Tests for the checkpoint of a run, and qlik_explore against the engine simulator: a run that is killed continues with
+--resume and gives the same snapshot as a run that has not been interrupted.
+"""
+
+import filecmp
+import json
+import os
+import tempfile
+import time
+import unittest
+from lib.engine_simulator import SiteModel
+from lib.my_env import ChangeSet
+from lib.snapshot_checkpoint import Checkpoint
+from simulator import SimulatorThread, read_log, run_script, start_script
+
+settings = dict(incremental=False, shard=None, shard_by='docid')
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = os.path.join(self.tmp.name, 'work')
+        self.filename = os.path.join(self.tmp.name, 'state', 'checkpoint.jsonl')
+        return
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        return
+
+    def add_app(self, checkpoint, doc_id):
+        changes = ChangeSet(self.workdir)
+        filepath = os.path.join(self.workdir, 'Work', doc_id, 'Sheet.json')
+        changes.record(filepath, 'added', 'digest', 10)
+        checkpoint.add(doc_id, [filepath], changes)
+        return
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.filename, self.workdir, settings)
+        self.add_app(checkpoint, 'app1')
+        # The run is killed while the second application is written to the checkpoint.
+        with open(self.filename, 'a', encoding='utf-8') as fh:
+            fh.write('{"doc_id": "app2", "fil')
+        with self.assertLogs(level='WARNING'):
+            checkpoint = Checkpoint(self.filename, self.workdir, settings, resume=True)
+        self.assertTrue(checkpoint.is_done('app1'))
+        self.assertFalse(checkpoint.is_done('app2'))
+        changes = ChangeSet(self.workdir)
+        checkpoint.restore(changes)
+        filepath = os.path.join(self.workdir, 'Work', 'app1', 'Sheet.json')
+        self.assertEqual((changes.files[filepath], changes.sizes[filepath]), (('added', 'digest'), 10))
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.filename))
+        return
+
+    def test_resume_other_settings(self):
+        Checkpoint(self.filename, self.workdir, settings)
+        with self.assertRaises(ValueError):
+            Checkpoint(self.filename, self.workdir, dict(settings, incremental=True), resume=True)
+        return
+
+    def test_new_run(self):
+        self.add_app(Checkpoint(self.filename, self.workdir, settings), 'app1')
+        with self.assertLogs(level='WARNING'):
+            checkpoint = Checkpoint(self.filename, self.workdir, settings)
+        self.assertFalse(checkpoint.is_done('app1'))
+        # Resume without checkpoint starts a new run.
+        os.remove(self.filename)
+        self.assertEqual(Checkpoint(self.filename, self.workdir, settings, resume=True).apps, {})
+        return
+
+
+class ResumeExploreTest(unittest.TestCase):
+
+    apps = 6
+
+    def explore(self, tmpdir, name, args=()):
+        workdir = os.path.join(tmpdir, name)
+        statedir = os.path.join(tmpdir, f"{name}_state")
+        os.makedirs(workdir, exist_ok=True)
+        run_script('qlik_explore.py', args, tmpdir, self.uri, workdir, statedir)
+        return workdir, statedir
+
+    def interrupt(self, tmpdir, name):
+        # Kill the run when two applications are in the checkpoint.
+        workdir = os.path.join(tmpdir, name)
+        checkpoint = os.path.join(tmpdir, f"{name}_state", 'checkpoint.jsonl')
+        os.makedirs(workdir)
+        process = start_script('qlik_explore.py', [], tmpdir, self.uri, workdir, os.path.dirname(checkpoint))
+        try:
+            for _ in range(3000):
+                if os.path.isfile(checkpoint) and len(self.read_lines(checkpoint)) > 2:
+                    break
+                time.sleep(0.01)
+        finally:
+            process.kill()
+            process.wait()
+        # The first line has the settings of the run.
+        return len(self.read_lines(checkpoint)) - 1
+
+    @staticmethod
+    def get_files(workdir):
+        return sorted(os.path.relpath(os.path.join(dirpath, fn), workdir)
+                      for dirpath, _, filenames in os.walk(workdir) for fn in filenames)
+
+    @staticmethod
+    def read_lines(filename):
+        with open(filename, encoding='utf-8') as fh:
+            return [line for line in fh if line.endswith('\n')]
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                SimulatorThread(SiteModel(streams=0, apps=self.apps), latency=0.01) as simulator:
+            self.uri = simulator.uri
+            full, full_state = self.explore(tmpdir, 'full')
+            collected = self.interrupt(tmpdir, 'resumed')
+            self.assertLess(collected, self.apps)
+            start = len(read_log(tmpdir, 'qlik_explore'))
+            resumed, resumed_state = self.explore(tmpdir, 'resumed', ['--resume'])
+            log = read_log(tmpdir, 'qlik_explore')[start:]
+            files = [self.get_files(workdir) for workdir in [full, resumed]]
+            differ = [path for path in files[0] if not filecmp.cmp(os.path.join(full, path),
+                                                                   os.path.join(resumed, path), shallow=False)]
+            reports = []
+            for statedir in [full_state, resumed_state]:
+                with open(os.path.join(statedir, 'changes.json'), encoding='utf-8') as fh:
+                    reports.append(json.load(fh))
+            self.assertFalse(os.path.exists(os.path.join(resumed_state, 'checkpoint.jsonl')))
+        # Only the applications that are not in the checkpoint are collected again.
+        self.assertEqual(log.count('Collecting info for'), self.apps - collected)
+        self.assertEqual(files[1], files[0])
+        self.assertEqual(differ, [])
+        self.assertEqual(reports[1]['added'], reports[0]['added'])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
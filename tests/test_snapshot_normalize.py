@@ -0,0 +1,114 @@
+"""
+Tests for the normalization of layouts: the drop and sort rules, and qlik_explore against the engine simulator with
+sheet layouts that change on every request.
+"""
+
+import configparser
+import filecmp
+import json
+import os
+import tempfile
+import unittest
+from lib.engine_simulator import SiteModel
+from lib.snapshot_normalize import Normalizer, get_normalizer, get_rules
+from simulator import SimulatorThread, run_script
+
+
+def get_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+
+class NormalizerTest(unittest.TestCase):
+
+    def test_get_rules(self):
+        self.assertEqual(get_rules("/qSelectionInfo, qHyperCube.qSize\n tags,\n"),
+                         [('/', 'qSelectionInfo'), ('qHyperCube', 'qSize'), ('tags',)])
+        return
+
+    def test_anchored_rule(self):
+        normalize = Normalizer(drop=get_rules('/qSelectionInfo'))
+        layout = dict(qSelectionInfo=dict(qInSelections=True), qInfo=dict(qId='a'),
+                      child=dict(qSelectionInfo=dict(qInSelections=False)))
+        self.assertEqual(normalize(layout), dict(qInfo=dict(qId='a'), child=dict(qSelectionInfo=dict(
+            qInSelections=False))))
+        self.assertEqual(normalize.dropped, 1)
+        return
+
+    def test_path_rule(self):
+        normalize = Normalizer(drop=get_rules('qHyperCube.qDataPages'))
+        layout = dict(qHyperCube=dict(qDataPages=[1], qMode='S'), qDataPages=[2],
+                      qChildren=[dict(qHyperCube=dict(qDataPages=[3]))], other=dict(qDataPages=[4]))
+        self.assertEqual(normalize(layout), dict(qHyperCube=dict(qMode='S'), qDataPages=[2],
+                                                 qChildren=[dict(qHyperCube={})], other=dict(qDataPages=[4])))
+        self.assertEqual(normalize.dropped, 2)
+        return
+
+    def test_sort_rule(self):
+        normalize = Normalizer(sort=get_rules('tags, qChildList.qItems'))
+        layout = dict(qMeta=dict(tags=['b', 'a']), qChildList=dict(qItems=[dict(qId='y'), dict(qId='x')]),
+                      qDimensions=['b', 'a'])
+        self.assertEqual(normalize(layout), dict(qMeta=dict(tags=['a', 'b']),
+                                                 qChildList=dict(qItems=[dict(qId='x'), dict(qId='y')]),
+                                                 qDimensions=['b', 'a']))
+        return
+
+    def test_sort_keys(self):
+        layout = dict(b=1, a=dict(d=2, c=3))
+        self.assertEqual(list(Normalizer()(layout)), ['b', 'a'])
+        normalized = Normalizer(sort_keys=True)(layout)
+        self.assertEqual((list(normalized), list(normalized['a'])), (['a', 'b'], ['c', 'd']))
+        # The structure itself is not changed.
+        self.assertEqual(list(layout['a']), ['d', 'c'])
+        return
+
+    def test_get_normalizer(self):
+        self.assertIsNone(get_normalizer(get_config('')))
+        self.assertIsNone(get_normalizer(get_config("[Normalize]\nenabled = no\n")))
+        normalize = get_normalizer(get_config("[Normalize]\nenabled = yes\n"))
+        self.assertFalse(normalize.sort_keys)
+        self.assertIn(('/', 'qSelectionInfo'), normalize.drop['qSelectionInfo'])
+        normalize = get_normalizer(get_config("[Normalize]\nenabled = yes\ndrop = qStateName\nsort_keys = yes\n"))
+        self.assertEqual((normalize.drop, normalize.sort_keys), (dict(qStateName=[('qStateName',)]), True))
+        return
+
+
+class NormalizeExploreTest(unittest.TestCase):
+
+    def explore_twice(self, tmpdir, name, ini):
+        # Two runs, the changes of the first run have been committed.
+        workdir = os.path.join(tmpdir, name)
+        statedir = os.path.join(tmpdir, f"{name}_state")
+        os.makedirs(workdir)
+        run_script('qlik_explore.py', [], tmpdir, self.uri, workdir, statedir, ini=ini)
+        os.replace(os.path.join(statedir, 'changes.json'), os.path.join(statedir, 'changes.committed.json'))
+        run_script('qlik_explore.py', [], tmpdir, self.uri, workdir, statedir, ini=ini)
+        with open(os.path.join(statedir, 'changes.json'), encoding='utf-8') as fh:
+            return workdir, json.load(fh)
+
+    def test_volatile_layouts(self):
+        site = SiteModel(streams=1, apps=2, sheets=2, children=3)
+        with tempfile.TemporaryDirectory() as tmpdir, SimulatorThread(site, volatile=True) as simulator:
+            self.uri = simulator.uri
+            plain, report = self.explore_twice(tmpdir, 'plain', '')
+            sheet_layouts = sorted(report['modified'])
+            self.assertEqual(len(sheet_layouts), 4)
+            for path in sheet_layouts:
+                sheet = os.path.basename(os.path.dirname(path))
+                self.assertEqual(os.path.basename(path), f"{sheet}.json")
+            normalized, report = self.explore_twice(tmpdir, 'normalized', "[Normalize]\nenabled = yes\n")
+            self.assertEqual((report['added'], report['modified'], report['deleted']), ([], [], []))
+            # Only the sheet layouts are normalized.
+            differ = []
+            for dirpath, _, filenames in os.walk(plain):
+                for fn in filenames:
+                    path = os.path.relpath(os.path.join(dirpath, fn), plain)
+                    if not filecmp.cmp(os.path.join(plain, path), os.path.join(normalized, path), shallow=False):
+                        differ.append(path)
+        self.assertEqual(sorted(differ), sheet_layouts)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Tests for the git store of qlik_explore. git fast-import writes on the branch without updating the index and working
+tree, so the store must refuse a branch that is checked out in the repository.
+"""
+
+import os
+import tempfile
+import unittest
+import git
+from lib.snapshot_store import GitFastImportStore
+
+
+class GitFastImportStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.workdir = os.path.join(self.tmp.name, 'work')
+        self.repo = git.Repo.init(self.workdir, initial_branch='master')
+        with self.repo.config_writer() as cw:
+            cw.set_value('user', 'name', 'test')
+            cw.set_value('user', 'email', 'test@example.com')
+        with open(os.path.join(self.workdir, 'readme.md'), 'w', encoding='utf-8') as fh:
+            fh.write('snapshot')
+        self.repo.index.add(['readme.md'])
+        self.repo.index.commit('initial')
+        return
+
+    def tearDown(self):
+        self.repo.close()
+        self.tmp.cleanup()
+        return
+
+    def test_checked_out_branch(self):
+        with self.assertRaises(ValueError):
+            GitFastImportStore(self.workdir, self.workdir, 'master')
+        return
+
+    def test_branch_in_linked_worktree(self):
+        self.repo.git.worktree('add', '-b', 'site', os.path.join(self.tmp.name, 'site'))
+        with self.assertRaises(ValueError):
+            GitFastImportStore(self.workdir, self.workdir, 'site')
+        return
+
+    def test_other_branch(self):
+        store = GitFastImportStore(self.workdir, self.workdir, 'snapshot')
+        self.assertIsNone(store.parent)
+        return
+
+    def test_bare_repository(self):
+        gitdir = os.path.join(self.tmp.name, 'snapshot.git')
+        git.Repo.init(gitdir, bare=True, initial_branch='master').close()
+        store = GitFastImportStore(self.workdir, gitdir, 'master')
+        self.assertIsNone(store.parent)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()